@@ -0,0 +1,148 @@
+"""Семантический кэш ответов на повторяющиеся вопросы.
+
+Вопрос сравнивается с ранее отвеченными по косинусной близости
+L2-нормированных векторов (модель берётся из индекса базы знаний). Кэш используется
+только для вопросов без истории диалога: ответ на уточняющий вопрос
+зависит от контекста и повторно не подходит.
+"""
+import threading
+from collections import OrderedDict
+
+
+class CachedAnswer:
+    __slots__ = ("question", "answer", "vector", "interaction_ids")
+
+    def __init__(self, question, answer, vector, interaction_id):
+        self.question = question
+        self.answer = answer
+        self.vector = vector
+        # id исходного взаимодействия и всех ответов, выданных из кэша:
+        # низкая оценка любого из них снимает запись
+        self.interaction_ids = [interaction_id]
+
+
+class AnswerCache:
+    """LRU-кэш ответов с поиском по близости вопросов.
+
+    Вектор вопроса считается один раз при добавлении, матрица для поиска
+    склеивается из них лениво после изменения состава кэша. При смене
+    векторизатора (пересборка индекса) векторы пересчитываются.
+    """
+
+    # Сколько id выданных из кэша ответов помнить для одной записи
+    MAX_TRACKED_IDS = 50
+
+    def __init__(self, threshold=0.9, maxsize=2000):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        # interaction_id -> ключ записи (исходный id)
+        self._owners = {}
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._matrix_keys = []
+        self._vectorizer = None
+        # За период между отчётами (reset_stats)
+        self.hits = 0
+        self.lookups = 0
+        # С запуска процесса, не сбрасываются — для счётчиков Prometheus
+        self.total_hits = 0
+        self.total_lookups = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _use_vectorizer(self, vectorizer):
+        if vectorizer is self._vectorizer:
+            return
+        keys = list(self._entries)
+        if keys:
+            vectors = vectorizer.transform([self._entries[key].question for key in keys]).tocsr()
+            for i, key in enumerate(keys):
+                self._entries[key].vector = vectors[i]
+        self._vectorizer = vectorizer
+        self._matrix = None
+
+    def _ensure_matrix(self):
+        # scipy уже загружен индексом базы знаний; импорт здесь не тянет его при старте бота
+        from scipy import sparse
+
+        if self._matrix is None and self._entries:
+            self._matrix_keys = list(self._entries)
+            self._matrix = sparse.vstack(
+                [self._entries[key].vector for key in self._matrix_keys], format="csr"
+            )
+
+    def lookup(self, question, vectorizer):
+        """Возвращает самую близкую запись с близостью не ниже порога или None"""
+        with self._lock:
+            self.lookups += 1
+            self.total_lookups += 1
+            if not self._entries:
+                return None
+            self._use_vectorizer(vectorizer)
+            self._ensure_matrix()
+            query_vec = vectorizer.transform([question])
+            if query_vec.nnz == 0:
+                return None
+            scores = (self._matrix @ query_vec.T).toarray().ravel()
+            best = int(scores.argmax())
+            if scores[best] < self.threshold:
+                return None
+            key = self._matrix_keys[best]
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def record_hit(self, entry, interaction_id):
+        """Учитывает выдачу ответа из кэша под новым interaction_id"""
+        with self._lock:
+            self.hits += 1
+            self.total_hits += 1
+            key = entry.interaction_ids[0]
+            if key not in self._entries:
+                return
+            entry.interaction_ids.append(interaction_id)
+            self._owners[interaction_id] = key
+            if len(entry.interaction_ids) > self.MAX_TRACKED_IDS:
+                dropped = entry.interaction_ids.pop(1)
+                self._owners.pop(dropped, None)
+
+    def add(self, interaction_id, question, answer, vectorizer):
+        with self._lock:
+            self._use_vectorizer(vectorizer)
+            vector = vectorizer.transform([question]).tocsr()
+            if vector.nnz == 0:
+                # Вопрос без известных слов ни с чем не совпадёт
+                return
+            self._entries[interaction_id] = CachedAnswer(question, answer, vector, interaction_id)
+            self._owners[interaction_id] = interaction_id
+            while len(self._entries) > self.maxsize:
+                _, evicted = self._entries.popitem(last=False)
+                for evicted_id in evicted.interaction_ids:
+                    self._owners.pop(evicted_id, None)
+            self._matrix = None
+
+    def invalidate(self, interaction_id):
+        """Снимает запись, к которой относится interaction_id. Возвращает True, если она была"""
+        with self._lock:
+            key = self._owners.get(interaction_id)
+            if key is None:
+                return False
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                for entry_id in entry.interaction_ids:
+                    self._owners.pop(entry_id, None)
+            self._matrix = None
+            return entry is not None
+
+    def hit_rate(self):
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def reset_stats(self):
+        """Начинает новый период для hits и lookups; total_* не трогает"""
+        with self._lock:
+            self.hits = 0
+            self.lookups = 0
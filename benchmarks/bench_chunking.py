@@ -0,0 +1,77 @@
+"""Бенчмарк загрузки base_knowledge/: прежний квадратичный чанкер против потокового.
+
+Каждый вариант запускается в отдельном процессе, чтобы пиковый RSS не смешивался.
+Запуск из корня репозитория:
+    python benchmarks/bench_chunking.py
+"""
+import os
+import sys
+import json
+import time
+import resource
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def legacy_load_chunks(paths):
+    """Прежний загрузчик из bot.py: current_chunk += sent и split() на каждое предложение"""
+    chunks = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read().strip()
+            sentences = text.split(". ")
+            current_chunk = ""
+            for sent in sentences:
+                if len(current_chunk.split()) + len(sent.split()) > 500:
+                    if len(current_chunk) > 50:
+                        chunks.append(current_chunk.strip())
+                    current_chunk = sent + ". "
+                else:
+                    current_chunk += sent + ". "
+            if current_chunk and len(current_chunk) > 50:
+                chunks.append(current_chunk.strip())
+    return chunks
+
+
+def _run_variant(variant):
+    from knowledge_index import KNOWLEDGE_DIR, KnowledgeIndex, list_knowledge_files, load_chunks
+
+    paths = list_knowledge_files(KNOWLEDGE_DIR)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    chunks = legacy_load_chunks(paths) if variant == "legacy" else load_chunks(paths)
+    chunk_s = time.perf_counter() - start
+    chunk_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    KnowledgeIndex.build(chunks)
+    total_s = time.perf_counter() - start
+    print(json.dumps({
+        "chunks": len(chunks),
+        "chunk_ms": chunk_s * 1000,
+        "startup_ms": total_s * 1000,
+        "chunk_rss_delta_mb": (chunk_rss - base_rss) / 1024,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+
+
+def main():
+    print(f"{'вариант':<10} {'чанков':>7} {'чанкинг, мс':>12} {'старт, мс':>10} {'+RSS чанкинга, МБ':>18} {'пик RSS, МБ':>12}")
+    for variant in ("legacy", "streaming"):
+        runs = []
+        for _ in range(3):
+            out = subprocess.run(
+                [sys.executable, __file__, variant], cwd=ROOT,
+                capture_output=True, text=True, check=True,
+            ).stdout
+            runs.append(json.loads(out.strip().splitlines()[-1]))
+        best = min(runs, key=lambda r: r["startup_ms"])
+        print(f"{variant:<10} {best['chunks']:>7} {best['chunk_ms']:>12.1f} {best['startup_ms']:>10.1f} "
+              f"{best['chunk_rss_delta_mb']:>18.1f} {best['peak_rss_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        _run_variant(sys.argv[1])
+    else:
+        main()
@@ -0,0 +1,165 @@
+"""Ежедневный отчёт: прежний подсчёт в pandas по сырым взаимодействиям против сводок stats_rollup.
+
+База заполняется взаимодействиями (по умолчанию 1 млн за 50 дней, 20 тыс.
+в сутки, у 10% есть оценка), сводки строятся backfill. Затем измеряются:
+
+* время построения сводок по всей базе (backfill);
+* сводка за 24 часа и за 30 дней: прежний путь (get_admin_stats + pandas,
+  как в get_daily_stats) и get_stats_summary;
+* скорость записи через write_log со сводками и без них — цена
+  обновления сводок в транзакции записи.
+
+Счётчики обоих путей печатаются рядом для сверки.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_daily_stats.py [--rows 1000000] [--days 50] [--inserts 20000]
+"""
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+QUESTIONS = [
+    "Как выровнять стены гипсокартоном?",
+    "Нужна ли гидроизоляция в ванной под плитку?",
+    "Какой краской покрасить деревянный пол?",
+    "Какая глубина заложения ленточного фундамента?",
+    "Чем утеплить каркасный дом?",
+]
+
+
+def _question(rnd):
+    # Несколько частых вопросов и длинный хвост уникальных
+    if rnd.random() < 0.3:
+        return rnd.choice(QUESTIONS)
+    return f"Вопрос номер {rnd.randrange(10 ** 6)} про ремонт квартиры"
+
+
+def populate(path, rows, days, users=50000, feedback_share=0.1):
+    import storage
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous=OFF")
+    for statement in storage._SCHEMA:
+        conn.execute(statement)
+    now = datetime.utcnow()
+    rnd = random.Random(42)
+    answer = "Ответ эксперта. " * 60
+
+    def interactions():
+        for _ in range(rows):
+            ts = now - timedelta(seconds=rnd.randrange(days * 24 * 3600))
+            user_id = rnd.randrange(users)
+            yield (user_id, f"user{user_id}", "Имя", None, _question(rnd), answer,
+                   ts.strftime("%Y-%m-%d %H:%M:%S"))
+
+    conn.executemany(
+        "INSERT INTO user_interactions (user_id, username, first_name, last_name, question, answer, timestamp) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)", interactions())
+    conn.executemany(
+        "INSERT OR IGNORE INTO feedback (user_id, interaction_id, rating, comment) VALUES (?, ?, ?, ?)",
+        ((rnd.randrange(users), interaction_id, rnd.randint(1, 5), "Спасибо" if interaction_id % 3 else None)
+         for interaction_id in rnd.sample(range(1, rows + 1), int(rows * feedback_share))))
+    conn.commit()
+    conn.close()
+
+
+# === Прежний подсчёт из get_daily_stats ===
+def legacy_summary(days):
+    import storage
+
+    df = storage.get_admin_stats(days)
+    ratings_count = df['rating'].notna().sum()
+    top_users = df.groupby('user_id').size().sort_values(ascending=False).head(3)
+    for user_id in top_users.index:
+        df[df['user_id'] == user_id].iloc[0]
+    return {
+        "interactions": len(df),
+        "users": df['user_id'].nunique(),
+        "ratings": int(ratings_count),
+        "comments": int(df['comment'].notna().sum()),
+        "avg": df['rating'].mean() if ratings_count > 0 else 0,
+        "top_question": int(df['question'].value_counts().iloc[0]),
+    }
+
+
+def rollup_summary(hours):
+    import storage
+
+    summary = storage.get_stats_summary(hours)
+    return {
+        "interactions": summary["interactions"],
+        "users": summary["users"],
+        "ratings": summary["ratings"],
+        "comments": summary["comments"],
+        "avg": summary["rating_sum"] / summary["ratings"] if summary["ratings"] else 0,
+        "top_question": summary["top_questions"][0][1],
+    }
+
+
+def _measure(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def _write_rate(storage, inserts):
+    rnd = random.Random(7)
+    start = time.perf_counter()
+    for _ in range(inserts):
+        user_id = rnd.randrange(50000)
+        storage.write_log.log_interaction(user_id, f"user{user_id}", "Имя", None, _question(rnd), "Ответ")
+    storage.write_log.flush()
+    return inserts / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=50)
+    parser.add_argument("--inserts", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "stats.db")
+        os.environ["DB_PATH"] = db_path
+        populate(db_path, args.rows, args.days)
+
+        import storage
+        import stats_rollup
+
+        start = time.perf_counter()
+        storage.init_database()  # сводок нет — строятся по всей базе
+        print(f"Взаимодействий: {args.rows:,} за {args.days} дн.; backfill: {time.perf_counter() - start:.1f} с\n")
+
+        print(f"{'':<24} {'мс':>9} {'взаим.':>8} {'польз.':>7} {'оценок':>7} {'комм.':>6} {'ср.':>5} {'топ-1':>6}")
+        for label, days in (("24 часа", 1), ("30 дней", 30)):
+            for name, func in (("pandas", lambda: legacy_summary(days)),
+                               ("сводки", lambda: rollup_summary(days * 24))):
+                ms, s = _measure(func, 3)
+                print(f"{label + ', ' + name:<24} {ms:9.1f} {s['interactions']:8d} {s['users']:7d} "
+                      f"{s['ratings']:7d} {s['comments']:6d} {s['avg']:5.2f} {s['top_question']:6d}")
+
+        storage.write_log.start()
+        with_rollups = _write_rate(storage, args.inserts)
+        original = stats_rollup.RollupBatch.apply
+        stats_rollup.RollupBatch.apply = lambda batch, conn: None
+        without_rollups = _write_rate(storage, args.inserts)
+        stats_rollup.RollupBatch.apply = original
+        print(f"\nЗапись через write_log, взаимодействий/с: без сводок {without_rollups:,.0f}, "
+              f"со сводками {with_rollups:,.0f}")
+        storage.close_storage()
+
+
+if __name__ == "__main__":
+    main()
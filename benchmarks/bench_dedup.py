@@ -0,0 +1,137 @@
+"""Почти дубликаты при сборке индекса и разнообразие выдачи (MMR) при поиске.
+
+1. Корпус base_knowledge/: сколько фрагментов схлопывается при разных
+   порогах NearDuplicateFilter, размер индекса (текст + матрица) и
+   наибольшая оценка Жаккара среди всех пар фрагментов.
+2. Корпус с подмешанными копиями: --copies доля фрагментов добавляется
+   ещё раз с заменой --edit доли слов — сколько копий найдено и сколько
+   исходных фрагментов отброшено по ошибке.
+3. MMR: для нескольких MMR_LAMBDA — recall@3 по benchmarks/relevance_set.json,
+   средний косинус между фрагментами top-3 (чем меньше, тем меньше повторов)
+   и время запроса.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_dedup.py [--copies 0.3] [--edit 0.02]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_index import KNOWLEDGE_DIR, KnowledgeIndex, chunk_key, list_knowledge_files, load_chunks  # noqa: E402
+from near_duplicates import NearDuplicateFilter  # noqa: E402
+
+RELEVANCE_SET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "relevance_set.json")
+THRESHOLDS = (0.9, 0.8, 0.7, 0.5)
+LAMBDAS = (1.0, 0.7, 0.5, 0.3)
+
+
+def collapse(chunks, threshold):
+    """Фрагменты без точных и почти дубликатов (как в build_index) и время поиска почти дубликатов"""
+    near_filter = NearDuplicateFilter(threshold)
+    seen, kept, flags = set(), [], []
+    start = time.perf_counter()
+    for chunk in chunks:
+        key = chunk_key(chunk)
+        duplicate = key in seen or near_filter.add(chunk) is not None
+        seen.add(key)
+        flags.append(duplicate)
+        if not duplicate:
+            kept.append(chunk)
+    return kept, flags, time.perf_counter() - start
+
+
+def index_kb(chunks):
+    matrix = KnowledgeIndex.build(chunks).matrix
+    text = sum(len(chunk.encode()) for chunk in chunks)
+    return (text + matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes) / 1024
+
+
+def max_pair_jaccard(chunks):
+    """Наибольшая оценка Жаккара по подписям MinHash среди всех пар"""
+    near_filter = NearDuplicateFilter()
+    signatures = np.array([near_filter.signature(chunk) for chunk in chunks])
+    best = 0.0
+    for i in range(len(signatures) - 1):
+        best = max(best, float((signatures[i + 1:] == signatures[i]).mean(axis=1).max()))
+    return best
+
+
+def edited_copy(chunk, rate, rnd):
+    words = chunk.split()
+    for _ in range(max(1, int(len(words) * rate))):
+        words[rnd.randrange(len(words))] = rnd.choice(("также", "обычно", "например", "всегда"))
+    return " ".join(words)
+
+
+def report_corpus(chunks):
+    size = index_kb(chunks)
+    print(f"Корпус {KNOWLEDGE_DIR}/: {len(chunks)} фрагментов, индекс {size:.0f} КБ, "
+          f"наибольший Жаккар пары {max_pair_jaccard(chunks):.2f}")
+    print(f"{'порог':>6} {'осталось':>9} {'дубликатов':>11} {'индекс, КБ':>11} {'время, мс':>10}")
+    for threshold in THRESHOLDS:
+        kept, _, seconds = collapse(chunks, threshold)
+        print(f"{threshold:6.2f} {len(kept):9d} {1 - len(kept) / len(chunks):10.1%} "
+              f"{index_kb(kept):11.0f} {seconds * 1000:10.0f}")
+
+
+def report_synthetic(chunks, copies, edit):
+    rnd = random.Random(7)
+    sources = rnd.sample(range(len(chunks)), int(len(chunks) * copies))
+    mixed = chunks + [edited_copy(chunks[i], edit, rnd) for i in sources]
+    print(f"\nС копиями: +{len(sources)} копий с заменой {edit:.0%} слов, всего {len(mixed)} фрагментов, "
+          f"индекс {index_kb(mixed):.0f} КБ")
+    print(f"{'порог':>6} {'найдено копий':>14} {'ложных':>7} {'индекс, КБ':>11}")
+    for threshold in THRESHOLDS:
+        kept, flags, _ = collapse(mixed, threshold)
+        found = sum(flags[len(chunks):])
+        false = sum(flags[:len(chunks)])
+        print(f"{threshold:6.2f} {found:8d} ({found / len(sources):4.0%}) {false:7d} {index_kb(kept):11.0f}")
+
+
+def report_mmr(chunks):
+    with open(RELEVANCE_SET, encoding="utf-8") as f:
+        cases = json.load(f)
+    index = KnowledgeIndex.build(chunks)
+    position = {chunk: i for i, chunk in enumerate(chunks)}
+    norms = np.sqrt(np.asarray(index.matrix.multiply(index.matrix).sum(axis=1)).ravel())
+
+    print(f"\nMMR по {len(cases)} вопросам:")
+    print(f"{'lambda':>6} {'recall@3':>9} {'косинус top-3':>14} {'запрос, мс':>11}")
+    for weight in LAMBDAS:
+        found, similarities, timings = 0, [], []
+        for case in cases:
+            start = time.perf_counter()
+            results = index.search(case["query"], relevance_weight=weight)
+            timings.append((time.perf_counter() - start) * 1000)
+            found += any(case["relevant"].lower() in chunk.lower() for chunk in results)
+            rows = [position[chunk] for chunk in results]
+            for a in range(len(rows)):
+                for b in range(a + 1, len(rows)):
+                    dot = index.matrix[rows[a]].multiply(index.matrix[rows[b]]).sum()
+                    similarities.append(dot / (norms[rows[a]] * norms[rows[b]]))
+        print(f"{weight:6.1f} {found / len(cases):9.2f} {statistics.mean(similarities):14.3f} "
+              f"{statistics.median(timings):11.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--copies", type=float, default=0.3, help="доля фрагментов, добавляемых копиями")
+    parser.add_argument("--edit", type=float, default=0.02, help="доля заменяемых слов в копии")
+    args = parser.parse_args()
+
+    chunks = load_chunks(list_knowledge_files(KNOWLEDGE_DIR))
+    report_corpus(chunks)
+    report_synthetic(chunks, args.copies, args.edit)
+    report_mmr(chunks)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Бенчмарк движков поиска на синтетическом корпусе от 10 тыс. до 1 млн фрагментов.
+
+Фрагменты — разреженные векторы с распределением терминов по Ципфу (как в
+естественном тексте), строки нормированы по L2. Запросы — 3–6 терминов.
+Для каждого размера выводятся задержка поиска (p50/p95), память движка и
+совпадение top-k инвертированного индекса с полным перебором.
+Запуск из корня репозитория:
+    python benchmarks/bench_engines.py [--sizes 10000,100000,1000000]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from scipy import sparse
+
+from retrieval import DenseScanEngine, InvertedIndexEngine
+
+VOCABULARY = 200_000
+TERMS_PER_CHUNK = 60
+TOP_K = 3
+
+
+def synthetic_corpus(n_chunks, rng):
+    # Ципф с отсечением по размеру словаря; частые термины встречаются почти везде
+    terms = (rng.zipf(1.3, size=n_chunks * TERMS_PER_CHUNK) - 1) % VOCABULARY
+    rows = np.repeat(np.arange(n_chunks), TERMS_PER_CHUNK)
+    counts = np.ones(len(terms), dtype=np.float32)
+    matrix = sparse.csr_matrix((counts, (rows, terms)), shape=(n_chunks, VOCABULARY), dtype=np.float32)
+    matrix.sum_duplicates()
+    # tf-idf и нормировка строк
+    df = np.bincount(matrix.indices, minlength=VOCABULARY)
+    idf = (np.log((1 + n_chunks) / (1 + df)) + 1).astype(np.float32)
+    matrix.data = np.log1p(matrix.data) * idf[matrix.indices]
+    norms = np.sqrt(np.add.reduceat(matrix.data ** 2, matrix.indptr[:-1]))
+    matrix.data /= np.repeat(norms, np.diff(matrix.indptr))
+    return matrix, idf
+
+
+def synthetic_queries(idf, n_queries, rng):
+    queries = []
+    for _ in range(n_queries):
+        # Запросы состоят из не самых частых терминов (стоп-слова в запросах малоинформативны)
+        terms = np.unique((rng.zipf(1.3, size=rng.integers(3, 7)) + 20) % VOCABULARY)
+        data = idf[terms] / np.linalg.norm(idf[terms])
+        queries.append(sparse.csr_matrix((data, (np.zeros(len(terms), dtype=int), terms)), shape=(1, VOCABULARY)))
+    return queries
+
+
+def bench(engine, queries):
+    samples = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        ids, _ = engine.search(query, TOP_K)
+        samples.append((time.perf_counter() - start) * 1000)
+        results.append(set(ids.tolist()))
+    return np.percentile(samples, 50), np.percentile(samples, 95), results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    print(f"{'фрагментов':>10} {'движок':<9} {'сборка, с':>9} {'p50, мс':>9} {'p95, мс':>9} {'память, МБ':>11} {'совпадение top-k':>17}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        matrix, idf = synthetic_corpus(size, rng)
+        queries = synthetic_queries(idf, args.queries, rng)
+        baseline = None
+        for engine_cls in (DenseScanEngine, InvertedIndexEngine):
+            start = time.perf_counter()
+            engine = engine_cls(matrix)
+            build_s = time.perf_counter() - start
+            p50, p95, results = bench(engine, queries)
+            if baseline is None:
+                baseline = results
+            agreement = np.mean([a == b for a, b in zip(results, baseline)]) * 100
+            print(f"{size:>10} {engine.name:<9} {build_s:>9.2f} {p50:>9.2f} {p95:>9.2f} "
+                  f"{engine.nbytes / 2 ** 20:>11.1f} {agreement:>16.1f}%")
+            del engine
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""Нагрузочный тест бота целиком без Telegram и OpenRouter.
+
+Поднимает заглушки Bot API, OpenRouter и docs.cntd.ru (stub_servers.py),
+запускает настоящий bot.py отдельным процессом с адресами заглушек
+(TELEGRAM_API_URL, OPENROUTER_URL, CNTD_URL) и временными базами, затем
+шлёт апдейты в вебхук /<token>.
+
+* Синтетическая нагрузка (по умолчанию): --users пользователей нажимают
+  «Получить консультацию» и задают по --messages вопросов, каждый
+  следующий — после ответа на предыдущий; доля вопросов про нормативы
+  (с поиском на cntd.ru) — --normative-share.
+* Запись (--updates file.jsonl): апдейты Telegram по одному JSON в строке
+  отправляются с частотой --rate в секунду, не дожидаясь ответов.
+
+Время ответа — от отправки апдейта до окончательного сообщения бота
+(ответ с кнопкой оценки, отказ rate limit или сообщение об ошибке).
+Печатаются ответы в секунду, p50/p95/p99 времени ответа, процессорное
+время и RSS процесса бота, а также счётчики исходов и средние этапов из
+его /metrics.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_load.py [--users 50] [--messages 4] [--llm-latency 1.0]
+        [--error-rate 0.05] [--no-stream] [--updates recorded.jsonl --rate 20]
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import signal
+import socket
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from collections import defaultdict, deque
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiohttp import ClientSession  # noqa: E402
+
+from stub_servers import CntdStub, OpenRouterStub, TelegramStub, start_site  # noqa: E402
+
+TOKEN = "123456:LOADTEST"
+QUESTIONS = [
+    "Как выровнять стены гипсокартоном?",
+    "Нужна ли гидроизоляция в ванной под плитку?",
+    "Какой краской покрасить деревянный пол?",
+    "Какая глубина заложения ленточного фундамента?",
+    "Чем утеплить каркасный дом минеральной ватой?",
+    "Как армировать монолитную плиту перекрытия?",
+]
+NORMATIVE_QUESTIONS = [
+    "Какой СП действует для фундаментов в 2025 году?",
+    "Актуальные требования ГОСТ к кирпичной кладке",
+]
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    # utime и stime — 14-е и 15-е поля /proc/<pid>/stat
+    return (int(fields[11]) + int(fields[12])) / CLK_TCK
+
+
+def _memory_mb(pid):
+    values = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("VmRSS", "VmHWM"):
+                values[key] = int(value.split()[0]) / 1024
+    return values["VmRSS"], values["VmHWM"]
+
+
+class ReplyTracker:
+    """Сопоставляет отправленные апдейты с окончательными ответами бота по чату (FIFO)"""
+
+    def __init__(self):
+        self.pending = defaultdict(deque)
+        self.waiters = {}
+        self.latencies = []
+        self.outcomes = defaultdict(int)
+        self.last_reply = None
+
+    def sent(self, chat_id):
+        self.pending[chat_id].append(time.perf_counter())
+
+    @staticmethod
+    def classify(text, reply_markup):
+        buttons = json.dumps(reply_markup or {})
+        if "feedback_" in buttons:
+            return "answered"
+        if text.startswith("⚠️ **Слишком много"):
+            return "rate_limited"
+        if text.startswith("⚠️ Не удалось"):
+            return "error"
+        if text.startswith("📝") or text.startswith("🔄"):
+            return "ready"
+        return None
+
+    def on_message(self, chat_id, text, reply_markup):
+        outcome = self.classify(text, reply_markup)
+        if outcome is None:
+            # Заглушка «Минутку...», правки потокового ответа, приветствие
+            return
+        now = time.perf_counter()
+        if outcome != "ready":
+            if self.pending[chat_id]:
+                self.latencies.append((now - self.pending[chat_id].popleft()) * 1000)
+            self.outcomes[outcome] += 1
+            self.last_reply = now
+        waiter = self.waiters.pop(chat_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(outcome)
+
+    def wait(self, chat_id):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[chat_id] = future
+        return future
+
+
+def _message_update(update_id, user_id, text):
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": text,
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+    }}
+
+
+def _ask_update(update_id, user_id):
+    """Нажатие «Получить консультацию»: включает режим вопросов"""
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "chat_instance": str(user_id), "data": "ask",
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+        "message": {
+            "message_id": 1, "date": int(time.time()), "text": "Меню",
+            "chat": {"id": user_id, "type": "private"},
+            "from": TelegramStub.BOT_USER,
+        },
+    }}
+
+
+async def _post(session, url, update):
+    async with session.post(url, json=update) as resp:
+        if resp.status != 200:
+            raise RuntimeError(f"Вебхук ответил {resp.status}")
+
+
+async def _start_consultation(session, url, tracker, user_id, update_id, timeout):
+    waiter = tracker.wait(user_id)
+    await _post(session, url, _ask_update(update_id, user_id))
+    await asyncio.wait_for(waiter, timeout)
+
+
+async def run_synthetic(session, url, tracker, args):
+    rnd = random.Random(1)
+    update_ids = iter(range(1, 10 ** 9))
+    await asyncio.gather(*(_start_consultation(session, url, tracker, uid, next(update_ids), args.timeout)
+                           for uid in range(1, args.users + 1)))
+
+    async def user(user_id):
+        for _ in range(args.messages):
+            normative = rnd.random() < args.normative_share
+            text = rnd.choice(NORMATIVE_QUESTIONS if normative else QUESTIONS)
+            waiter = tracker.wait(user_id)
+            tracker.sent(user_id)
+            await _post(session, url, _message_update(next(update_ids), user_id, text))
+            await asyncio.wait_for(waiter, args.timeout)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(uid) for uid in range(1, args.users + 1)))
+    return started
+
+
+async def run_recorded(session, url, tracker, args):
+    with open(args.updates, encoding="utf-8") as f:
+        updates = [json.loads(line) for line in f if line.strip()]
+    messages = [u for u in updates if "message" in u and u["message"].get("text")]
+    users = sorted({u["message"]["chat"]["id"] for u in messages})
+    await asyncio.gather(*(_start_consultation(session, url, tracker, uid, 10 ** 9 + i, args.timeout)
+                           for i, uid in enumerate(users)))
+
+    started = time.perf_counter()
+    for i, update in enumerate(messages):
+        await asyncio.sleep(max(0.0, started + i / args.rate - time.perf_counter()))
+        tracker.sent(update["message"]["chat"]["id"])
+        await _post(session, url, update)
+    deadline = time.perf_counter() + args.timeout
+    while any(tracker.pending.values()) and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    return started
+
+
+def _summarize_metrics(text):
+    """Исходы вопросов и среднее время этапов из /metrics бота"""
+    outcomes = dict(re.findall(r'^bot_requests_total\{outcome="(\w+)"\} (\S+)$', text, re.M))
+    sums = dict(re.findall(r'^bot_stage_seconds_sum\{stage="(\w+)"\} (\S+)$', text, re.M))
+    counts = dict(re.findall(r'^bot_stage_seconds_count\{stage="(\w+)"\} (\S+)$', text, re.M))
+    stages = {name: float(sums[name]) / float(counts[name]) * 1000 for name in sums if float(counts[name])}
+    return {k: int(float(v)) for k, v in outcomes.items()}, stages
+
+
+async def run(args):
+    tracker = ReplyTracker()
+    telegram = TelegramStub(TOKEN, tracker.on_message)
+    openrouter = OpenRouterStub(args.llm_latency, args.llm_jitter, args.tokens, args.token_interval,
+                                args.error_rate, seed=2)
+    cntd = CntdStub(args.cntd_latency)
+    runners = []
+    ports = {}
+    for name, stub in (("telegram", telegram), ("openrouter", openrouter), ("cntd", cntd)):
+        runner, ports[name] = await start_site(stub.app)
+        runners.append(runner)
+
+    tmp = tempfile.mkdtemp(prefix="bench_load_")
+    bot_port = _free_port()
+    env = dict(
+        os.environ,
+        BOT_TOKEN=TOKEN, OPENROUTER_API_KEY="stub", ADMIN_ID="1", PORT=str(bot_port),
+        TELEGRAM_API_URL=f"http://127.0.0.1:{ports['telegram']}/bot",
+        OPENROUTER_URL=f"http://127.0.0.1:{ports['openrouter']}{OpenRouterStub.PATH}",
+        CNTD_URL=f"http://127.0.0.1:{ports['cntd']}",
+        OPENROUTER_MODELS="stub/model-a,stub/model-b",
+        OPENROUTER_STREAM="0" if args.no_stream else "1",
+        DB_PATH=os.path.join(tmp, "bot.db"), SESSION_DB=os.path.join(tmp, "sessions.db"),
+        CNTD_CACHE_DB=os.path.join(tmp, "cntd_cache.db"),
+        RATE_LIMIT_PER_MINUTE=str(args.rate_limit), RATE_LIMIT_BURST=str(args.rate_limit),
+        # Повторные вопросы без истории иначе отдаются из кэша ответов
+        ANSWER_CACHE_THRESHOLD="0" if args.no_answer_cache else os.environ.get("ANSWER_CACHE_THRESHOLD", "0.9"),
+    )
+    log_path = os.path.join(tmp, "bot.log")
+    with open(log_path, "w") as log:
+        bot = subprocess.Popen([sys.executable, "bot.py"], cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    url = f"http://127.0.0.1:{bot_port}"
+    try:
+        async with ClientSession() as session:
+            started = time.perf_counter()
+            while True:
+                if bot.poll() is not None:
+                    raise RuntimeError(f"bot.py завершился с кодом {bot.returncode}, лог: {log_path}")
+                try:
+                    async with session.get(f"{url}/health") as resp:
+                        if resp.status == 200:
+                            break
+                except OSError:
+                    pass
+                if time.perf_counter() - started > 120:
+                    raise RuntimeError(f"bot.py не поднял порт за 120 с, лог: {log_path}")
+                await asyncio.sleep(0.1)
+            print(f"bot.py готов за {time.perf_counter() - started:.1f} с")
+
+            rss_idle, _ = _memory_mb(bot.pid)
+            cpu_before = _cpu_seconds(bot.pid)
+            if args.updates:
+                load_started = await run_recorded(session, f"{url}/{TOKEN}", tracker, args)
+            else:
+                load_started = await run_synthetic(session, f"{url}/{TOKEN}", tracker, args)
+            wall = (tracker.last_reply or time.perf_counter()) - load_started
+            cpu = _cpu_seconds(bot.pid) - cpu_before
+            rss, rss_peak = _memory_mb(bot.pid)
+            # Строка трассировки пишется после отправки ответа — даём последним обработчикам завершиться
+            await asyncio.sleep(0.5)
+            async with session.get(f"{url}/metrics") as resp:
+                outcomes, stages = _summarize_metrics(await resp.text())
+    finally:
+        bot.send_signal(signal.SIGINT)
+        try:
+            bot.wait(30)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        for runner in runners:
+            await runner.cleanup()
+
+    replies = len(tracker.latencies)
+    mode = f"запись {args.updates}, {args.rate}/с" if args.updates else \
+        f"{args.users} пользователей x {args.messages} вопросов"
+    print(f"Нагрузка: {mode}; LLM {args.llm_latency}±{args.llm_jitter} с до первого токена, "
+          f"{args.tokens} токенов, ошибок {args.error_rate:.0%}, {'без потока' if args.no_stream else 'поток'}")
+    print(f"Ответов: {replies} за {wall:.1f} с — {replies / wall:.1f} в секунду; "
+          f"исходы {dict(tracker.outcomes)}")
+    if replies:
+        print(f"Время ответа: p50 {_percentile(tracker.latencies, 50):.0f} мс, "
+              f"p95 {_percentile(tracker.latencies, 95):.0f} мс, p99 {_percentile(tracker.latencies, 99):.0f} мс, "
+              f"max {max(tracker.latencies):.0f} мс")
+    print(f"CPU бота: {cpu:.1f} с ({cpu / wall:.0%} ядра); RSS: {rss_idle:.0f} МБ до нагрузки, "
+          f"{rss:.0f} МБ после, пик {rss_peak:.0f} МБ")
+    print(f"Заглушки: OpenRouter {openrouter.requests} запросов ({openrouter.errors} ошибок, "
+          f"{openrouter.cancelled} отменено хеджированием), "
+          f"cntd {cntd.requests}, Bot API {sum(telegram.calls.values())} вызовов")
+    print(f"/metrics бота: исходы {outcomes}")
+    print("Среднее по этапам, мс: " + ", ".join(f"{name} {ms:.1f}" for name, ms in stages.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=4)
+    parser.add_argument("--normative-share", type=float, default=0.2)
+    parser.add_argument("--updates", help="файл JSONL с записанными апдейтами Telegram")
+    parser.add_argument("--rate", type=float, default=20.0, help="апдейтов в секунду при воспроизведении записи")
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--llm-jitter", type=float, default=0.3)
+    parser.add_argument("--tokens", type=int, default=60)
+    parser.add_argument("--token-interval", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--no-stream", action="store_true")
+    parser.add_argument("--cntd-latency", type=float, default=0.3)
+    parser.add_argument("--rate-limit", type=int, default=1000, help="RATE_LIMIT_PER_MINUTE бота")
+    parser.add_argument("--no-answer-cache", action="store_true")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
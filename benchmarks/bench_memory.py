@@ -0,0 +1,148 @@
+"""Память воркеров: прежний кэш (chunks.json + matrix.npz в памяти) против отображённого хранилища.
+
+Индекс собирается из base_knowledge/ (с --scale N корпус повторяется N
+раз — модель библиотеки побольше) и сохраняется в обоих форматах. Затем
+запускаются --workers процессов, каждый загружает индекс и выполняет
+запросы; когда загрузились все, каждый снимает память из
+/proc/self/smaps_rollup:
+
+* RSS — включает страницы, общие с другими воркерами;
+* PSS — общие страницы поделены между процессами, сумма PSS — реальная
+  память всех воркеров;
+* private — страницы только этого процесса.
+
+Из RSS и private вычитается память после импортов (до загрузки индекса).
+PSS приводится целиком: доля общих библиотек в нём зависит от числа
+запущенных процессов, и разность до/после загрузки была бы искажена.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_memory.py [--workers 4] [--scale 1 10]
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+QUERIES = [
+    "Как выровнять стены гипсокартоном?",
+    "Нужна ли гидроизоляция в ванной под плитку?",
+    "глубина заложения ленточного фундамента",
+    "армирование монолитной плиты",
+]
+
+
+def memory_kb():
+    values = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss": values["Rss"],
+        "pss": values["Pss"],
+        "private": values["Private_Clean"] + values["Private_Dirty"],
+    }
+
+
+def save_legacy(index, path):
+    """Прежний формат кэша: фрагменты в JSON, матрица в npz"""
+    from scipy import sparse
+
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "chunks.json"), "w", encoding="utf-8") as f:
+        json.dump(list(index.chunks), f, ensure_ascii=False)
+    sparse.save_npz(os.path.join(path, "matrix.npz"), index.matrix)
+
+
+def load_legacy(cache_dir, legacy_dir):
+    """Прежняя загрузка: все строки фрагментов и матрица — в памяти процесса"""
+    from scipy import sparse
+    from knowledge_index import KnowledgeIndex
+
+    mapped = KnowledgeIndex.load(cache_dir)
+    with open(os.path.join(legacy_dir, "chunks.json"), encoding="utf-8") as f:
+        chunks = json.load(f)
+    matrix = sparse.load_npz(os.path.join(legacy_dir, "matrix.npz")).tocsr()
+    return KnowledgeIndex(chunks, mapped.model, matrix, mapped.fingerprint)
+
+
+def run_worker(kind, cache_dir, legacy_dir):
+    """Выполняется в дочернем процессе: загрузка, запросы, ожидание остальных, замер"""
+    from knowledge_index import KnowledgeIndex
+
+    base = memory_kb()
+    index = load_legacy(cache_dir, legacy_dir) if kind == "legacy" else KnowledgeIndex.load(cache_dir)
+    for query in QUERIES * 5:
+        index.search(query)
+    print("ready", flush=True)
+    sys.stdin.readline()
+    loaded = memory_kb()
+    print(json.dumps({
+        "rss": (loaded["rss"] - base["rss"]) / 1024,
+        "private": (loaded["private"] - base["private"]) / 1024,
+        "pss": loaded["pss"] / 1024,
+    }), flush=True)
+
+
+def run_workers(kind, cache_dir, legacy_dir, workers):
+    procs = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--run", kind, cache_dir, legacy_dir],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, cwd=ROOT,
+        )
+        for _ in range(workers)
+    ]
+    for proc in procs:
+        if proc.stdout.readline().strip() != "ready":
+            raise RuntimeError(f"Воркер {kind} завершился с ошибкой")
+    results = []
+    for proc in procs:
+        proc.stdin.write("go\n")
+        proc.stdin.flush()
+        results.append(json.loads(proc.stdout.readline()))
+        proc.stdin.close()
+        proc.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--run", nargs=3, metavar=("KIND", "CACHE_DIR", "LEGACY_DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_worker(*args.run)
+        return
+
+    from knowledge_index import KnowledgeIndex, build_index
+
+    base_index, _ = build_index(cache_dir=os.path.join(tempfile.gettempdir(), "bench_memory_parts"))
+    chunks = list(base_index.chunks)
+    print(f"Воркеров: {args.workers}; память на воркер, МБ (RSS и private — прирост после импортов)\n")
+    print(f"{'':<26} {'фрагм.':>7} {'RSS':>7} {'private':>8} {'PSS':>7} {'сумма PSS':>10}")
+    for scale in args.scale:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_dir, legacy_dir = os.path.join(tmp, "cache"), os.path.join(tmp, "legacy")
+            # Копии с номером — чтобы фрагменты не совпадали буквально
+            scaled = [f"{chunk} [{copy}]" for copy in range(scale) for chunk in chunks]
+            index = KnowledgeIndex.build(scaled, fingerprint="bench")
+            index.save(cache_dir)
+            save_legacy(index, legacy_dir)
+            del index
+            for kind, name in (("legacy", "в памяти (прежний)"), ("mmap", "mmap")):
+                results = run_workers(kind, cache_dir, legacy_dir, args.workers)
+                avg = {key: sum(r[key] for r in results) / len(results) for key in results[0]}
+                print(f"x{scale} {name:<22} {len(scaled):7d} {avg['rss']:7.1f} {avg['private']:8.1f} "
+                      f"{avg['pss']:7.1f} {sum(r['pss'] for r in results):10.1f}")
+
+
+if __name__ == "__main__":
+    main()
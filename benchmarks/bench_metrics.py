@@ -0,0 +1,63 @@
+"""Цена инструментирования на горячем пути: запись в счётчики и гистограммы, вывод /metrics.
+
+Замеряется время одной операции Counter.inc и Histogram.observe, полный
+учёт одного вопроса (как finish_trace в bot.py: гистограммы этапов,
+исход и JSON-строка трассировки без вывода в лог) и рендер /metrics.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_metrics.py [--ops 200000]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+from timings import StageTimings  # noqa: E402
+
+STAGES = ("rate_limit", "cache", "retrieval", "cntd", "llm", "deliver")
+
+
+def _per_op(func, ops):
+    start = time.perf_counter()
+    for _ in range(ops):
+        func()
+    return (time.perf_counter() - start) / ops * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=200_000)
+    args = parser.parse_args()
+
+    registry = metrics.Registry()
+    requests = registry.counter("bench_requests_total", "bench", ("outcome",))
+    stage_seconds = registry.histogram("bench_stage_seconds", "bench", ("stage",))
+    request_seconds = registry.histogram("bench_request_seconds", "bench", ("outcome",))
+
+    timings = StageTimings()
+    for i, stage in enumerate(STAGES):
+        timings.record(stage, 0.01 * (i + 1))
+
+    def finish():
+        for name, seconds in timings.stages.items():
+            stage_seconds.observe(seconds, name)
+        requests.inc("answered")
+        request_seconds.observe(timings.total(), "answered")
+        json.dumps(timings.trace(trace_id="u1", outcome="answered", user_id=1), ensure_ascii=False)
+
+    print(f"Counter.inc:            {_per_op(lambda: requests.inc('answered'), args.ops):8.0f} нс")
+    print(f"Histogram.observe:      {_per_op(lambda: stage_seconds.observe(0.3, 'llm'), args.ops):8.0f} нс")
+    print(f"учёт вопроса (6 этапов): {_per_op(finish, args.ops // 10) / 1000:8.1f} мкс")
+
+    start = time.perf_counter()
+    for _ in range(100):
+        text = registry.render()
+    print(f"рендер /metrics:        {(time.perf_counter() - start) * 10:8.2f} мс ({len(text.splitlines())} строк)")
+
+
+if __name__ == "__main__":
+    main()
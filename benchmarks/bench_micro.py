@@ -0,0 +1,146 @@
+"""Быстрые микробенчмарки горячих функций со сверкой с сохранённым базовым замером.
+
+* retrieve_relevant_chunks — KnowledgeIndex.search по индексу из knowledge_cache/;
+* загрузка индекса из кэша и разбор base_knowledge/ на фрагменты (load_chunks);
+* SQLite: отложенная запись взаимодействия, has_given_feedback,
+  has_low_rating, get_user_interaction_count, get_stats_summary на
+  временной базе с --rows взаимодействий.
+
+Для каждой операции печатается медиана и p95 в микросекундах. --save
+сохраняет медианы в JSON; --baseline сравнивает с сохранёнными и
+завершается с кодом 1, если какая-то операция медленнее базовой больше
+чем на --tolerance (по умолчанию 30%).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_micro.py [--rows 100000] [--save base.json] [--baseline base.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+QUERIES = [
+    "Как выровнять стены гипсокартоном?",
+    "Нужна ли гидроизоляция в ванной под плитку?",
+    "глубина заложения ленточного фундамента",
+    "утепление стен каркасного дома минеральной ватой",
+    "армирование монолитной плиты",
+]
+
+
+def measure(func, repeats):
+    """Медиана и p95 одного вызова, мкс"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1e6)
+    timings.sort()
+    return statistics.median(timings), timings[min(len(timings) - 1, int(0.95 * len(timings)))]
+
+
+def populate(path, rows, users=5000):
+    import storage
+
+    conn = sqlite3.connect(path)
+    for statement in storage._SCHEMA:
+        conn.execute(statement)
+    rnd = random.Random(3)
+    now = datetime.utcnow()
+    conn.executemany(
+        "INSERT INTO user_interactions (user_id, username, first_name, last_name, question, answer, timestamp) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ((rnd.randrange(users), "user", "Имя", None, rnd.choice(QUERIES), "Ответ",
+          (now - timedelta(seconds=rnd.randrange(30 * 24 * 3600))).strftime("%Y-%m-%d %H:%M:%S"))
+         for _ in range(rows)))
+    conn.executemany(
+        "INSERT OR IGNORE INTO feedback (user_id, interaction_id, rating, comment) VALUES (?, ?, ?, ?)",
+        ((rnd.randrange(users), i, rnd.randint(1, 5), None) for i in rnd.sample(range(1, rows + 1), rows // 10)))
+    conn.commit()
+    conn.close()
+
+
+def run_knowledge(results):
+    from knowledge_index import CACHE_DIR, KnowledgeIndex, list_knowledge_files, load_chunks, load_or_build_index
+
+    index = load_or_build_index()
+    queries = iter(QUERIES * 1000)
+    results["retrieve_relevant_chunks"] = measure(lambda: index.search(next(queries)), 500)
+    results["index_load_from_cache"] = measure(lambda: KnowledgeIndex.load(CACHE_DIR), 20)
+    paths = list_knowledge_files()
+    results["load_chunks_base_knowledge"] = measure(lambda: load_chunks(paths), 3)
+
+
+def run_storage(results, rows):
+    import storage
+
+    rnd = random.Random(5)
+    storage.init_database()
+    storage.write_log.start()
+
+    def log_interaction():
+        storage.write_log.log_interaction(rnd.randrange(5000), "user", "Имя", None, "Вопрос", "Ответ")
+
+    results["write_log.log_interaction"] = measure(log_interaction, 5000)
+    results["write_log.flush"] = measure(lambda: (log_interaction(), storage.write_log.flush()), 200)
+    results["has_given_feedback"] = measure(
+        lambda: storage.has_given_feedback(rnd.randrange(5000), rnd.randrange(1, rows)), 2000)
+    results["has_low_rating"] = measure(
+        lambda: storage.has_low_rating([rnd.randrange(1, rows) for _ in range(8)], 2), 2000)
+    results["get_user_interaction_count"] = measure(
+        lambda: storage.get_user_interaction_count(rnd.randrange(5000)), 2000)
+    results["get_stats_summary_24h"] = measure(lambda: storage.get_stats_summary(24), 50)
+    storage.close_storage()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--save", help="сохранить медианы в JSON")
+    parser.add_argument("--baseline", help="сравнить с медианами из JSON")
+    parser.add_argument("--tolerance", type=float, default=0.3)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "micro.db")
+        os.environ["DB_PATH"] = db_path
+        populate(db_path, args.rows)
+        run_knowledge(results)
+        run_storage(results, args.rows)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    regressions = []
+    print(f"{'операция':<30} {'медиана, мкс':>13} {'p95, мкс':>11} {'база':>11} {'изм.':>7}")
+    for name, (median, p95) in results.items():
+        line = f"{name:<30} {median:13.1f} {p95:11.1f}"
+        if name in baseline:
+            change = median / baseline[name] - 1
+            line += f" {baseline[name]:11.1f} {change:+7.0%}"
+            if change > args.tolerance:
+                regressions.append(name)
+                line += "  ← медленнее"
+        print(line)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({name: median for name, (median, _) in results.items()}, f, ensure_ascii=False, indent=2)
+    if regressions:
+        print(f"\nРегрессии больше {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Хвостовые задержки запросов к LLM: прежний цикл повторов против model_router.
+
+Поднимает локальную заглушку OpenRouter с внедрёнными сбоями:
+* flaky (основная модель) — часть ответов 500, часть 429 с Retry-After,
+  часть очень медленных;
+* steady (запасная) — стабильно отвечает чуть медленнее здоровой flaky.
+
+Прежний способ — три попытки той же модели с паузами 1.5 * (attempt + 1) с,
+новый — ModelRouter(["flaky", "steady"]). Запросы идут через тот же httpx,
+что и в боте (без потока).
+
+Отдельно — одна модель (OPENROUTER_MODELS по умолчанию), отвечающая втрое
+дольше задержки хеджирования: хеджировать нечем, и ожидание не должно
+занимать процессор. Если оно заняло больше MAX_IDLE_CPU процессорного
+времени, бенчмарк завершается с кодом 1.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_model_router.py [--requests 300] [--concurrency 30] [--hedge-delay 1.0]
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+from aiohttp import web
+
+from model_router import AllModelsFailed, ModelCallError, ModelRouter, parse_retry_after
+
+# Доля процессорного времени от ожидания ответа единственной модели, выше которой — холостой цикл
+MAX_IDLE_CPU = 0.05
+# model -> (доля 500, доля 429, доля медленных, обычная задержка, медленная задержка), сек
+PROFILES = {
+    "flaky": (0.20, 0.05, 0.10, 0.3, 8.0),
+    "steady": (0.01, 0.0, 0.0, 0.5, 0.5),
+}
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+async def _start_stub(seed):
+    rng = random.Random(seed)
+
+    async def completions(request):
+        body = await request.json()
+        errors, throttled, slow, latency, slow_latency = PROFILES[body["model"]]
+        roll = rng.random()
+        if roll < errors:
+            await asyncio.sleep(0.05)
+            return web.json_response({"error": "upstream error"}, status=500)
+        if roll < errors + throttled:
+            return web.json_response({"error": "rate limited"}, status=429, headers={"Retry-After": "1"})
+        await asyncio.sleep(slow_latency if roll < errors + throttled + slow else latency)
+        return web.json_response({"choices": [{"message": {"content": f"ответ {body['model']}"}}]})
+
+    app = web.Application()
+    app.router.add_post("/api/v1/chat/completions", completions)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+async def _request(client, url, model, first_token=None):
+    response = await client.post(url, json={"model": model, "messages": []})
+    if response.status_code != 200:
+        raise ModelCallError(
+            f"HTTP {response.status_code}", status=response.status_code,
+            retry_after=parse_retry_after(response.headers.get("Retry-After")),
+        )
+    answer = response.json()["choices"][0]["message"]["content"]
+    if first_token is not None:
+        first_token()
+    return answer
+
+
+async def legacy(client, url):
+    """Прежний цикл из handle_message"""
+    for attempt in range(3):
+        try:
+            answer = await _request(client, url, "flaky")
+            if answer:
+                return answer
+        except Exception:
+            pass
+        await asyncio.sleep(1.5 * (attempt + 1))
+    raise AllModelsFailed("3 попытки не удались")
+
+
+async def _measure(name, fn, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await fn()
+            except AllModelsFailed:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    print(f"{name:<10} {statistics.median(latencies):8.2f} {_percentile(latencies, 95):8.2f} "
+          f"{_percentile(latencies, 99):8.2f} {max(latencies):8.2f} {failures:>8}")
+
+
+async def run(requests, concurrency, hedge_delay):
+    runner, port = await _start_stub(seed=42)
+    url = f"http://127.0.0.1:{port}/api/v1/chat/completions"
+    router = ModelRouter(["flaky", "steady"], hedge_delay=hedge_delay)
+    try:
+        async with httpx.AsyncClient(timeout=30.0, limits=httpx.Limits(max_connections=100)) as client:
+            print(f"Запросов: {requests}, одновременно: {concurrency}\n")
+            print(f"{'способ':<10} {'p50, с':>8} {'p95, с':>8} {'p99, с':>8} {'max, с':>8} {'отказов':>8}")
+            await _measure("прежний", lambda: legacy(client, url), requests, concurrency)
+            await _measure("router", lambda: router.run(
+                lambda model, first_token: _request(client, url, model, first_token)
+            ), requests, concurrency)
+    finally:
+        await runner.cleanup()
+
+    print(f"\nХеджирований: {router.hedges}")
+    for model, stats in router.stats().items():
+        p95 = f"{stats['p95']:.2f} с" if stats["p95"] is not None else "—"
+        print(f"  {model}: автомат {stats['state']}, успехов {stats['successes']}, "
+              f"сбоев {stats['failures']}, p95 {p95}")
+
+
+async def single_model(hedge_delay):
+    """Процессорное время и длительность одного запроса к единственной медленной модели"""
+    router = ModelRouter(["only"], hedge_delay=hedge_delay, min_hedge_delay=hedge_delay)
+
+    async def attempt(model, first_token):
+        await asyncio.sleep(3 * hedge_delay)
+        first_token()
+        return "ответ"
+
+    cpu, start = time.process_time(), time.perf_counter()
+    await router.run(attempt)
+    return time.process_time() - cpu, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=30)
+    parser.add_argument("--hedge-delay", type=float, default=1.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.requests, args.concurrency, args.hedge_delay))
+
+    cpu, elapsed = asyncio.run(single_model(args.hedge_delay))
+    print(f"\nОдна модель, ответ за {elapsed:.1f} с: процессорное время {cpu * 1000:.0f} мс")
+    if cpu > MAX_IDLE_CPU * elapsed:
+        print(f"Ожидание заняло больше {MAX_IDLE_CPU:.0%} процессора — холостой цикл")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Размер промпта: прежняя склейка истории и знаний против prompt_builder.
+
+Проигрывает таблицу user_interactions (по пользователям, в порядке времени),
+восстанавливая историю диалога так же, как бот (последние 10 пар), и ищет
+фрагменты базы знаний для каждого вопроса. Для каждого вопроса строится
+прежний промпт и промпт с бюджетом, сравнивается оценка токенов.
+
+Если в БД нет взаимодействий, проигрываются синтетические диалоги: вопросы
+из benchmarks/relevance_set.json, ответы — выдержки из найденных фрагментов
+(ответ модели обычно пересказывает их).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_prompt_builder.py [--db bot_feedback.db] [--budget 3000]
+"""
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import statistics
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_index import load_or_build_index
+from prompt_builder import build_user_prompt, count_tokens
+
+RELEVANCE_SET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "relevance_set.json")
+SYSTEM_PROMPT = (
+    "Сегодня 2025 год. Ты — профессиональный строитель с 10-летним опытом. "
+    "Ты отвечаешь ТОЛЬКО на вопросы по строительству и ремонту. "
+    "Если вопрос не по теме — вежливо откажись. "
+    "ОТВЕЧАЙ ТОЛЬКО НА РУССКОМ ЯЗЫКЕ. "
+    "НЕ ПИШИ РАССУЖДЕНИЯ. НЕ ИСПОЛЬЗУЙ ФРАЗЫ ВРОДЕ «Я думаю». "
+    "ПИШИ КАК ЭКСПЕРТ: КРАТКО, ТОЧНО, ПО ДЕЛУ. "
+    "МАКСИМУМ — 400 слов."
+)
+
+
+def legacy_prompt(question, history, knowledge):
+    """Прежняя сборка промпта из handle_message"""
+    conversation = "\n\n".join(
+        f"Вопрос {i}: {entry['question']}\n\nОтвет {i}: {entry['answer']}"
+        for i, entry in enumerate(history, 1)
+    )
+    conversation_part = f"Предыдущий диалог с клиентом:\n{conversation}\n\n" if conversation else ""
+    if knowledge:
+        return (
+            f"{conversation_part}"
+            f"Информация из строительных нормативов:\n" + "\n\n".join(knowledge) + "\n\n"
+            f"Текущий вопрос клиента: {question}\n\n"
+            f"Ответь на русском языке, без лишних слов."
+        )
+    return f"{conversation_part}Текущий вопрос клиента: {question}\n\nОтветь на русском языке, без лишних слов."
+
+
+def load_dialogs(db_path):
+    if not db_path or not os.path.exists(db_path):
+        return {}
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT user_id, question, answer FROM user_interactions ORDER BY user_id, timestamp, id"
+        ).fetchall()
+    except sqlite3.Error:
+        return {}
+    finally:
+        conn.close()
+    dialogs = defaultdict(list)
+    for user_id, question, answer in rows:
+        dialogs[user_id].append((question, answer))
+    return dialogs
+
+
+def synthetic_dialogs(index, users=20, turns=12):
+    with open(RELEVANCE_SET, encoding="utf-8") as f:
+        questions = [case["query"] for case in json.load(f)]
+    dialogs = {}
+    for user in range(users):
+        dialog = []
+        for turn in range(turns):
+            question = questions[(user * 7 + turn) % len(questions)]
+            found = index.search(question)
+            # ~300 слов пересказа найденного фрагмента
+            answer = " ".join((found[0] if found else question).split()[:300])
+            dialog.append((question, answer))
+        dialogs[user] = dialog
+    return dialogs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--db", default=os.environ.get("DB_PATH", "bot_feedback.db"))
+    parser.add_argument("--budget", type=int, default=None)
+    args = parser.parse_args()
+
+    index = load_or_build_index()
+    dialogs = load_dialogs(args.db)
+    source = f"БД {args.db}"
+    if not dialogs:
+        dialogs = synthetic_dialogs(index)
+        source = "синтетические диалоги"
+
+    old_sizes, new_sizes = [], []
+    for dialog in dialogs.values():
+        history = []
+        for question, answer in dialog:
+            knowledge = index.search(question)
+            old_sizes.append(count_tokens(SYSTEM_PROMPT) + count_tokens(legacy_prompt(question, history, knowledge)))
+            kwargs = {"budget": args.budget} if args.budget else {}
+            _, tokens = build_user_prompt(question, history, knowledge, SYSTEM_PROMPT, **kwargs)
+            new_sizes.append(tokens)
+            history = (history + [{"question": question, "answer": answer}])[-10:]
+
+    print(f"Источник: {source}, диалогов: {len(dialogs)}, вопросов: {len(old_sizes)}\n")
+    print(f"{'':<10} {'среднее':>9} {'медиана':>9} {'p95':>9} {'max':>9}")
+    for name, sizes in (("прежний", old_sizes), ("бюджет", new_sizes)):
+        ordered = sorted(sizes)
+        print(f"{name:<10} {statistics.mean(sizes):9.0f} {statistics.median(sizes):9.0f} "
+              f"{ordered[int(0.95 * (len(ordered) - 1))]:9d} {ordered[-1]:9d}")
+    reduction = 1 - statistics.mean(new_sizes) / statistics.mean(old_sizes)
+    print(f"\nСокращение среднего промпта: {reduction:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Стоимость проверки и память лимитера при 1M пользователей.
+
+Сравнивает прежний check_rate_limit (два defaultdict без очистки) с
+rate_limiter.RateLimiter: время одной проверки, память на 1M разных
+пользователей и память после простоя (вытеснение полных вёдер).
+
+Время подменяется искусственными часами, чтобы прогон был быстрым.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_rate_limiter.py [--users 1000000]
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limiter import RateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class LegacyLimiter:
+    """Прежняя реализация из bot.py"""
+
+    def __init__(self, clock, limit=10, window=60):
+        self.clock = clock
+        self.limit = limit
+        self.window = window
+        self.user_last_activity = defaultdict(float)
+        self.user_request_counts = defaultdict(int)
+
+    def allow(self, user_id):
+        current_time = self.clock()
+        if user_id in self.user_last_activity:
+            if current_time - self.user_last_activity[user_id] > self.window:
+                self.user_request_counts[user_id] = 0
+                self.user_last_activity[user_id] = current_time
+        if self.user_request_counts[user_id] >= self.limit:
+            return False
+        self.user_request_counts[user_id] += 1
+        self.user_last_activity[user_id] = current_time
+        return True
+
+
+def _fill(limiter, clock, users):
+    """По одному запросу от каждого пользователя, часы идут на 1 мкс за запрос"""
+    start = time.perf_counter()
+    for user_id in range(users):
+        clock.now += 1e-6
+        limiter.allow(10 ** 9 + user_id)
+    return (time.perf_counter() - start) / users * 1e9
+
+
+def _repeat(limiter, clock, checks=200_000):
+    """Повторные проверки уже известных пользователей"""
+    start = time.perf_counter()
+    for i in range(checks):
+        clock.now += 1e-6
+        limiter.allow(10 ** 9 + i % 1000)
+    return (time.perf_counter() - start) / checks * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    print(f"Пользователей: {args.users:,}\n")
+    print(f"{'':<10} {'нс/новый':>9} {'нс/повтор':>10} {'память, МБ':>11} {'после простоя, МБ':>18}")
+    for name, factory in (("прежний", lambda c: LegacyLimiter(c)),
+                          ("GCRA", lambda c: RateLimiter(10, burst=3, clock=c))):
+        clock = FakeClock()
+        limiter = factory(clock)
+        new_ns = _fill(limiter, clock, args.users)
+        repeat_ns = _repeat(limiter, clock)
+        del limiter
+
+        # Память меряется отдельным прогоном: tracemalloc сильно замедляет выделения
+        clock = FakeClock()
+        tracemalloc.start()
+        limiter = factory(clock)
+        _fill(limiter, clock, args.users)
+        memory = tracemalloc.get_traced_memory()[0]
+        # Через 10 минут тишины приходит один запрос: новый лимитер вытесняет простаивающих
+        clock.now += 600
+        limiter.allow(7)
+        idle_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del limiter
+
+        print(f"{name:<10} {new_ns:9.0f} {repeat_ns:10.0f} {memory / 2 ** 20:11.1f} {idle_memory / 2 ** 20:18.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Офлайн-оценка качества поиска: recall@3 и размер индекса для TF-IDF и BM25.
+
+Набор вопросов — benchmarks/relevance_set.json: для каждого вопроса указана
+фраза из нужного фрагмента (так набор не зависит от нумерации чанков).
+Вопрос считается найденным, если фраза есть хотя бы в одном из top-3
+фрагментов выдачи с порогом модели. Дополнительно проверяется, что
+вопросы не по теме не получают фрагментов.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_relevance.py
+"""
+import os
+import sys
+import json
+import time
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_index import KNOWLEDGE_DIR, KnowledgeIndex, list_knowledge_files, load_chunks
+from scoring import MODELS
+
+RELEVANCE_SET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "relevance_set.json")
+
+OFF_TOPIC = [
+    "Как приготовить борщ?",
+    "Какой курс доллара на завтра",
+    "Посоветуй сериал на выходные",
+    "Как настроить роутер",
+]
+
+
+def recall_at_k(index, cases, top_k=3, min_score=None):
+    found = 0
+    for case in cases:
+        phrase = case["relevant"].lower()
+        results = index.search(case["query"], top_k=top_k, min_score=min_score)
+        found += any(phrase in chunk.lower() for chunk in results)
+    return found / len(cases)
+
+
+def main():
+    with open(RELEVANCE_SET, encoding="utf-8") as f:
+        cases = json.load(f)
+    chunks = load_chunks(list_knowledge_files(KNOWLEDGE_DIR))
+    print(f"Фрагментов: {len(chunks)}, вопросов: {len(cases)}\n")
+
+    print(f"{'модель':<8} {'recall@3':>9} {'без порога':>11} {'не по теме':>11} "
+          f"{'словарь':>9} {'nnz':>8} {'матрица, КБ':>12} {'сборка, мс':>11} {'запрос, мс':>11}")
+    for name in MODELS:
+        start = time.perf_counter()
+        index = KnowledgeIndex.build(chunks, model=name)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        recall = recall_at_k(index, cases)
+        recall_raw = recall_at_k(index, cases, min_score=0.0)
+        off_topic = sum(not index.search(q) for q in OFF_TOPIC)
+
+        samples = []
+        for case in cases:
+            start = time.perf_counter()
+            index.search(case["query"])
+            samples.append((time.perf_counter() - start) * 1000)
+
+        print(f"{name:<8} {recall:9.2f} {recall_raw:11.2f} {off_topic:>6}/{len(OFF_TOPIC):<4} "
+              f"{index.model.vocabulary_size:9d} {index.matrix.nnz:8d} {index.engine.nbytes / 1024:12.0f} "
+              f"{build_ms:11.0f} {statistics.median(samples):11.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Микробенчмарк поиска по базе знаний: старый способ против предрассчитанной матрицы.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_retrieval.py
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+from knowledge_index import (
+    KNOWLEDGE_DIR,
+    KnowledgeIndex,
+    corpus_fingerprint,
+    list_knowledge_files,
+    load_or_build_index,
+    scan_sources,
+)
+
+QUERIES = [
+    "Как выровнять стены гипсокартоном?",
+    "Нужна ли гидроизоляция в ванной под плитку?",
+    "Какой краской покрасить деревянный пол?",
+    "глубина заложения ленточного фундамента",
+    "как наносить жидкие обои SILK PLASTER",
+    "утепление стен каркасного дома минеральной ватой",
+    "армирование монолитной плиты",
+    "расход декоративной штукатурки на квадратный метр",
+]
+
+
+def _timeit(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def legacy_retrieve(index, vectorizer, query, top_k=3):
+    """Прежняя реализация: векторизация всего корпуса на каждый запрос"""
+    query_vec = vectorizer.transform([query])
+    knowledge_vecs = vectorizer.transform(index.chunks)
+    similarities = cosine_similarity(query_vec, knowledge_vecs).flatten()
+    top_indices = similarities.argsort()[-top_k:][::-1]
+    return [index.chunks[i] for i in top_indices if similarities[i] > 0.1]
+
+
+def main():
+    paths = list_knowledge_files(KNOWLEDGE_DIR)
+    size_mb = sum(os.path.getsize(p) for p in paths) / 2 ** 20
+    print(f"Корпус: {len(paths)} файлов, {size_mb:.1f} МБ")
+
+    cache_dir = tempfile.mkdtemp(prefix="knowledge_cache_")
+    try:
+        start = time.perf_counter()
+        index = load_or_build_index(KNOWLEDGE_DIR, cache_dir)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        cached = load_or_build_index(KNOWLEDGE_DIR, cache_dir)
+        load_ms = (time.perf_counter() - start) * 1000
+        print(f"Фрагментов: {len(index)}, признаков: {index.matrix.shape[1]}")
+        print(f"Холодная сборка индекса: {build_ms:8.1f} мс")
+        print(f"Загрузка из кэша:        {load_ms:8.1f} мс")
+
+        start = time.perf_counter()
+        corpus_fingerprint(scan_sources(KNOWLEDGE_DIR))
+        print(f"  из них отпечаток корпуса: {(time.perf_counter() - start) * 1000:.1f} мс")
+
+        # Выдача сверяется с той же моделью TF-IDF, что была в старом поиске
+        vectorizer = TfidfVectorizer(stop_words=None).fit(index.chunks)
+        tfidf_index = KnowledgeIndex.build(index.chunks, model="tfidf")
+        mismatches = sum(
+            legacy_retrieve(index, vectorizer, q) != tfidf_index.search(q) for q in QUERIES
+        )
+        print(f"Расхождений в выдаче со старым поиском (tfidf): {mismatches}/{len(QUERIES)}")
+
+        print(f"\n{'Запрос':<50} {'старый, мс':>12} {'новый, мс':>12}")
+        old_total, new_total = [], []
+        for q in QUERIES:
+            old_med, _ = _timeit(lambda: legacy_retrieve(index, vectorizer, q), 3)
+            new_med, _ = _timeit(lambda: cached.search(q), 50)
+            old_total.append(old_med)
+            new_total.append(new_med)
+            print(f"{q[:50]:<50} {old_med:12.2f} {new_med:12.3f}")
+        print(f"{'медиана':<50} {statistics.median(old_total):12.2f} {statistics.median(new_total):12.3f}")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""Холодный старт bot.py: время до открытого порта, /health и загруженного индекса.
+
+bot.py запускается отдельным процессом (заглушка Bot API из stub_servers.py
+вместо Telegram, временные базы), отсчёт — от запуска процесса:
+
+* порт принимает TCP-соединения;
+* /health отвечает 200;
+* в /metrics bot_knowledge_chunks > 0 — индекс базы знаний загружен.
+
+Затем в отдельном процессе снимается python -X importtime для import bot
+и печатаются самые дорогие модули верхнего уровня.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_startup.py [--runs 3] [--top 10]
+"""
+import os
+import re
+import sys
+import time
+import signal
+import socket
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiohttp import ClientSession  # noqa: E402
+
+from stub_servers import TelegramStub, start_site  # noqa: E402
+
+TOKEN = "123456:STARTUP"
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _port_open(port):
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.05):
+            return True
+    except OSError:
+        return False
+
+
+def _bot_env(tmp, telegram_port, port):
+    return dict(
+        os.environ,
+        BOT_TOKEN=TOKEN, OPENROUTER_API_KEY="stub", ADMIN_ID="1", PORT=str(port),
+        TELEGRAM_API_URL=f"http://127.0.0.1:{telegram_port}/bot",
+        DB_PATH=os.path.join(tmp, "bot.db"), SESSION_DB=os.path.join(tmp, "sessions.db"),
+        CNTD_CACHE_DB=os.path.join(tmp, "cntd_cache.db"),
+    )
+
+
+async def measure_once(telegram_port):
+    """Секунды от запуска до порта, /health и загруженного индекса"""
+    with tempfile.TemporaryDirectory() as tmp:
+        port = _free_port()
+        started = time.perf_counter()
+        bot = subprocess.Popen([sys.executable, "bot.py"], cwd=ROOT, env=_bot_env(tmp, telegram_port, port),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        marks = {}
+        try:
+            async with ClientSession() as session:
+                while len(marks) < 3:
+                    if bot.poll() is not None:
+                        raise RuntimeError(f"bot.py завершился с кодом {bot.returncode}")
+                    if time.perf_counter() - started > 120:
+                        raise RuntimeError("bot.py не запустился за 120 с")
+                    if "port" not in marks and _port_open(port):
+                        marks["port"] = time.perf_counter() - started
+                    if "port" in marks:
+                        try:
+                            if "health" not in marks:
+                                async with session.get(f"http://127.0.0.1:{port}/health") as resp:
+                                    if resp.status == 200:
+                                        marks["health"] = time.perf_counter() - started
+                            async with session.get(f"http://127.0.0.1:{port}/metrics") as resp:
+                                text = await resp.text()
+                            match = re.search(r"^bot_knowledge_chunks (\S+)$", text, re.M)
+                            if match and float(match.group(1)) > 0:
+                                marks["index"] = time.perf_counter() - started
+                        except OSError:
+                            pass
+                    await asyncio.sleep(0.005)
+        finally:
+            bot.send_signal(signal.SIGINT)
+            try:
+                bot.wait(30)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+        return marks
+
+
+def import_profile(top):
+    """Самые дорогие импорты import bot (накопительное время, мс)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import bot"], cwd=ROOT,
+                              env=_bot_env(tmp, 9, _free_port()), capture_output=True, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)", line)
+        # Отступ в два пробела — модуль, импортированный самим bot.py
+        if match and len(match.group(2)) <= 3:
+            rows.append((int(match.group(1)) / 1000, match.group(3)))
+    return sorted(rows, reverse=True)[:top]
+
+
+async def run(runs, top):
+    stub = TelegramStub(TOKEN)
+    runner, telegram_port = await start_site(stub.app)
+    try:
+        results = [await measure_once(telegram_port) for _ in range(runs)]
+    finally:
+        await runner.cleanup()
+    print(f"Холодный старт bot.py, медиана {runs} запусков:")
+    for key, label in (("port", "порт открыт"), ("health", "/health отвечает"), ("index", "индекс загружен")):
+        print(f"  {label:<18} {statistics.median(r[key] for r in results):6.2f} с")
+    print(f"\nimport bot, самые дорогие модули:")
+    for ms, name in import_profile(top):
+        print(f"  {name:<30} {ms:8.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(run(args.runs, args.top))
+
+
+if __name__ == "__main__":
+    main()
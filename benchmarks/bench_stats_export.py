@@ -0,0 +1,169 @@
+"""Выгрузка /stats: прежний DataFrame + обычная книга openpyxl против потоковой выгрузки.
+
+База заполняется взаимодействиями по 1000 в сутки (по умолчанию 500 тыс.
+за 500 дней, у 10% есть оценка), так что период в N/1000 дней даёт N строк.
+Каждый замер идёт в отдельном процессе: пиковый RSS процесса минус RSS
+после импортов — это память самой выгрузки.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_stats_export.py [--rows 500000] [--legacy-rows 50000]
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import resource
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ROWS_PER_DAY = 1000
+END = datetime(2025, 6, 1)
+QUESTIONS = [
+    "Как выровнять стены гипсокартоном?",
+    "Нужна ли гидроизоляция в ванной под плитку?",
+    "Какой краской покрасить деревянный пол?",
+    "Какая глубина заложения ленточного фундамента?",
+    "Чем утеплить каркасный дом?",
+]
+
+
+def populate(path, rows, users=50000, feedback_share=0.1):
+    import storage
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous=OFF")
+    for statement in storage._SCHEMA:
+        conn.execute(statement)
+    rnd = random.Random(42)
+    answer = "Ответ эксперта по строительству и ремонту. " * 12
+    step = 24 * 3600 / ROWS_PER_DAY
+
+    def interactions():
+        for i in range(rows):
+            ts = END - timedelta(seconds=(i + 0.5) * step)
+            yield (rnd.randrange(users), f"user{i % 997}", "Имя", None, rnd.choice(QUESTIONS), answer,
+                   ts.strftime("%Y-%m-%d %H:%M:%S"))
+
+    conn.executemany(
+        "INSERT INTO user_interactions (user_id, username, first_name, last_name, question, answer, timestamp) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)", interactions())
+    conn.executemany(
+        "INSERT OR IGNORE INTO feedback (user_id, interaction_id, rating, comment) VALUES (?, ?, ?, ?)",
+        ((rnd.randrange(users), interaction_id, rnd.randint(1, 5), "Спасибо" if interaction_id % 3 else None)
+         for interaction_id in rnd.sample(range(1, rows + 1), int(rows * feedback_share))))
+    conn.commit()
+    conn.close()
+
+
+def _period(rows):
+    start = END - timedelta(days=rows / ROWS_PER_DAY)
+    return start.strftime("%Y-%m-%d %H:%M:%S"), END.strftime("%Y-%m-%d %H:%M:%S")
+
+
+# === Прежняя реализация из handle_admin_stats ===
+def legacy_export(start, end, path):
+    import pandas as pd
+    from openpyxl import Workbook
+    from openpyxl.styles import Font, Alignment
+    import storage
+
+    with storage.pool.connection() as conn:
+        df = pd.read_sql_query(storage._ADMIN_STATS_RANGE, conn, params=(start, end))
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "Статистика бота"
+    headers = [
+        "ID пользователя", "Имя пользователя", "Имя", "Фамилия",
+        "Вопрос", "Ответ", "Дата/время", "Оценка", "Комментарий"
+    ]
+    for col, header in enumerate(headers, 1):
+        cell = ws.cell(row=1, column=col, value=header)
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal='center')
+    for row_idx, (_, row) in enumerate(df.iterrows(), 2):
+        ws.cell(row=row_idx, column=1, value=row['user_id'])
+        ws.cell(row=row_idx, column=2, value=row['username'] or '')
+        ws.cell(row=row_idx, column=3, value=row['first_name'] or '')
+        ws.cell(row=row_idx, column=4, value=row['last_name'] or '')
+        ws.cell(row=row_idx, column=5, value=row['question'][:100] + '...' if len(str(row['question'])) > 100 else row['question'])
+        ws.cell(row=row_idx, column=6, value=row['answer'][:100] + '...' if len(str(row['answer'])) > 100 else row['answer'])
+        ws.cell(row=row_idx, column=7, value=row['timestamp'])
+        ws.cell(row=row_idx, column=8, value=row['rating'] if pd.notna(row['rating']) else 'Нет оценки')
+        ws.cell(row=row_idx, column=9, value=row['comment'] or '')
+    for column in ws.columns:
+        max_length = 0
+        column_letter = column[0].column_letter
+        for cell in column:
+            if len(str(cell.value)) > max_length:
+                max_length = len(str(cell.value))
+        ws.column_dimensions[column_letter].width = min(max_length + 2, 50)
+    wb.save(path)
+    return len(df)
+
+
+def run_case(kind, fmt, rows):
+    """Выполняется в дочернем процессе, печатает JSON с результатом"""
+    import pandas  # noqa: F401 — импорты не входят в замер памяти
+    import openpyxl  # noqa: F401
+    import stats_export
+
+    start, end = _period(rows)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{fmt}") as tmp:
+        path = tmp.name
+    base_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    if kind == "legacy":
+        exported = legacy_export(start, end, path)
+    else:
+        exported = stats_export.export_stats(start, end, fmt, path).rows
+    elapsed = time.perf_counter() - started
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    size = os.path.getsize(path)
+    os.unlink(path)
+    print(json.dumps({"rows": exported, "seconds": elapsed, "memory_mb": (peak_kb - base_kb) / 1024,
+                      "size_mb": size / 2 ** 20}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--legacy-rows", type=int, default=50_000)
+    parser.add_argument("--run", nargs=3, metavar=("KIND", "FORMAT", "ROWS"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_case(args.run[0], args.run[1], int(args.run[2]))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "stats.db")
+        os.environ["DB_PATH"] = db_path
+        populate(db_path, args.rows)
+
+        cases = [("legacy", "xlsx", args.legacy_rows)]
+        for rows in sorted({args.legacy_rows, args.rows}):
+            cases += [("stream", "xlsx", rows), ("stream", "csv", rows)]
+        print(f"{'':<18} {'строк':>8} {'сек':>7} {'память, МБ':>11} {'файл, МБ':>9}")
+        for kind, fmt, rows in cases:
+            proc = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--run", kind, fmt, str(rows)],
+                capture_output=True, text=True, cwd=ROOT, env=os.environ,
+            )
+            if proc.returncode != 0:
+                print(f"{kind} {fmt}: ошибка\n{proc.stderr}")
+                continue
+            result = json.loads(proc.stdout.strip().splitlines()[-1])
+            name = "прежний" if kind == "legacy" else "потоковый"
+            print(f"{name + ' ' + fmt:<18} {result['rows']:8d} {result['seconds']:7.1f} "
+                  f"{result['memory_mb']:11.1f} {result['size_mb']:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
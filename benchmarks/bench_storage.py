@@ -0,0 +1,162 @@
+"""Бенчмарк хранилища: прежние connect/close на каждый вызов против пула в режиме WAL.
+
+Обе базы заполняются одинаковыми данными (по умолчанию 1 млн взаимодействий
+за год), затем измеряются вставки в секунду и задержка запросов статистики.
+Запуск из корня репозитория:
+    python benchmarks/bench_storage.py [--rows 1000000] [--inserts 2000]
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+import storage
+
+LEGACY_SCHEMA = storage._SCHEMA[:2]
+QUESTIONS = [
+    "Как выровнять стены гипсокартоном?",
+    "Нужна ли гидроизоляция в ванной под плитку?",
+    "Какой краской покрасить деревянный пол?",
+    "Какая глубина заложения ленточного фундамента?",
+    "Чем утеплить каркасный дом?",
+]
+
+
+def populate(path, rows, users=50000, feedback_share=0.1):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous=OFF")
+    for statement in LEGACY_SCHEMA:
+        conn.execute(statement)
+    now = datetime.utcnow()
+    rnd = random.Random(42)
+    answer = "Ответ эксперта. " * 10
+
+    def interactions():
+        for i in range(rows):
+            ts = now - timedelta(seconds=rnd.randrange(365 * 24 * 3600))
+            yield (rnd.randrange(users), "user", "Имя", None, rnd.choice(QUESTIONS), answer,
+                   ts.strftime("%Y-%m-%d %H:%M:%S"))
+
+    conn.executemany(
+        "INSERT INTO user_interactions (user_id, username, first_name, last_name, question, answer, timestamp) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)", interactions())
+    conn.executemany(
+        "INSERT OR IGNORE INTO feedback (user_id, interaction_id, rating, comment) VALUES (?, ?, ?, NULL)",
+        ((rnd.randrange(users), rnd.randrange(1, rows + 1), rnd.randint(1, 5))
+         for _ in range(int(rows * feedback_share))))
+    conn.commit()
+    conn.close()
+
+
+# === Прежняя реализация из bot.py ===
+def legacy_save_interaction(path, user_id, question, answer):
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT INTO user_interactions (user_id, username, first_name, last_name, question, answer, session_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, "user", "Имя", None, question, answer, None))
+    interaction_id = cursor.lastrowid
+    conn.commit()
+    conn.close()
+    return interaction_id
+
+
+def legacy_admin_stats(path, days):
+    conn = sqlite3.connect(path)
+    df = pd.read_sql_query(storage._ADMIN_STATS.replace("?", f"'-{days} days'"), conn)
+    conn.close()
+    return df
+
+
+def legacy_user_count(path, user_id, days=30):
+    conn = sqlite3.connect(path)
+    count = conn.execute(storage._COUNT_USER_INTERACTIONS.replace("?", str(user_id), 1).replace("?", f"'-{days} days'")).fetchone()[0]
+    conn.close()
+    return count
+
+
+def _measure(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--inserts", type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_storage_")
+    legacy_path = os.path.join(workdir, "legacy.db")
+    pooled_path = os.path.join(workdir, "pooled.db")
+    try:
+        start = time.perf_counter()
+        populate(legacy_path, args.rows)
+        shutil.copy(legacy_path, pooled_path)
+        print(f"Заполнено {args.rows} строк за {time.perf_counter() - start:.1f} с")
+
+        pool = storage.ConnectionPool(pooled_path, size=4)
+        storage.pool = pool
+        start = time.perf_counter()
+        storage.init_database()
+        print(f"Создание индексов на существующих данных: {time.perf_counter() - start:.1f} с")
+
+        rnd = random.Random(1)
+        answer = "Ответ эксперта. " * 10
+
+        start = time.perf_counter()
+        for _ in range(args.inserts):
+            legacy_save_interaction(legacy_path, rnd.randrange(50000), rnd.choice(QUESTIONS), answer)
+        legacy_rate = args.inserts / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for _ in range(args.inserts):
+            storage.save_interaction(rnd.randrange(50000), "user", "Имя", None, rnd.choice(QUESTIONS), answer)
+        pooled_rate = args.inserts / (time.perf_counter() - start)
+
+        # Отложенная запись: на горячем пути остаётся только постановка в очередь
+        log = storage.WriteBehindLog(pool)
+        log.start()
+        hot_path = []
+        start = time.perf_counter()
+        for _ in range(args.inserts):
+            call_start = time.perf_counter()
+            log.log_interaction(rnd.randrange(50000), "user", "Имя", None, rnd.choice(QUESTIONS), answer)
+            hot_path.append((time.perf_counter() - call_start) * 1e6)
+        log.flush()
+        write_behind_rate = args.inserts / (time.perf_counter() - start)
+        log.close()
+
+        print(f"\n{'операция':<40} {'прежде':>12} {'пул + WAL':>12} {'write-behind':>14}")
+        print(f"{'вставок/с (до коммита)':<40} {legacy_rate:>12.0f} {pooled_rate:>12.0f} {write_behind_rate:>14.0f}")
+        print(f"{'задержка ответа на запись, мкс':<40} {1e6 / legacy_rate:>12.0f} {1e6 / pooled_rate:>12.0f} "
+              f"{statistics.median(hot_path):>14.1f}")
+        for days in (1, 7):
+            old = _measure(lambda: legacy_admin_stats(legacy_path, days), 3)
+            new = _measure(lambda: storage.get_admin_stats(days), 3)
+            print(f"{f'get_admin_stats({days}), мс':<40} {old:>12.1f} {new:>12.1f}")
+        old = _measure(lambda: legacy_user_count(legacy_path, 123), 5)
+        new = _measure(lambda: storage.get_user_interaction_count(123), 5)
+        print(f"{'get_user_interaction_count, мс':<40} {old:>12.2f} {new:>12.2f}")
+        pool.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
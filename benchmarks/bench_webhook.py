@@ -0,0 +1,113 @@
+"""Нагрузочный тест вебхука: время до ответа 200 при 50 одновременных пользователях.
+
+Поднимает локальную заглушку Bot API (getMe) и сервер из webhook.py, обработчик
+сообщений имитирует ответ LLM задержкой. Вебхук должен отвечать за миллисекунды,
+не дожидаясь обработки.
+Запуск из корня репозитория:
+    python benchmarks/bench_webhook.py [--users 50] [--messages 4] [--llm-latency 3]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web, ClientSession
+from telegram.ext import Application, MessageHandler, filters
+
+from webhook import create_web_app
+
+TOKEN = "123456:BENCHMARK"
+
+
+def _percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+async def _start_site(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, port
+
+
+async def run(users, messages, llm_latency):
+    # Заглушка Bot API: достаточно getMe для Application.initialize()
+    async def get_me(request):
+        return web.json_response({"ok": True, "result": {
+            "id": 123456, "is_bot": True, "first_name": "bench", "username": "bench_bot",
+        }})
+
+    stub = web.Application()
+    stub.router.add_post(f"/bot{TOKEN}/getMe", get_me)
+    stub_runner, stub_port = await _start_site(stub)
+
+    processed = []
+
+    async def slow_handler(update, context):
+        await asyncio.sleep(llm_latency)
+        processed.append(time.perf_counter())
+
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .base_url(f"http://127.0.0.1:{stub_port}/bot")
+        .update_queue(asyncio.Queue(maxsize=1000))
+        .concurrent_updates(32)
+        .build()
+    )
+    application.add_handler(MessageHandler(filters.TEXT, slow_handler))
+    runner, port = await _start_site(create_web_app(application, TOKEN))
+
+    latencies = []
+    url = f"http://127.0.0.1:{port}/{TOKEN}"
+
+    async def user(session, user_id):
+        for n in range(messages):
+            update = {
+                "update_id": user_id * 1000 + n,
+                "message": {
+                    "message_id": n + 1, "date": int(time.time()), "text": "Как залить фундамент?",
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                },
+            }
+            start = time.perf_counter()
+            async with session.post(url, json=update) as resp:
+                assert resp.status == 200, resp.status
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(user(session, uid) for uid in range(1, users + 1)))
+    acked = time.perf_counter() - start
+    while len(processed) < users * messages:
+        await asyncio.sleep(0.05)
+    done = time.perf_counter() - start
+
+    await runner.cleanup()
+    await stub_runner.cleanup()
+
+    print(f"Пользователей: {users}, сообщений: {users * messages}, задержка LLM: {llm_latency} с")
+    print(f"Время до 200 OK: p50 {_percentile(latencies, 50):.1f} мс, "
+          f"p95 {_percentile(latencies, 95):.1f} мс, p99 {_percentile(latencies, 99):.1f} мс, "
+          f"max {max(latencies):.1f} мс")
+    print(f"Все апдейты подтверждены за {acked:.2f} с, обработаны за {done:.2f} с")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=4)
+    parser.add_argument("--llm-latency", type=float, default=3.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.messages, args.llm_latency))
+
+
+if __name__ == "__main__":
+    main()
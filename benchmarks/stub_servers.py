@@ -0,0 +1,151 @@
+"""Локальные заглушки внешних сервисов для нагрузочных тестов (см. bench_load.py).
+
+* TelegramStub — Bot API: getMe, sendMessage, editMessageText,
+  answerCallbackQuery и прочие методы с ответом «ok». Каждое отправленное
+  ботом сообщение передаётся в on_message(chat_id, text, reply_markup).
+* OpenRouterStub — /api/v1/chat/completions: задержка до первого токена с
+  разбросом, доля ошибок, ответ целиком или потоком SSE по токену.
+* CntdStub — страницы поиска и документа docs.cntd.ru в той разметке,
+  которую разбирает бот.
+
+Все заглушки — aiohttp-приложения; start_site поднимает приложение на
+свободном порту 127.0.0.1.
+"""
+import json
+import time
+import random
+import asyncio
+
+from aiohttp import web
+
+
+async def start_site(app, port=0):
+    """Запускает app на 127.0.0.1; возвращает (runner, порт)"""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+class TelegramStub:
+    """Bot API по адресу http://127.0.0.1:<порт>/bot<token>/<method>"""
+
+    BOT_USER = {"id": 123456, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+    def __init__(self, token, on_message=None):
+        self.token = token
+        self.on_message = on_message
+        self.calls = {}
+        self._message_id = 0
+        self.app = web.Application()
+        self.app.router.add_post(f"/bot{token}/{{method}}", self._handle)
+
+    async def _params(self, request):
+        # python-telegram-bot шлёт параметры формой, вложенные объекты — строками JSON
+        if request.content_type == "application/json":
+            return await request.json()
+        params = dict(await request.post())
+        for key in ("reply_markup", "entities"):
+            if isinstance(params.get(key), str):
+                params[key] = json.loads(params[key])
+        return params
+
+    async def _handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getMe":
+            return web.json_response({"ok": True, "result": self.BOT_USER})
+        params = await self._params(request)
+        if method not in ("sendMessage", "editMessageText"):
+            return web.json_response({"ok": True, "result": True})
+
+        chat_id = int(params["chat_id"])
+        if self.on_message is not None:
+            self.on_message(chat_id, params.get("text", ""), params.get("reply_markup"))
+        if method == "sendMessage":
+            self._message_id += 1
+            message_id = self._message_id
+        else:
+            message_id = int(params["message_id"])
+        return web.json_response({"ok": True, "result": {
+            "message_id": message_id, "date": int(time.time()), "text": params.get("text", ""),
+            "chat": {"id": chat_id, "type": "private"}, "from": self.BOT_USER,
+        }})
+
+
+class OpenRouterStub:
+    """Модель с задержкой latency ± jitter до первого токена и token_interval между токенами"""
+
+    PATH = "/api/v1/chat/completions"
+
+    def __init__(self, latency=1.0, jitter=0.3, tokens=60, token_interval=0.02, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens = tokens
+        self.token_interval = token_interval
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self.cancelled = 0
+        self._random = random.Random(seed)
+        self.app = web.Application()
+        self.app.router.add_post(self.PATH, self._handle)
+
+    def _words(self):
+        return [f"слово{i} " for i in range(self.tokens)]
+
+    async def _handle(self, request):
+        payload = await request.json()
+        self.requests += 1
+        await asyncio.sleep(max(0.0, self._random.uniform(self.latency - self.jitter, self.latency + self.jitter)))
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"error": {"message": "stub failure"}}, status=500)
+
+        if not payload.get("stream"):
+            await asyncio.sleep(self.tokens * self.token_interval)
+            return web.json_response({"choices": [{"message": {"content": "".join(self._words())}}]})
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        try:
+            await response.prepare(request)
+            await response.write(b": OPENROUTER PROCESSING\n\n")
+            for word in self._words():
+                chunk = {"choices": [{"delta": {"content": word}}]}
+                await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+                await asyncio.sleep(self.token_interval)
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            # Бот отменил проигравший хеджированный запрос
+            self.cancelled += 1
+        return response
+
+
+class CntdStub:
+    """Поиск и документ docs.cntd.ru с задержкой latency"""
+
+    def __init__(self, latency=0.3):
+        self.latency = latency
+        self.requests = 0
+        self.app = web.Application()
+        self.app.router.add_get("/search", self._search)
+        self.app.router.add_get("/document/{doc_id}", self._document)
+
+    async def _search(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        doc_id = abs(hash(request.query.get("text", ""))) % 1000
+        html = (
+            '<div class="search-results__item">'
+            f'<a href="/document/{doc_id}">СП {doc_id}.13330.2024 Заглушка свода правил</a>'
+            '<span class="document-info__status">Действующий</span></div>'
+        )
+        return web.Response(text=html, content_type="text/html")
+
+    async def _document(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        paragraphs = "".join(f"<p>Пункт {i}. Требования к конструкциям и материалам заглушки.</p>" for i in range(40))
+        return web.Response(text=f'<div class="document-content">{paragraphs}</div>', content_type="text/html")
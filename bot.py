@@ -1,43 +1,63 @@
 import os
 import logging
 import asyncio
-import sqlite3
 import json
-import threading
-from concurrent.futures import ThreadPoolExecutor
-from flask import Flask, request, send_file
+import sqlite3
+from aiohttp import web
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import (
     Application,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
     ContextTypes,
+    ApplicationHandlerStop,
     filters,
 )
 import httpx
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from datetime import datetime, timedelta
+from datetime import datetime
 from selectolax.parser import HTMLParser
 from dotenv import load_dotenv
-import glob
-import pandas as pd
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment
 import tempfile
 import time
-from collections import defaultdict
-import schedule
 import pytz
 import atexit
 
 # === Настройки ===
 load_dotenv()
+
+# Модули бота читают свои настройки из окружения при импорте, поэтому импортируем их после load_dotenv()
+from storage import (
+    init_database,
+    run_db,
+    write_log,
+    ahas_given_feedback,
+    get_stats_summary,
+    has_low_rating,
+    run_maintenance,
+    close_storage,
+)
+from answer_cache import AnswerCache
+from ttl_cache import SQLiteCacheTier, TieredCache
+from webhook import MAX_CONCURRENT_UPDATES, WEBHOOK_QUEUE_SIZE, create_web_app
+from timings import StageTimings
+import metrics
+from model_router import ModelCallError, ModelRouter, parse_retry_after
+from prompt_builder import build_user_prompt
+from session_store import REDIS_URL, SessionPersistence, create_backend
+from rate_limiter import ConcurrencyLimiter, RateLimiter, SharedRateLimiter
+from stats_export import MAX_DOCUMENT_BYTES, export_stats, parse_stats_args
+from scheduler import Scheduler
+
 BOT_TOKEN = os.environ.get("BOT_TOKEN", "")
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "")
 MODEL = os.environ.get("OPENROUTER_MODEL", "minimax/minimax-m2:free")
 ADMIN_ID = int(os.environ.get("ADMIN_ID", "364191893"))
+# Адреса внешних сервисов; переопределяются для нагрузочных тестов с заглушками (benchmarks/bench_load.py)
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+OPENROUTER_URL = os.environ.get("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+CNTD_URL = os.environ.get("CNTD_URL", "https://docs.cntd.ru")
 
 if not BOT_TOKEN or not OPENROUTER_API_KEY:
     error_msg = "❌ ОШИБКА КОНФИГУРАЦИИ:\n"
@@ -58,186 +78,83 @@ if not BOT_TOKEN or not OPENROUTER_API_KEY:
 logging.info(f"Бот настроен. Админ ID: {ADMIN_ID}")
 
 # === База данных ===
-def init_database():
-    conn = sqlite3.connect('bot_feedback.db')
-    cursor = conn.cursor()
-    
-    # Таблица для отслеживания взаимодействий пользователей
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_interactions (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            question TEXT NOT NULL,
-            answer TEXT NOT NULL,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            session_id TEXT,
-            feedback_given BOOLEAN DEFAULT FALSE
-        )
-    ''')
-    
-    # Таблица для обратной связи
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS feedback (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            interaction_id INTEGER NOT NULL,
-            rating INTEGER NOT NULL CHECK (rating >= 1 AND rating <= 5),
-            comment TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (interaction_id) REFERENCES user_interactions (id),
-            UNIQUE(user_id, interaction_id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-
-# Инициализируем базу данных
 init_database()
+# Фоновая отложенная запись; остаток очереди дописывается в cleanup_resources при завершении
+write_log.start()
 
 # === Система управления пользователями и rate limiting ===
-# Словарь для отслеживания последней активности пользователей
-user_last_activity = defaultdict(float)
-# Словарь для подсчета запросов пользователей за минуту
-user_request_counts = defaultdict(int)
-# Блокировка для потокобезопасности
-db_lock = threading.Lock()
-
-# Rate limiting: максимум 10 запросов в минуту на пользователя
-MAX_REQUESTS_PER_MINUTE = 10
-RATE_LIMIT_WINDOW = 60  # секунд
-
-def check_rate_limit(user_id):
+# Сессии (user_data) живут в общем хранилище (SQLite или Redis, см. session_store.py),
+# поэтому переживают перезапуск и общие для всех воркеров
+session_backend = create_backend()
+session_persistence = SessionPersistence(session_backend)
+
+# Rate limiting (см. rate_limiter.py): вопросы к модели и дешёвые действия (кнопки)
+# считаются отдельно; burst — сколько запросов можно сделать подряд
+MAX_REQUESTS_PER_MINUTE = int(os.environ.get("RATE_LIMIT_PER_MINUTE", "10"))
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", "3"))
+CALLBACKS_PER_MINUTE = int(os.environ.get("RATE_LIMIT_CALLBACKS_PER_MINUTE", "60"))
+CALLBACKS_BURST = int(os.environ.get("RATE_LIMIT_CALLBACKS_BURST", "20"))
+# Общий для воркеров лимит через хранилище сессий; с SQLite это запись на каждый запрос,
+# поэтому по умолчанию включён только с Redis
+RATE_LIMIT_SHARED = os.environ.get("RATE_LIMIT_SHARED", "1" if REDIS_URL else "0") == "1"
+# Не больше стольких одновременных запросов к OpenRouter на воркер (0 — без ограничения)
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", "0"))
+
+if RATE_LIMIT_SHARED:
+    llm_rate_limiter = SharedRateLimiter(session_backend, "llm", MAX_REQUESTS_PER_MINUTE, RATE_LIMIT_BURST)
+    callback_rate_limiter = SharedRateLimiter(session_backend, "callback", CALLBACKS_PER_MINUTE, CALLBACKS_BURST)
+else:
+    llm_rate_limiter = RateLimiter(MAX_REQUESTS_PER_MINUTE, RATE_LIMIT_BURST)
+    callback_rate_limiter = RateLimiter(CALLBACKS_PER_MINUTE, CALLBACKS_BURST)
+llm_slots = ConcurrencyLimiter(LLM_CONCURRENCY)
+RATE_LIMITED = metrics.counter("bot_rate_limited_total", "Отклонённые rate limit запросы", ("limiter",))
+
+async def check_rate_limit(limiter, user_id):
     """Проверяет rate limit для пользователя"""
-    current_time = time.time()
-    
-    # Очищаем старые записи (старше минуты)
-    if user_id in user_last_activity:
-        if current_time - user_last_activity[user_id] > RATE_LIMIT_WINDOW:
-            user_request_counts[user_id] = 0
-            user_last_activity[user_id] = current_time
-    
-    # Проверяем лимит
-    if user_request_counts[user_id] >= MAX_REQUESTS_PER_MINUTE:
-        return False
-    
-    # Увеличиваем счетчик
-    user_request_counts[user_id] += 1
-    user_last_activity[user_id] = current_time
-    return True
-
-# === Вспомогательные функции для работы с БД ===
-def save_interaction(user_id, username, first_name, last_name, question, answer, session_id=None):
-    with db_lock:
-        conn = sqlite3.connect('bot_feedback.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO user_interactions (user_id, username, first_name, last_name, question, answer, session_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, username, first_name, last_name, question, answer, session_id))
-        interaction_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        return interaction_id
-
-def save_feedback(user_id, interaction_id, rating, comment):
-    with db_lock:
-        conn = sqlite3.connect('bot_feedback.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO feedback (user_id, interaction_id, rating, comment)
-            VALUES (?, ?, ?, ?)
-        ''', (user_id, interaction_id, rating, comment))
-        
-        # Отмечаем, что обратная связь была дана
-        cursor.execute('''
-            UPDATE user_interactions SET feedback_given = TRUE WHERE id = ?
-        ''', (interaction_id,))
-        
-        conn.commit()
-        conn.close()
-
-def get_user_interaction_count(user_id, days=30):
-    with db_lock:
-        conn = sqlite3.connect('bot_feedback.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT COUNT(*) FROM user_interactions 
-            WHERE user_id = ? AND timestamp >= datetime('now', '-{} days')
-        '''.format(days), (user_id,))
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count
-
-def has_given_feedback(user_id, interaction_id):
-    with db_lock:
-        conn = sqlite3.connect('bot_feedback.db')
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT COUNT(*) FROM feedback WHERE user_id = ? AND interaction_id = ?
-        ''', (user_id, interaction_id))
-        count = cursor.fetchone()[0]
-        conn.close()
-        return count > 0
-
-def get_admin_stats(days=30):
-    with db_lock:
-        conn = sqlite3.connect('bot_feedback.db')
-        
-        # Получаем статистику за последние N дней
-        query = '''
-            SELECT 
-                ui.user_id,
-                ui.username,
-                ui.first_name,
-                ui.last_name,
-                ui.question,
-                ui.answer,
-                ui.timestamp,
-                f.rating,
-                f.comment
-            FROM user_interactions ui
-            LEFT JOIN feedback f ON ui.id = f.interaction_id
-            WHERE ui.timestamp >= datetime('now', '-{} days')
-            ORDER BY ui.timestamp DESC
-        '''.format(days)
-        
-        df = pd.read_sql_query(query, conn)
-        conn.close()
-        return df
+    if not RATE_LIMIT_SHARED:
+        return limiter.allow(user_id)
+    try:
+        return await asyncio.to_thread(limiter.allow, user_id)
+    except Exception as e:
+        # Недоступное хранилище не должно блокировать ответы
+        logging.error(f"Ошибка rate limit для {user_id}: {e}")
+        return True
+
+async def throttle_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отсекает слишком частые нажатия кнопок до их обработчиков"""
+    if await check_rate_limit(callback_rate_limiter, update.effective_user.id):
+        return
+    RATE_LIMITED.inc("callback")
+    await update.callback_query.answer("⚠️ Слишком часто, подождите немного")
+    raise ApplicationHandlerStop
 
 # === Функции для работы с Telegram статистикой ===
 def get_daily_stats():
     """Получает статистику за последние 24 часа"""
     try:
-        df = get_admin_stats(1)  # За последние 24 часа
+        # Счётчики и топы читаются из почасовых сводок, а не из всех взаимодействий за сутки
+        summary = get_stats_summary(24)
         
-        if df.empty:
+        if not summary["interactions"]:
             return "📊 **Статистика за последние 24 часа:**\n\nНет данных за этот период."
         
         # Статистика
-        total_interactions = len(df)
-        unique_users = df['user_id'].nunique()
-        ratings_count = df['rating'].notna().sum()
-        comments_count = df['comment'].notna().sum()
-        avg_rating = df['rating'].mean() if ratings_count > 0 else 0
+        total_interactions = summary["interactions"]
+        unique_users = summary["users"]
+        ratings_count = summary["ratings"]
+        comments_count = summary["comments"]
+        avg_rating = summary["rating_sum"] / ratings_count if ratings_count > 0 else 0
         
         # Топ пользователей по активности
-        top_users = df.groupby('user_id').size().sort_values(ascending=False).head(3)
         top_users_text = ""
-        for user_id, count in top_users.items():
-            user_info = df[df['user_id'] == user_id].iloc[0]
-            username = user_info['username'] or f"ID{user_id}"
-            name = user_info['first_name'] or ""
+        for user_id, username, first_name, count in summary["top_users"]:
+            username = username or f"ID{user_id}"
+            name = first_name or ""
             top_users_text += f"• {username} ({name}): {count} вопросов\n"
         
         # Топ вопросов
-        top_questions = df['question'].value_counts().head(3)
         top_questions_text = ""
-        for question, count in top_questions.items():
+        for question, count in summary["top_questions"]:
             short_q = question[:50] + "..." if len(question) > 50 else question
             top_questions_text += f"• \"{short_q}\": {count} раз\n"
         
@@ -259,7 +176,15 @@ def get_daily_stats():
 
 **💬 Система обратной связи:**
 • Процент оцененных ответов: {(ratings_count/total_interactions*100):.1f}%
-• Процент с комментариями: {(comments_count/total_interactions*100):.1f}%"""
+• Процент с комментариями: {(comments_count/total_interactions*100):.1f}%
+
+**⚡ Кэш ответов:**
+• Из кэша: {answer_cache.hits} из {answer_cache.lookups} вопросов без истории ({answer_cache.hit_rate()*100:.1f}%)
+• Записей в кэше: {len(answer_cache)}
+
+**🗄 Кэш docs.cntd.ru (с момента запуска):**
+{format_cache_stats("Поиск", cntd_search_cache)}
+{format_cache_stats("Документы", cntd_document_cache)}"""
         
         return stats_text
         
@@ -267,10 +192,17 @@ def get_daily_stats():
         logging.error(f"Ошибка при создании статистики: {e}")
         return f"❌ Ошибка при создании статистики: {e}"
 
+def format_cache_stats(name, cache):
+    """Строка с попаданиями в кэш для статистики"""
+    stats = cache.stats()
+    hits = stats["hits"] + stats["disk_hits"]
+    lookups = hits + stats["misses"]
+    return f"• {name}: {hits} из {lookups} запросов из кэша ({stats['hit_rate']*100:.1f}%), записей: {stats['size']}"
+
 async def send_daily_stats_to_admin():
     """Отправляет ежедневную статистику администратору в Telegram"""
     try:
-        stats_text = get_daily_stats()
+        stats_text = await run_db(get_daily_stats)
         
         # Отправляем сообщение администратору
         await application.bot.send_message(
@@ -280,14 +212,12 @@ async def send_daily_stats_to_admin():
         )
         
         logging.info(f"Ежедневная статистика отправлена администратору (ID: {ADMIN_ID})")
+        # Доля попаданий в кэш ответов считается за период между отчётами
+        answer_cache.reset_stats()
         
     except Exception as e:
         logging.error(f"Ошибка при отправке статистики администратору: {e}")
 
-# === Функции для работы с историей диалога ===
-
-# === Функции для работы с историей диалога ===
-
 # === Функции для работы с историей диалога ===
 def add_to_conversation_history(user_data, question, answer):
     """Добавляет вопрос и ответ в историю диалога пользователя"""
@@ -307,18 +237,6 @@ def add_to_conversation_history(user_data, question, answer):
     
     return user_data['conversation_history']
 
-def get_conversation_context(user_data):
-    """Возвращает контекст диалога для передачи в ИИ"""
-    if 'conversation_history' not in user_data or not user_data['conversation_history']:
-        return ""
-    
-    context_parts = []
-    for i, entry in enumerate(user_data['conversation_history'], 1):
-        context_parts.append(f"Вопрос {i}: {entry['question']}")
-        context_parts.append(f"Ответ {i}: {entry['answer']}")
-    
-    return "\n\n".join(context_parts)
-
 def clear_conversation_history(user_data):
     """Очищает историю диалога пользователя"""
     user_data['conversation_history'] = []
@@ -326,48 +244,107 @@ def clear_conversation_history(user_data):
 
 # === Логирование ===
 logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO
+    format="%(asctime)s - %(name)s - %(levelname)s - [%(trace_id)s] %(message)s",
+    level=logging.INFO,
+    # Модули, импортированные выше, могли уже писать в лог и настроить его по умолчанию
+    force=True,
 )
+# trace_id обработки апдейта (см. metrics.py) — в каждой строке лога
+for _handler in logging.getLogger().handlers:
+    _handler.addFilter(metrics.TraceIdFilter())
 
 # === Загрузка базы знаний из base_knowledge/*.txt ===
-_knowledge_chunks = []
-knowledge_dir = "base_knowledge"
-
-if os.path.exists(knowledge_dir):
-    txt_files = sorted(glob.glob(os.path.join(knowledge_dir, "*.txt")))
-    if not txt_files:
-        print("⚠️ В папке base_knowledge нет .txt файлов")
-    for path in txt_files:
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                text = f.read().strip()
-                # Разбиваем на чанки по ~500 слов
-                sentences = text.split(". ")
-                current_chunk = ""
-                for sent in sentences:
-                    if len(current_chunk.split()) + len(sent.split()) > 500:
-                        if len(current_chunk) > 50:
-                            _knowledge_chunks.append(current_chunk.strip())
-                        current_chunk = sent + ". "
-                    else:
-                        current_chunk += sent + ". "
-                if current_chunk and len(current_chunk) > 50:
-                    _knowledge_chunks.append(current_chunk.strip())
-        except Exception as e:
-            logging.error(f"Ошибка чтения {path}: {e}")
+# Индекс загружается в фоне уже после открытия порта (load_knowledge); до этого поиск пуст.
+# knowledge_index тянет numpy и scipy, поэтому импортируется там же, а не при старте
+_knowledge_index = None
+_knowledge_ready = False
+_knowledge_load_task = None
+_knowledge_reload_lock = asyncio.Lock()
+
+def _load_knowledge_index():
+    from knowledge_index import KNOWLEDGE_DIR, list_knowledge_files, load_or_build_index
+
+    if not os.path.exists(KNOWLEDGE_DIR):
+        print("⚠️ Папка base_knowledge не найдена, ищу готовый индекс в knowledge_cache/")
+    elif not list_knowledge_files(KNOWLEDGE_DIR):
+        print("⚠️ В папке base_knowledge нет .txt и .pdf файлов")
+    # Индекс берётся из кэша knowledge_cache/ (его же собирает prepare_knowledge.py)
+    # и пересобирается только при изменении файлов базы знаний
+    index = load_or_build_index(KNOWLEDGE_DIR)
+    print(f"✅ Загружено {len(index) if index else 0} фрагментов из base_knowledge/")
+    return index
+
+async def load_knowledge():
+    """Первая загрузка индекса; reload_knowledge ждёт её на той же блокировке"""
+    global _knowledge_index, _knowledge_ready
+    async with _knowledge_reload_lock:
+        index = await asyncio.to_thread(_load_knowledge_index)
+        if index is not None:
+            _knowledge_index = index
+            _knowledge_ready = True
+
+async def start_knowledge_loading(app):
+    global _knowledge_load_task
+    _knowledge_load_task = asyncio.create_task(load_knowledge())
+
+# === Горячая перезагрузка базы знаний ===
+
+async def reload_knowledge(force=False):
+    """Пересобирает индекс, если файлы base_knowledge/ добавлены, изменены или удалены.
+
+    Проверка — stat файлов (хэш только у изменившихся по mtime/размеру);
+    force пересчитывает все хэши и проверяет индекс в любом случае (если
+    кэш уже совпадает с файлами, он только перечитывается, без пересборки).
+    Сборка идёт в отдельном процессе и разбирает заново только изменённые
+    файлы; готовый индекс читается из кэша и подменяет текущий одним
+    присваиванием — запросы тем временем обслуживает старый.
+    Возвращает статистику сборки или None, если ничего не изменилось.
+    """
+    from knowledge_index import (
+        CACHE_DIR, KNOWLEDGE_DIR, KnowledgeIndex, corpus_fingerprint, rebuild_in_subprocess, scan_sources,
+    )
 
-    print(f"✅ Загружено {len(_knowledge_chunks)} фрагментов из base_knowledge/")
-else:
-    print("❌ Папка base_knowledge не найдена!")
+    global _knowledge_index, _knowledge_ready
+    async with _knowledge_reload_lock:
+        current = _knowledge_index
+        previous = current.manifest if current is not None else None
+        if not force:
+            manifest = await asyncio.to_thread(scan_sources, KNOWLEDGE_DIR, previous)
+            if not manifest or (current is not None and corpus_fingerprint(manifest) == current.fingerprint):
+                return None
+
+        started = time.perf_counter()
+        stats = await rebuild_in_subprocess(KNOWLEDGE_DIR, CACHE_DIR, previous, rehash=force)
+        stats["seconds"] = time.perf_counter() - started
+        if "fingerprint" not in stats:
+            logging.warning("В base_knowledge нет фрагментов, остаётся прежний индекс")
+            return stats
+        index = await asyncio.to_thread(KnowledgeIndex.load, CACHE_DIR, stats["fingerprint"])
+        if index is None:
+            raise RuntimeError("Собранный индекс не удалось загрузить из кэша")
+        _knowledge_index = index
+        _knowledge_ready = True
+        return stats
+
+def format_reload_stats(stats):
+    """Краткое описание пересборки для лога и ответа админу"""
+    return (
+        f"файлов {stats['files']} (новых {len(stats['added'])}, изменённых {len(stats['changed'])}, "
+        f"удалённых {len(stats['removed'])}, разобрано заново {len(stats['parsed'])}), "
+        f"фрагментов {stats['chunks']} (убрано дубликатов {stats['duplicates']}, "
+        f"почти дубликатов {stats['near_duplicates']})"
+    )
 
-# Подготавливаем TF-IDF векторизатор
-if _knowledge_chunks:
-    _vectorizer = TfidfVectorizer(stop_words=None)
-    _vectorizer.fit(_knowledge_chunks)
-    _knowledge_ready = True
-else:
-    _knowledge_ready = False
+# === Кэш ответов ===
+# Порог косинусной близости вопросов; ANSWER_CACHE_THRESHOLD=0 отключает кэш
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.9"))
+ANSWER_CACHE_ENABLED = ANSWER_CACHE_THRESHOLD > 0
+# Оценка, при которой (и ниже) ответ снимается с кэша
+LOW_RATING = 2
+answer_cache = AnswerCache(
+    threshold=ANSWER_CACHE_THRESHOLD,
+    maxsize=int(os.environ.get("ANSWER_CACHE_SIZE", "2000")),
+)
 
 # === Приветствие ===
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -424,11 +401,7 @@ async def ask_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
 def retrieve_relevant_chunks(query, top_k=3):
     if not _knowledge_ready:
         return []
-    query_vec = _vectorizer.transform([query])
-    knowledge_vecs = _vectorizer.transform(_knowledge_chunks)
-    similarities = cosine_similarity(query_vec, knowledge_vecs).flatten()
-    top_indices = similarities.argsort()[-top_k:][::-1]
-    return [_knowledge_chunks[i] for i in top_indices if similarities[i] > 0.1]
+    return _knowledge_index.search(query, top_k=top_k)
 
 # === Глобальные HTTP клиенты для оптимизации ===
 # Создаем глобальный HTTP клиент с пулом соединений
@@ -439,61 +412,142 @@ http_client = httpx.AsyncClient(
 )
 
 # === Ищет актуальные нормативные документы на docs.cntd.ru ===
+CNTD_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+    "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "none",
+    "Sec-Fetch-User": "?1",
+}
+
+# Кэш поиска (нормализованный запрос -> список документов) и текстов документов (URL -> текст).
+# Дисковый уровень переживает перезапуск; CNTD_CACHE_DB= (пусто) отключает его
+CNTD_CACHE_TTL = float(os.environ.get("CNTD_CACHE_TTL", str(24 * 3600)))
+CNTD_CACHE_DB = os.environ.get("CNTD_CACHE_DB", "cntd_cache.db")
+try:
+    _cntd_disk_cache = SQLiteCacheTier(CNTD_CACHE_DB) if CNTD_CACHE_DB else None
+except sqlite3.Error as e:
+    logging.warning(f"Дисковый кэш cntd.ru недоступен: {e}")
+    _cntd_disk_cache = None
+cntd_search_cache = TieredCache("cntd_search", maxsize=512, ttl=CNTD_CACHE_TTL, disk=_cntd_disk_cache)
+cntd_document_cache = TieredCache("cntd_document", maxsize=256, ttl=CNTD_CACHE_TTL, disk=_cntd_disk_cache)
+CNTD_FAILURES = metrics.counter("bot_cntd_failures_total", "Ошибки поиска на docs.cntd.ru")
+
+def normalize_cntd_query(query: str) -> str:
+    """Приводит запрос к ключу кэша: регистр, ё, пунктуация по краям, пробелы"""
+    return " ".join(query.lower().replace("ё", "е").strip(" \t\n?!.,;:«»\"'").split())
+
+async def _cntd_search_results(query: str) -> list:
+    cache_key = normalize_cntd_query(query)
+    results = await cntd_search_cache.aget(cache_key)
+    if results is not None:
+        return results
+
+    response = await http_client.get(f"{CNTD_URL}/search", params={"text": query}, headers=CNTD_HEADERS)
+    response.raise_for_status()
+
+    # Парсинг без изменений
+    tree = HTMLParser(response.text)
+    results = []
+    for item in tree.css("div.search-results__item"):
+        title_node = item.css_first("a")
+        if not title_node:
+            continue
+        title = title_node.text().strip()
+        href = title_node.attributes.get("href")
+        if not href or not href.startswith("/document/"):
+            continue
+        status_node = item.css_first("span.document-info__status")
+        status = status_node.text().strip().lower() if status_node else ""
+        if "отмен" in status or "не действует" in status:
+            continue
+        results.append({"title": title, "url": CNTD_URL + href})
+
+    # Кэшируем и пустую выдачу, чтобы не повторять заведомо пустой поиск
+    await cntd_search_cache.aset(cache_key, results)
+    return results
+
+async def _cntd_document_content(doc_url: str, max_chars: int) -> str:
+    content = await cntd_document_cache.aget(doc_url)
+    if content is not None:
+        return content
+
+    doc_resp = await http_client.get(doc_url)
+    doc_resp.raise_for_status()
+    doc_tree = HTMLParser(doc_resp.text)
+    content = ""
+    for p in doc_tree.css("div.document-content p"):
+        text = p.text().strip()
+        if text and len(text) > 20:
+            content += text + "\n"
+            if len(content) > max_chars:
+                break
+
+    await cntd_document_cache.aset(doc_url, content)
+    return content
 
 async def search_cntd(query: str, max_chars=1500) -> str:
     try:
-        search_url = f"https://docs.cntd.ru/search?text={query}"
-        response = await http_client.get(search_url, headers={
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/129.0.0.0 Safari/537.36",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
-            "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
-            "Accept-Encoding": "gzip, deflate, br",
-            "Connection": "keep-alive",
-            "Upgrade-Insecure-Requests": "1",
-            "Sec-Fetch-Dest": "document",
-            "Sec-Fetch-Mode": "navigate",
-            "Sec-Fetch-Site": "none",
-            "Sec-Fetch-User": "?1",
-        })
-        response.raise_for_status()
-
-        # Парсинг без изменений
-        tree = HTMLParser(response.text)
-        results = []
-        for item in tree.css("div.search-results__item"):
-            title_node = item.css_first("a")
-            if not title_node:
-                continue
-            title = title_node.text().strip()
-            href = title_node.attributes.get("href")
-            if not href or not href.startswith("/document/"):
-                continue
-            status_node = item.css_first("span.document-info__status")
-            status = status_node.text().strip().lower() if status_node else ""
-            if "отмен" in status or "не действует" in status:
-                continue
-            results.append({"title": title, "url": "https://docs.cntd.ru" + href})
-
+        results = await _cntd_search_results(query)
         if not results:
             return ""
 
-        doc_url = results[0]["url"]
-        doc_resp = await http_client.get(doc_url)
-        doc_tree = HTMLParser(doc_resp.text)
-        content = ""
-        for p in doc_tree.css("div.document-content p"):
-            text = p.text().strip()
-            if text and len(text) > 20:
-                content += text + "\n"
-                if len(content) > max_chars:
-                    break
-
+        content = await _cntd_document_content(results[0]["url"], max_chars)
         return f"[Источник: {results[0]['title']}]\n{content[:max_chars]}..." if content else ""
 
     except Exception as e:
+        CNTD_FAILURES.inc()
         logging.error(f"Ошибка поиска на cntd.ru: {e}")
         return ""
-        
+
+# === Параллельный сбор контекста ===
+async def _retrieve_when_loaded(user_text):
+    # Вопросы сразу после старта ждут фоновую загрузку индекса в пределах RETRIEVAL_DEADLINE;
+    # shield: отмена по дедлайну не должна прерывать саму загрузку
+    if _knowledge_load_task is not None and not _knowledge_load_task.done():
+        await asyncio.shield(_knowledge_load_task)
+    return await asyncio.to_thread(retrieve_relevant_chunks, user_text)
+
+# Бюджет времени каждого источника, сек, от начала сбора: что не успело — не ждём
+RETRIEVAL_DEADLINE = float(os.environ.get("RETRIEVAL_DEADLINE", "2.0"))
+CNTD_DEADLINE = float(os.environ.get("CNTD_DEADLINE", "5.0"))
+
+async def gather_knowledge(user_text: str, is_normative: bool, timings: StageTimings):
+    """Запускает локальный поиск (в потоке) и, для вопросов о нормативах, поиск на cntd.ru
+    одновременно. Возвращает (online_context, relevant_chunks) из того, что успело к дедлайнам"""
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    sources = {"retrieval": (_retrieve_when_loaded(user_text), RETRIEVAL_DEADLINE, [])}
+    if is_normative:
+        sources["cntd"] = (search_cntd(user_text), CNTD_DEADLINE, "")
+
+    tasks = {}
+    for name, (coro, _, _) in sources.items():
+        task = asyncio.create_task(coro)
+        # Длительность пишем по факту завершения, даже если ответ уже ушёл без этого источника
+        task.add_done_callback(lambda _, name=name: timings.stages.setdefault(name, loop.time() - started))
+        tasks[name] = task
+
+    results = {}
+    for name, (_, deadline, default) in sorted(sources.items(), key=lambda item: item[1][1]):
+        try:
+            # shield: опоздавший поиск на cntd.ru доработает в фоне и прогреет кэш
+            results[name] = await asyncio.wait_for(asyncio.shield(tasks[name]), max(0.0, started + deadline - loop.time()))
+        except asyncio.TimeoutError:
+            logging.warning(f"Источник {name} не уложился в {deadline:.1f} с, отвечаю без него")
+            timings.record(name, loop.time() - started, timed_out=True)
+            results[name] = default
+        except Exception as e:
+            logging.error(f"Ошибка источника {name}: {e}")
+            results[name] = default
+
+    return results.get("cntd", ""), results["retrieval"]
+
 # === Обработка обратной связи ===
 async def handle_feedback_request(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -505,7 +559,7 @@ async def handle_feedback_request(update: Update, context: ContextTypes.DEFAULT_
     interaction_id = int(query.data.split("_")[1])
     
     # Проверяем, не давал ли уже пользователь обратную связь
-    if has_given_feedback(update.effective_user.id, interaction_id):
+    if await ahas_given_feedback(update.effective_user.id, interaction_id):
         await query.message.reply_text(
             "✅ Вы уже оценили этот ответ. Спасибо за обратную связь!"
         )
@@ -548,7 +602,10 @@ async def handle_feedback_rating(update: Update, context: ContextTypes.DEFAULT_T
         return
     
     # Сохраняем оценку
-    save_feedback(update.effective_user.id, interaction_id, rating, None)
+    write_log.log_feedback(update.effective_user.id, interaction_id, rating, None)
+    if rating <= LOW_RATING:
+        # Плохо оценённый ответ больше не выдаём из кэша
+        answer_cache.invalidate(interaction_id)
     
     await query.message.reply_text(
         f"✅ Спасибо за оценку {rating} звезд! "
@@ -582,13 +639,7 @@ async def handle_feedback_comment(update: Update, context: ContextTypes.DEFAULT_
         return
     
     # Обновляем комментарий в базе
-    conn = sqlite3.connect('bot_feedback.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        UPDATE feedback SET comment = ? WHERE interaction_id = ? AND user_id = ?
-    ''', (comment, interaction_id, update.effective_user.id))
-    conn.commit()
-    conn.close()
+    write_log.log_feedback_comment(update.effective_user.id, interaction_id, comment)
     
     await update.message.reply_text(
         "✅ Спасибо за комментарий! Ваше мнение поможет улучшить качество консультаций.",
@@ -606,88 +657,253 @@ async def handle_admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if update.effective_user.id != ADMIN_ID:
         await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
         return
-    
+
+    # /stats [дней | ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]] [xlsx|csv|parquet]; даты — по Москве
+    now = datetime.now(pytz.timezone('Europe/Moscow'))
     try:
-        # Получаем статистику за последние 30 дней
-        df = get_admin_stats(30)
-        
-        if df.empty:
-            await update.message.reply_text("📊 За последние 30 дней нет данных для анализа.")
+        start, end, fmt, period = parse_stats_args(context.args or [], now)
+    except ValueError as e:
+        await update.message.reply_text(str(e))
+        return
+
+    # В БД время хранится в UTC (CURRENT_TIMESTAMP)
+    utc_start, utc_end = (
+        moment.astimezone(pytz.utc).strftime('%Y-%m-%d %H:%M:%S') for moment in (start, end)
+    )
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{fmt}') as tmp_file:
+        tmp_file_path = tmp_file.name
+    try:
+        # Строки идут из курсора прямо в файл в отдельном потоке, event loop не блокируется
+        summary = await asyncio.to_thread(export_stats, utc_start, utc_end, fmt, tmp_file_path)
+
+        if not summary.rows:
+            await update.message.reply_text(f"📊 {period.capitalize()} нет данных для анализа.")
             return
-        
-        # Создаем Excel файл
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Статистика бота"
-        
-        # Заголовки
-        headers = [
-            "ID пользователя", "Имя пользователя", "Имя", "Фамилия", 
-            "Вопрос", "Ответ", "Дата/время", "Оценка", "Комментарий"
-        ]
-        
-        for col, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col, value=header)
-            cell.font = Font(bold=True)
-            cell.alignment = Alignment(horizontal='center')
-        
-        # Данные
-        for row_idx, (_, row) in enumerate(df.iterrows(), 2):
-            ws.cell(row=row_idx, column=1, value=row['user_id'])
-            ws.cell(row=row_idx, column=2, value=row['username'] or '')
-            ws.cell(row=row_idx, column=3, value=row['first_name'] or '')
-            ws.cell(row=row_idx, column=4, value=row['last_name'] or '')
-            ws.cell(row=row_idx, column=5, value=row['question'][:100] + '...' if len(str(row['question'])) > 100 else row['question'])
-            ws.cell(row=row_idx, column=6, value=row['answer'][:100] + '...' if len(str(row['answer'])) > 100 else row['answer'])
-            ws.cell(row=row_idx, column=7, value=row['timestamp'])
-            ws.cell(row=row_idx, column=8, value=row['rating'] if pd.notna(row['rating']) else 'Нет оценки')
-            ws.cell(row=row_idx, column=9, value=row['comment'] or '')
-        
-        # Автоширина колонок
-        for column in ws.columns:
-            max_length = 0
-            column_letter = column[0].column_letter
-            for cell in column:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(str(cell.value))
-                except:
-                    pass
-            adjusted_width = min(max_length + 2, 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # Сохраняем во временный файл
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as tmp_file:
-            wb.save(tmp_file.name)
-            tmp_file_path = tmp_file.name
-        
-        # Отправляем файл
+        if os.path.getsize(tmp_file_path) > MAX_DOCUMENT_BYTES:
+            await update.message.reply_text(
+                f"📊 Выгрузка {period} ({summary.rows} строк) больше 50 МБ и не может быть отправлена. "
+                f"Сократите период или выберите xlsx."
+            )
+            return
+
+        average = summary.average_rating
         with open(tmp_file_path, 'rb') as file:
             await update.message.reply_document(
                 document=file,
-                filename=f"bot_statistics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                caption=f"📊 Статистика использования бота за последние 30 дней\n"
-                       f"Всего взаимодействий: {len(df)}\n"
-                       f"Уникальных пользователей: {df['user_id'].nunique()}\n"
-                       f"Средняя оценка: {df['rating'].mean():.2f}" if not df['rating'].isna().all() else "Оценок пока нет"
+                filename=f"bot_statistics_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}",
+                caption=f"📊 Статистика использования бота {period}\n"
+                        f"Всего взаимодействий: {summary.rows}\n"
+                        f"Уникальных пользователей: {len(summary.users)}\n"
+                        + (f"Средняя оценка: {average:.2f}" if average is not None else "Оценок пока нет")
             )
-        
-        # Удаляем временный файл
-        os.unlink(tmp_file_path)
-        
+
+    except RuntimeError as e:
+        # Формат недоступен (нет pyarrow для Parquet)
+        await update.message.reply_text(f"❌ {e}")
     except Exception as e:
         logging.error(f"Ошибка при создании статистики: {e}")
         await update.message.reply_text("❌ Ошибка при создании статистики. Проверьте логи.")
+    finally:
+        os.unlink(tmp_file_path)
+
+async def handle_admin_reload(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/reload — пересобрать индекс базы знаний без перезапуска"""
+    if update.effective_user.id != ADMIN_ID:
+        await update.message.reply_text("❌ У вас нет прав для выполнения этой команды.")
+        return
+
+    await update.message.reply_text("🔄 Пересобираю индекс базы знаний...")
+    try:
+        stats = await reload_knowledge(force=True)
+    except Exception as e:
+        logging.error(f"Ошибка перезагрузки базы знаний: {e}")
+        await update.message.reply_text("❌ Ошибка при пересборке индекса. Проверьте логи.")
+        return
+    if "fingerprint" not in stats:
+        await update.message.reply_text("⚠️ В base_knowledge нет фрагментов, оставлен прежний индекс.")
+        return
+    logging.info(f"Индекс базы знаний пересобран по команде за {stats['seconds']:.1f} с: {format_reload_stats(stats)}")
+    await update.message.reply_text(
+        f"✅ Индекс пересобран за {stats['seconds']:.1f} с\n"
+        f"{format_reload_stats(stats).capitalize()}"
+    )
+
+# === Запросы к OpenRouter ===
+# Потоковый режим: ответ показывается по мере генерации правками сообщения-заглушки
+STREAM_RESPONSES = os.environ.get("OPENROUTER_STREAM", "1") != "0"
+# Telegram ограничивает частоту правок одного сообщения — правим не чаще раза в интервал
+STREAM_EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", "1.5"))
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+# Модели в порядке предпочтения: следующая — запасная и цель хеджирования для предыдущей
+OPENROUTER_MODELS = [m.strip() for m in os.environ.get("OPENROUTER_MODELS", MODEL).split(",") if m.strip()]
+# Задержка хеджирования до накопления статистики p95, сек
+OPENROUTER_HEDGE_DELAY = float(os.environ.get("OPENROUTER_HEDGE_DELAY", "6.0"))
+model_router = ModelRouter(OPENROUTER_MODELS, hedge_delay=OPENROUTER_HEDGE_DELAY)
+
+def _openrouter_request(messages, model=MODEL, stream=False):
+    """Заголовки и тело запроса к OpenRouter"""
+    headers = {
+        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    payload = {
+        "model": model,
+        "messages": messages,
+        "max_tokens": 1000,
+        "temperature": 0.3
+    }
+    if stream:
+        payload["stream"] = True
+    return headers, payload
+
+def _openrouter_error(response, body):
+    return ModelCallError(
+        f"HTTP {response.status_code}: {body}",
+        status=response.status_code,
+        retry_after=parse_retry_after(response.headers.get("Retry-After")),
+    )
+
+async def request_openrouter_answer(messages, model=MODEL, first_token=None):
+    """Получает ответ модели целиком одним запросом"""
+    headers, payload = _openrouter_request(messages, model)
+    response = await http_client.post(OPENROUTER_URL, headers=headers, json=payload)
+    if response.status_code != 200:
+        raise _openrouter_error(response, response.text)
+    data = response.json()
+    answer = data["choices"][0]["message"]["content"].strip()
+    if answer and first_token is not None:
+        first_token()
+    return answer
+
+async def _edit_streamed_text(message, text):
+    """Правит сообщение с частичным ответом. Возвращает паузу до следующей правки"""
+    try:
+        await message.edit_text(text[:TELEGRAM_MAX_MESSAGE_LENGTH], disable_web_page_preview=True)
+    except RetryAfter as e:
+        # Превысили лимит правок — ждём, сколько просит Telegram, поток при этом не прерываем
+        return float(e.retry_after)
+    except BadRequest as e:
+        logging.debug(f"Не удалось обновить сообщение: {e}")
+    return STREAM_EDIT_INTERVAL
+
+async def stream_openrouter_answer(messages, message, model=MODEL, first_token=None):
+    """Получает ответ модели потоком (SSE) и постепенно показывает его в message.
+
+    first_token() вызывается на первом фрагменте ответа; при хеджировании
+    показывать ответ начинает только победившая модель."""
+    headers, payload = _openrouter_request(messages, model, stream=True)
+    parts = []
+    shown = ""
+    next_edit_at = 0.0
+
+    async with http_client.stream("POST", OPENROUTER_URL, headers=headers, json=payload) as response:
+        if response.status_code != 200:
+            body = await response.aread()
+            raise _openrouter_error(response, body.decode('utf-8', errors='replace'))
+
+        async for line in response.aiter_lines():
+            # Строки-комментарии вида ": OPENROUTER PROCESSING" и пустые разделители пропускаем
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            chunk = json.loads(data)
+            if "error" in chunk:
+                raise Exception(f"Ошибка в потоке OpenRouter: {chunk['error']}")
+            choices = chunk.get("choices") or [{}]
+            delta = (choices[0].get("delta") or {}).get("content")
+            if not delta:
+                continue
+            if not parts and first_token is not None and not first_token():
+                # Другая модель ответила раньше — этот запрос будет отменён
+                return ""
+            parts.append(delta)
+
+            now = time.monotonic()
+            if now >= next_edit_at:
+                text = "".join(parts).strip()
+                if text and text != shown:
+                    next_edit_at = now + await _edit_streamed_text(message, text)
+                    shown = text
+
+    return "".join(parts).strip()
+
+async def send_final_answer(update, placeholder, answer, reply_markup):
+    """Показывает окончательный ответ с кнопками"""
+    if placeholder is not None and STREAM_RESPONSES and len(answer) <= TELEGRAM_MAX_MESSAGE_LENGTH:
+        # В потоковом режиме ответ уже в сообщении-заглушке — дописываем его и добавляем кнопки
+        try:
+            await placeholder.edit_text(answer, reply_markup=reply_markup, disable_web_page_preview=True)
+            return
+        except BadRequest as e:
+            logging.warning(f"Не удалось обновить сообщение с ответом, отправляю новое: {e}")
+    await update.message.reply_text(
+        answer,
+        reply_markup=reply_markup,
+        disable_web_page_preview=True
+    )
+
+async def deliver_answer(update, context, user_text, answer, placeholder=None):
+    """Сохраняет ответ, добавляет его в историю и показывает пользователю. Возвращает interaction_id"""
+    # Ставим взаимодействие в очередь на запись в БД: id выдаётся сразу, без ожидания коммита
+    user = update.effective_user
+    interaction_id = write_log.log_interaction(
+        user.id, 
+        user.username, 
+        user.first_name, 
+        user.last_name, 
+        user_text, 
+        answer
+    )
+    
+    # Добавляем в историю диалога
+    add_to_conversation_history(context.user_data, user_text, answer)
+    
+    # Ответ только что создан, оценки по нему ещё нет — показываем обе кнопки
+    keyboard = [
+        [InlineKeyboardButton("💬 Задать новый вопрос", callback_data="ask")],
+        [InlineKeyboardButton("⭐ Оценить качество ответа", callback_data=f"feedback_{interaction_id}")]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await send_final_answer(update, placeholder, answer, reply_markup)
+    return interaction_id
 
 # === Обработка текстовых сообщений ===
+REQUESTS = metrics.counter("bot_requests_total", "Обработанные вопросы по исходу", ("outcome",))
+REQUEST_SECONDS = metrics.histogram("bot_request_seconds", "Полное время обработки вопроса", ("outcome",))
+STAGE_SECONDS = metrics.histogram("bot_stage_seconds", "Длительность этапов обработки вопроса", ("stage",))
+STAGE_DEADLINES = metrics.counter("bot_stage_deadline_total", "Источники, не уложившиеся в дедлайн", ("stage",))
+LLM_ATTEMPTS = metrics.histogram("bot_llm_attempts", "Запросов к моделям на один ответ (с хеджированием и повторами)",
+                                 buckets=(1, 2, 3, 4, 5))
+
+def finish_trace(timings, outcome, **fields):
+    """Пишет этапы в метрики и одну JSON-строку трассировки на вопрос"""
+    for name, seconds in timings.stages.items():
+        STAGE_SECONDS.observe(seconds, name)
+    for name in timings.timed_out:
+        STAGE_DEADLINES.inc(name)
+    REQUESTS.inc(outcome)
+    REQUEST_SECONDS.observe(timings.total(), outcome)
+    record = timings.trace(trace_id=metrics.trace_id.get(), outcome=outcome, **fields)
+    logging.info(f"trace {json.dumps(record, ensure_ascii=False)}")
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
-    
+    # Один trace_id на апдейт: по нему в логе собираются все строки обработки вопроса
+    metrics.trace_id.set(f"u{update.update_id}")
+    timings = StageTimings()
+
     # Проверяем rate limit
-    if not check_rate_limit(user_id):
+    with timings.stage("rate_limit"):
+        allowed = await check_rate_limit(llm_rate_limiter, user_id)
+    if not allowed:
+        RATE_LIMITED.inc("message")
+        finish_trace(timings, "rate_limited", user_id=user_id)
         await update.message.reply_text(
             "⚠️ **Слишком много запросов!**\n\n"
-            "Вы превысили лимит в 10 запросов в минуту. "
+            f"Вы превысили лимит в {MAX_REQUESTS_PER_MINUTE} запросов в минуту. "
             "Пожалуйста, подождите немного перед следующим вопросом."
         )
         return
@@ -703,34 +919,31 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     user_text = update.message.text.strip()
 
+    # Повторный вопрос без истории диалога отдаём из кэша ответов, не обращаясь к модели
+    cacheable = ANSWER_CACHE_ENABLED and _knowledge_ready and not context.user_data.get("conversation_history")
+    if cacheable:
+        with timings.stage("cache"):
+            cached = answer_cache.lookup(user_text, _knowledge_index.model)
+            # Оценка могла прийти в другой воркер — перед выдачей сверяемся с таблицей feedback
+            low_rated = cached is not None and await run_db(has_low_rating, list(cached.interaction_ids), LOW_RATING)
+        if cached is not None and not low_rated:
+            logging.info(f"Ответ из кэша на вопрос: {user_text[:100]}")
+            with timings.stage("deliver"):
+                interaction_id = await deliver_answer(update, context, user_text, cached.answer)
+            answer_cache.record_hit(cached, interaction_id)
+            finish_trace(timings, "cached", user_id=user_id, interaction_id=interaction_id)
+            return
+        if cached is not None:
+            answer_cache.invalidate(cached.interaction_ids[0])
+
     # Проверка: запрос про нормативы?
     is_normative = any(word in user_text.lower() for word in [
         "снип", "гост", "сп ", "свод правил", "актуальн", "действует",
         "новый", "нормы", "требован", "стандарт", "2025", "2024", "обновл"
     ])
 
-    relevant_chunks = []
-    online_context = ""
-
-    if is_normative:
-        online_context = await search_cntd(user_text)
-        if not online_context:
-            # Fallback на локальную базу
-            relevant_chunks = retrieve_relevant_chunks(user_text)
-    else:
-        relevant_chunks = retrieve_relevant_chunks(user_text)
-
-    # Формируем контекст
-    if online_context:
-        knowledge_context = online_context
-    elif relevant_chunks:
-        knowledge_context = "\n\n".join(relevant_chunks)
-    else:
-        knowledge_context = "Нет релевантной информации в базе знаний."
+    online_context, relevant_chunks = await gather_knowledge(user_text, is_normative, timings)
 
-    # Получаем контекст диалога
-    conversation_context = get_conversation_context(context.user_data)
-    
     # Системный промпт с указанием года
     current_year = datetime.now().year
     system_prompt = (
@@ -743,168 +956,193 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "МАКСИМУМ — 400 слов."
     )
 
-    # Формируем промпт с учетом истории диалога
-    if conversation_context:
-        conversation_part = f"Предыдущий диалог с клиентом:\n{conversation_context}\n\n"
-    else:
-        conversation_part = ""
-
-    if online_context or relevant_chunks:
-        user_prompt = (
-            f"{conversation_part}"
-            f"Информация из строительных нормативов:\n{knowledge_context}\n\n"
-            f"Текущий вопрос клиента: {user_text}\n\n"
-            f"Ответь на русском языке, без лишних слов."
-        )
-    else:
-        user_prompt = f"{conversation_part}Текущий вопрос клиента: {user_text}\n\nОтветь на русском языке, без лишних слов."
+    # Промпт в пределах бюджета токенов: актуальный норматив с cntd.ru первым,
+    # затем фрагменты локальной базы и сжатая история диалога (см. prompt_builder.py)
+    knowledge = ([online_context] if online_context else []) + relevant_chunks
+    history = context.user_data.get("conversation_history", [])
+    user_prompt, prompt_tokens = build_user_prompt(user_text, history, knowledge, system_prompt)
 
-    await update.message.reply_text("⏳ Минутку, мне нужно подумать...")
-    logging.info(f"Отправляю запрос к OpenRouter: {user_prompt[:200]}...")
+    placeholder = await update.message.reply_text("⏳ Минутку, мне нужно подумать...")
+    logging.info(f"Отправляю запрос к OpenRouter (~{prompt_tokens} токенов): {user_prompt[:200]}...")
 
+    tried = []
     try:
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt},
         ]
-        last_error = None
-        for attempt in range(3):
-            try:
-                response = await http_client.post(
-                    "https://openrouter.ai/api/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                        "Content-Type": "application/json"
-                    },
-                    json={
-                        "model": MODEL,
-                        "messages": messages,
-                        "max_tokens": 1000,
-                        "temperature": 0.3
-                    }
-                )
-                if response.status_code == 200:
-                    data = response.json()
-                    answer = data["choices"][0]["message"]["content"].strip()
-                    logging.info(f"Получен ответ от OpenRouter: {answer[:200]}")
-
-                    # Сохраняем взаимодействие в БД
-                    user = update.effective_user
-                    interaction_id = save_interaction(
-                        user.id, 
-                        user.username, 
-                        user.first_name, 
-                        user.last_name, 
-                        user_text, 
-                        answer
-                    )
-                    
-                    # Добавляем в историю диалога
-                    add_to_conversation_history(context.user_data, user_text, answer)
-                    
-                    # Проверяем, давал ли пользователь обратную связь по этому ответу
-                    feedback_given = has_given_feedback(user.id, interaction_id)
-                    
-                    if feedback_given:
-                        # Если обратная связь уже дана, показываем только кнопку нового вопроса
-                        keyboard = [[InlineKeyboardButton("💬 Задать новый вопрос", callback_data="ask")]]
-                        reply_markup = InlineKeyboardMarkup(keyboard)
-                        await update.message.reply_text(
-                            answer,
-                            reply_markup=reply_markup,
-                            disable_web_page_preview=True
-                        )
-                    else:
-                        # Если обратная связь не дана, показываем обе кнопки
-                        keyboard = [
-                            [InlineKeyboardButton("💬 Задать новый вопрос", callback_data="ask")],
-                            [InlineKeyboardButton("⭐ Оценить качество ответа", callback_data=f"feedback_{interaction_id}")]
-                        ]
-                        reply_markup = InlineKeyboardMarkup(keyboard)
-                        await update.message.reply_text(
-                            answer,
-                            reply_markup=reply_markup,
-                            disable_web_page_preview=True
-                        )
-                    break
-                else:
-                    last_error = f"HTTP {response.status_code}: {response.text}"
-                    logging.warning(f"Попытка {attempt+1}/3 не удалась: {last_error}")
-            except Exception as inner_e:
-                last_error = str(inner_e)
-                logging.warning(f"Попытка {attempt+1}/3 завершилась ошибкой: {last_error}")
-            await asyncio.sleep(1.5 * (attempt + 1))
-
+        llm_started = time.perf_counter()
+        # Запасные модели, хеджирование и повторы — в model_router.ModelRouter
+        if STREAM_RESPONSES:
+            async def attempt(model, first_token):
+                return await stream_openrouter_answer(messages, placeholder, model, first_token)
         else:
-            raise Exception(last_error or "Неизвестная ошибка при обращении к OpenRouter")
+            async def attempt(model, first_token):
+                return await request_openrouter_answer(messages, model, first_token)
+        # Общий лимит одновременных запросов бережёт квоту OpenRouter
+        async with llm_slots:
+            answer, model = await model_router.run(attempt, tried)
+
+        timings.record("llm", time.perf_counter() - llm_started)
+        logging.info(f"Получен ответ от OpenRouter ({model}): {answer[:200]}")
+
+        with timings.stage("deliver"):
+            interaction_id = await deliver_answer(update, context, user_text, answer, placeholder)
+        if cacheable:
+            answer_cache.add(interaction_id, user_text, answer, _knowledge_index.model)
+        LLM_ATTEMPTS.observe(len(tried))
+        finish_trace(timings, "answered", user_id=user_id, interaction_id=interaction_id, model=model,
+                     attempts=tried, prompt_tokens=prompt_tokens, chunks=len(relevant_chunks),
+                     cntd=bool(online_context))
 
     except Exception as e:
         logging.error(f"Ошибка ИИ: {e}")
+        LLM_ATTEMPTS.observe(len(tried))
+        finish_trace(timings, "error", user_id=user_id, attempts=tried, error=str(e)[:200])
         await update.message.reply_text(
             "⚠️ Не удалось получить ответ. Возможно, временные проблемы с сервисом. "
             "Попробуйте через минуту или переформулируйте вопрос."
         )
 
-# === Flask + Webhook ===
-app = Flask(__name__)
-
-application = Application.builder().token(BOT_TOKEN).build()
+# === Вебхук (aiohttp) ===
+application = (
+    Application.builder()
+    .token(BOT_TOKEN)
+    .base_url(TELEGRAM_API_URL)
+    .update_queue(asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE))
+    .concurrent_updates(MAX_CONCURRENT_UPDATES)
+    .persistence(session_persistence)
+    .build()
+)
 
+# Группа -1 выполняется раньше остальных и может остановить обработку
+application.add_handler(CallbackQueryHandler(throttle_callbacks), group=-1)
 application.add_handler(CommandHandler("start", start))
 application.add_handler(CommandHandler("stats", handle_admin_stats))
+application.add_handler(CommandHandler("reload", handle_admin_reload))
 application.add_handler(CallbackQueryHandler(ask_callback, pattern="^ask$"))
 application.add_handler(CallbackQueryHandler(handle_feedback_request, pattern="^feedback_"))
 application.add_handler(CallbackQueryHandler(handle_feedback_rating, pattern="^rating_"))
 application.add_handler(CallbackQueryHandler(handle_comment_callback, pattern="^comment$"))
 application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
-_loop = asyncio.new_event_loop()
-asyncio.set_event_loop(_loop)
-_loop.run_until_complete(application.initialize())
+# /health и /<BOT_TOKEN>; Application стартует и останавливается вместе с сервером
+app = create_web_app(application, BOT_TOKEN)
 
-@app.route("/<path:token>", methods=["POST"])
-def telegram_webhook(token):
-    if token != BOT_TOKEN:
-        return "Forbidden", 403
-    data = request.get_json(force=True)
-    update = Update.de_json(data, application.bot)
-    _loop.run_until_complete(application.process_update(update))
-    return "OK"
+async def close_http_client(app):
+    await http_client.aclose()
+    logging.info("HTTP клиент закрыт")
 
-@app.route("/health")
-def health():
-    return "OK"
+app.on_cleanup.append(close_http_client)
 
 # === Очистка ресурсов при завершении ===
-import atexit
-
 def cleanup_resources():
     """Очищает ресурсы при завершении работы"""
     try:
-        asyncio.run(http_client.aclose())
-        logging.info("HTTP клиент закрыт")
+        if not http_client.is_closed:
+            asyncio.run(http_client.aclose())
+            logging.info("HTTP клиент закрыт")
     except Exception as e:
         logging.error(f"Ошибка при закрытии HTTP клиента: {e}")
+    try:
+        close_storage()
+    except Exception as e:
+        logging.error(f"Ошибка при закрытии БД: {e}")
+    try:
+        # Несохранённые user_data дописывает application.stop() при остановке сервера
+        session_backend.close()
+    except Exception as e:
+        logging.error(f"Ошибка при закрытии хранилища сессий: {e}")
 
 # Регистрируем функцию очистки
 atexit.register(cleanup_resources)
 
 # === Планировщик задач ===
-def run_scheduler():
-    """Запускает планировщик задач в отдельном потоке"""
-    # Настраиваем задачу на 17:30 по московскому времени
-    schedule.every().day.at("17:30").do(lambda: asyncio.run(send_daily_stats_to_admin()))
-    
-    logging.info("Планировщик задач запущен. Статистика будет отправляться ежедневно в 17:30 по МСК в Telegram")
-    
-    while True:
-        schedule.run_pending()
-        time.sleep(60)  # Проверяем каждую минуту
-
-# Запускаем планировщик
-scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-scheduler_thread.start()
+# Задачи выполняются на event loop бота (см. scheduler.py), время — московское
+DAILY_STATS_AT = os.environ.get("DAILY_STATS_AT", "17:30")
+DB_MAINTENANCE_AT = os.environ.get("DB_MAINTENANCE_AT", "04:00")
+CACHE_EVICTION_INTERVAL = float(os.environ.get("CACHE_EVICTION_INTERVAL", "600"))
+KNOWLEDGE_REFRESH_INTERVAL = float(os.environ.get("KNOWLEDGE_REFRESH_INTERVAL", "3600"))
+
+async def evict_caches():
+    """Вычищает просроченные записи кэшей docs.cntd.ru, сессий и простаивающих пользователей лимитеров"""
+    def evict_storage():
+        removed = cntd_search_cache.evict_expired() + cntd_document_cache.evict_expired()
+        # В Redis просроченные ключи удаляет сам Redis
+        if hasattr(session_backend, "purge_expired"):
+            removed += session_backend.purge_expired()
+        return removed
+
+    removed = await asyncio.to_thread(evict_storage)
+    # Локальные лимитеры не потокобезопасны — вытесняем на event loop, это быстро
+    for limiter in (llm_rate_limiter, callback_rate_limiter):
+        if isinstance(limiter, RateLimiter):
+            removed += limiter.evict_idle()
+    logging.info(f"Очистка кэшей: удалено {removed} записей")
+
+async def maintain_database():
+    """Ночное обслуживание БД взаимодействий"""
+    result = await run_db(run_maintenance)
+    logging.info(f"Обслуживание БД: {result}")
+
+async def refresh_knowledge_index():
+    """Подхватывает изменения в base_knowledge/ без перезапуска"""
+    stats = await reload_knowledge()
+    if stats is not None and "fingerprint" in stats:
+        logging.info(f"Индекс базы знаний обновлён за {stats['seconds']:.1f} с: {format_reload_stats(stats)}")
+
+scheduler = Scheduler("Europe/Moscow")
+scheduler.daily(DAILY_STATS_AT, send_daily_stats_to_admin, name="daily_stats")
+scheduler.daily(DB_MAINTENANCE_AT, maintain_database, name="db_maintenance")
+scheduler.every(CACHE_EVICTION_INTERVAL, evict_caches, name="cache_eviction")
+scheduler.every(KNOWLEDGE_REFRESH_INTERVAL, refresh_knowledge_index, name="knowledge_refresh")
+
+async def start_scheduler(app):
+    scheduler.start()
+    logging.info(f"Планировщик задач запущен. Статистика будет отправляться ежедневно в {DAILY_STATS_AT} по МСК в Telegram")
+
+async def stop_scheduler(app):
+    # on_shutdown выполняется до on_cleanup: задачи останавливаются раньше Application и http_client
+    await scheduler.stop()
+
+app.on_startup.append(start_knowledge_loading)
+app.on_startup.append(start_scheduler)
+app.on_shutdown.append(stop_scheduler)
+
+# === Метрики, которые уже считают сами компоненты: читаются при опросе /metrics ===
+def collect_component_metrics():
+    yield ("bot_update_queue_size", "gauge", "Апдейты, ожидающие обработки",
+           [({}, application.update_queue.qsize())])
+    yield ("bot_knowledge_chunks", "gauge", "Фрагментов в индексе базы знаний",
+           [({}, len(_knowledge_index) if _knowledge_ready else 0)])
+    caches = {"cntd_search": cntd_search_cache.stats(), "cntd_document": cntd_document_cache.stats()}
+    yield ("bot_cache_lookups_total", "counter", "Обращения к кэшам docs.cntd.ru",
+           [({"cache": name, "result": result}, stats[key])
+            for name, stats in caches.items()
+            for result, key in (("memory_hit", "hits"), ("disk_hit", "disk_hits"), ("miss", "misses"))])
+    yield ("bot_cache_size", "gauge", "Записей в кэшах в памяти",
+           [({"cache": name}, stats["size"]) for name, stats in caches.items()]
+           + [({"cache": "answers"}, len(answer_cache))])
+    # Не answer_cache.hits: те сбрасываются после ежедневного отчёта, а счётчик не должен убывать
+    yield ("bot_answer_cache_lookups_total", "counter", "Поиски в кэше ответов (вопросы без истории)",
+           [({"result": "hit"}, answer_cache.total_hits),
+            ({"result": "miss"}, answer_cache.total_lookups - answer_cache.total_hits)])
+    router = model_router.stats()
+    yield ("bot_llm_calls_total", "counter", "Завершённые запросы к моделям",
+           [({"model": model, "result": result}, stats[result])
+            for model, stats in router.items() for result in ("successes", "failures")])
+    yield ("bot_llm_breaker_open", "gauge", "Автомат отключения модели открыт",
+           [({"model": model}, int(stats["state"] == "open")) for model, stats in router.items()])
+    yield ("bot_llm_hedges_total", "counter", "Хеджирующие запросы к запасной модели", [({}, model_router.hedges)])
+    yield ("bot_llm_retries_total", "counter", "Повторы после ошибки модели", [({}, model_router.retries)])
+    jobs = scheduler.stats()
+    yield ("bot_job_runs_total", "counter", "Запуски периодических задач",
+           [({"job": job["name"]}, job["runs"]) for job in jobs])
+    yield ("bot_job_failures_total", "counter", "Ошибки периодических задач",
+           [({"job": job["name"]}, job["failures"]) for job in jobs])
+
+metrics.register_collector(collect_component_metrics)
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 10000))
-    app.run(host="0.0.0.0", port=port)
+    web.run_app(app, host="0.0.0.0", port=port)
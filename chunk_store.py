@@ -0,0 +1,82 @@
+"""Хранилище фрагментов базы знаний на диске.
+
+Все фрагменты лежат одним UTF-8 блобом (chunks.bin), границы — массив
+смещений (chunk_offsets.npy, n + 1 значений). Блоб и смещения открываются
+через mmap: воркеры на одной машине делят страницы через кэш ОС, а строка
+фрагмента декодируется только когда он попал в выдачу. Рядом с блобом
+хранится матрица весов в виде трёх .npy (data, indices, indptr) — тоже
+через mmap, без копии в памяти каждого процесса.
+"""
+import os
+import mmap
+from collections.abc import Sequence
+
+import numpy as np
+from scipy import sparse
+
+BLOB_FILE = "chunks.bin"
+OFFSETS_FILE = "chunk_offsets.npy"
+MATRIX_FILES = ("matrix_data.npy", "matrix_indices.npy", "matrix_indptr.npy")
+
+
+class ChunkStore(Sequence):
+    """Фрагменты из блоба по смещениям; store[i] возвращает str"""
+
+    def __init__(self, blob, offsets):
+        self._blob = blob
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("chunk index out of range")
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return self._blob[start:end].decode("utf-8")
+
+    @property
+    def nbytes(self):
+        return len(self._blob) + self._offsets.nbytes
+
+    @staticmethod
+    def write(cache_dir, chunks):
+        """Записывает блоб и смещения в cache_dir"""
+        offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+        with open(os.path.join(cache_dir, BLOB_FILE), "wb") as f:
+            for i, chunk in enumerate(chunks):
+                data = chunk.encode("utf-8")
+                f.write(data)
+                offsets[i + 1] = offsets[i] + len(data)
+        with open(os.path.join(cache_dir, OFFSETS_FILE), "wb") as f:
+            np.save(f, offsets)
+
+    @classmethod
+    def open(cls, cache_dir):
+        offsets = np.load(os.path.join(cache_dir, OFFSETS_FILE), mmap_mode="r")
+        with open(os.path.join(cache_dir, BLOB_FILE), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size != int(offsets[-1]):
+                raise ValueError(f"{BLOB_FILE}: {size} байт, по смещениям {int(offsets[-1])}")
+            # mmap пустого файла невозможен; отображение живёт и после закрытия файла
+            blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        return cls(blob, offsets)
+
+
+def write_matrix(cache_dir, matrix):
+    for name, array in zip(MATRIX_FILES, (matrix.data, matrix.indices, matrix.indptr)):
+        with open(os.path.join(cache_dir, name), "wb") as f:
+            np.save(f, array)
+
+
+def open_matrix(cache_dir, shape):
+    """CSR поверх отображённых массивов: данные не копируются в память процесса"""
+    data, indices, indptr = (np.load(os.path.join(cache_dir, name), mmap_mode="r") for name in MATRIX_FILES)
+    matrix = sparse.csr_matrix(shape)
+    # Конструктор csr_matrix проверяет и может привести массивы к своим типам — присваиваем напрямую
+    matrix.data, matrix.indices, matrix.indptr = data, indices, indptr
+    return matrix
@@ -0,0 +1,165 @@
+"""Потоковое разбиение текстов базы знаний на чанки.
+
+Текст читается построчно, предложения собираются из слов, а размер текущего
+чанка ведётся счётчиком слов — без повторных split() по уже накопленному
+тексту. Чанки отдаются генератором, поэтому весь файл в памяти не нужен.
+Перед нарезкой строки проходят normalize_lines: извлечённый из PDF текст
+содержит заменители дефиса и переносы слов по слогам.
+"""
+import re
+import unicodedata
+
+CHUNK_SIZE = 500        # слов в чанке
+CHUNK_OVERLAP = 0       # слов, переносимых из конца предыдущего чанка
+MIN_CHUNK_CHARS = 50    # более короткие чанки отбрасываются
+SENTENCE_ENDINGS = ".!?…"
+# Закрывающие кавычки и скобки после знака конца предложения
+_TRAILING_CLOSERS = "\"'»”)]"
+# Конвертеры PDF ставят \x11 и \x1f вместо дефиса; мягкий перенос убирается,
+# прочие управляющие символы становятся пробелом (str.translate на кириллице медленнее)
+_SPECIAL_CHARS = re.compile(r"[\x00-\x08\x0b-\x1f\x7f\u00ad]")
+_REPLACEMENTS = {"\x11": "-", "\x1f": "-", "\u00ad": ""}
+# Слово, перенесённое по слогам: буква и дефис в конце строки
+_HYPHENATED_END = re.compile(r"(\S*[^\W\d_])-\s*$")
+
+
+def _ends_sentence(word, sentence_endings):
+    return word.rstrip(_TRAILING_CLOSERS)[-1:] in sentence_endings
+
+
+def _replace_special(match):
+    return _REPLACEMENTS.get(match.group(), " ")
+
+
+def normalize_lines(lines):
+    """Чистит строки перед нарезкой.
+
+    Текст приводится к NFKC, заменители дефиса — к дефису, прочие
+    управляющие символы — к пробелу. Перенос «на-\\nучно» склеивается
+    в «научно», если следующая строка начинается со строчной буквы.
+    """
+    carry = ""
+    for line in lines:
+        line = _SPECIAL_CHARS.sub(_replace_special, unicodedata.normalize("NFKC", line))
+        if carry:
+            rest = line.lstrip()
+            if rest[:1].islower():
+                line = carry + rest
+            else:
+                yield carry + "-"
+            carry = ""
+        # Регулярное выражение с $ медленно на длинных строках — сначала дешёвая проверка
+        match = _HYPHENATED_END.search(line) if line.rstrip().endswith("-") else None
+        if match:
+            carry = match.group(1)
+            line = line[:match.start()]
+            # Строка из одного перенесённого слова — не пустая строка и не конец абзаца
+            if not line.strip():
+                continue
+        yield line
+    if carry:
+        yield carry + "-"
+
+
+def iter_sentences(lines, sentence_endings=SENTENCE_ENDINGS, paragraph_breaks=True):
+    """Отдаёт предложения как списки слов.
+
+    Предложение заканчивается словом, оканчивающимся на один из
+    sentence_endings, а при paragraph_breaks — ещё и пустой строкой.
+    """
+    sentence = []
+    for line in lines:
+        words = line.split()
+        if not words:
+            if paragraph_breaks and sentence:
+                yield sentence
+                sentence = []
+            continue
+        for word in words:
+            sentence.append(word)
+            if _ends_sentence(word, sentence_endings):
+                yield sentence
+                sentence = []
+    if sentence:
+        yield sentence
+
+
+def iter_chunks(lines, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP,
+                min_chars=MIN_CHUNK_CHARS, sentence_endings=SENTENCE_ENDINGS,
+                paragraph_breaks=True):
+    """Собирает предложения в чанки не длиннее chunk_size слов.
+
+    lines — любой итерируемый источник строк (файл, страницы PDF и т.п.).
+    overlap задаёт, сколько слов из конца чанка повторяется в начале
+    следующего (переносятся целые предложения).
+    """
+    if chunk_size <= 0:
+        raise ValueError("chunk_size должен быть положительным")
+    if not 0 <= overlap < chunk_size:
+        raise ValueError("overlap должен быть в диапазоне [0, chunk_size)")
+
+    # Текущий чанк — список предложений и их длин в словах
+    sentences = []
+    lengths = []
+    word_count = 0
+    # Есть ли в чанке что-то кроме перенесённого из предыдущего
+    has_new = False
+
+    def _emit():
+        text = " ".join(sentences)
+        return text if len(text) > min_chars else None
+
+    def _carry_over():
+        carried, carried_lengths, total = [], [], 0
+        for sent, length in zip(reversed(sentences), reversed(lengths)):
+            if total + length > overlap:
+                break
+            carried.append(sent)
+            carried_lengths.append(length)
+            total += length
+        carried.reverse()
+        carried_lengths.reverse()
+        return carried, carried_lengths, total
+
+    for words in iter_sentences(lines, sentence_endings, paragraph_breaks):
+        # Предложение длиннее чанка режем на куски по chunk_size слов
+        pieces = [words] if len(words) <= chunk_size else [
+            words[i:i + chunk_size] for i in range(0, len(words), chunk_size)
+        ]
+        for piece in pieces:
+            if sentences and word_count + len(piece) > chunk_size:
+                chunk = _emit()
+                if chunk:
+                    yield chunk
+                sentences, lengths, word_count = _carry_over() if overlap else ([], [], 0)
+                has_new = False
+                # Перенос не должен вытеснять новое предложение из чанка
+                while sentences and word_count + len(piece) > chunk_size:
+                    word_count -= lengths.pop(0)
+                    sentences.pop(0)
+            sentences.append(" ".join(piece))
+            lengths.append(len(piece))
+            word_count += len(piece)
+            has_new = True
+
+    if has_new:
+        chunk = _emit()
+        if chunk:
+            yield chunk
+
+
+def iter_file_lines(path):
+    """Строки текстового файла или PDF (постранично, через PyPDF2)"""
+    if path.lower().endswith(".pdf"):
+        from PyPDF2 import PdfReader
+
+        for page in PdfReader(path).pages:
+            yield from (page.extract_text() or "").splitlines()
+        return
+    with open(path, "r", encoding="utf-8-sig") as f:
+        yield from f
+
+
+def iter_file_chunks(path, **kwargs):
+    """Построчно читает файл базы знаний (.txt или .pdf) и отдаёт его чанки"""
+    yield from iter_chunks(normalize_lines(iter_file_lines(path)), **kwargs)
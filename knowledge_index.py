@@ -0,0 +1,524 @@
+"""Индекс базы знаний: сборка из файлов base_knowledge/, кэш на диске и поиск.
+
+* Источники — .txt и .pdf; манифест (scan_sources) хранит размер, mtime и
+  sha256 каждого файла, а отпечаток корпуса (corpus_fingerprint) решает,
+  годится ли кэш.
+* build_index разбирает только новые и изменённые файлы (разборы лежат в
+  knowledge_cache/parts/), убирает точные и почти дубликаты фрагментов и
+  обучает модель из scoring.py. Сборка идёт под блокировкой кэша, а если
+  кэш уже совпадает с файлами — не идёт вовсе.
+* Индекс сохраняется новой версией в knowledge_cache/versions/, на которую
+  атомарно переключает meta.json; фрагменты и матрица открываются через
+  mmap (chunk_store.py).
+* KnowledgeIndex.search — поиск движком из retrieval.py с MMR.
+
+Собрать вручную: python knowledge_index.py rebuild
+"""
+import os
+import sys
+import glob
+import json
+import fcntl
+import shutil
+import time
+import asyncio
+import hashlib
+import logging
+import argparse
+import tempfile
+import contextlib
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from chunk_store import BLOB_FILE, MATRIX_FILES, OFFSETS_FILE, ChunkStore, open_matrix, write_matrix
+from chunker import CHUNK_SIZE, CHUNK_OVERLAP, iter_file_chunks
+from near_duplicates import NearDuplicateFilter
+from retrieval import create_engine, mmr_order
+from scoring import create_model, model_from_state
+
+# === Настройки индекса ===
+KNOWLEDGE_DIR = "base_knowledge"
+CACHE_DIR = "knowledge_cache"
+# Движок поиска: dense — полный перебор, inverted — инвертированный индекс (см. retrieval.py)
+RETRIEVAL_ENGINE = os.environ.get("RETRIEVAL_ENGINE", "dense")
+# Модель ранжирования: bm25 — со стеммингом и стоп-словами, tfidf — прежняя (см. scoring.py)
+KNOWLEDGE_MODEL = os.environ.get("KNOWLEDGE_MODEL", "bm25")
+# Почти дубликаты фрагментов (near_duplicates.py) схлопываются при сборке, если оценка
+# Жаккара их шинглов не ниже порога; 1 — не искать
+NEAR_DUPLICATE_THRESHOLD = float(os.environ.get("NEAR_DUPLICATE_THRESHOLD", "0.7"))
+# Разнообразие выдачи (MMR, см. retrieval.mmr_order): вес релевантности против
+# непохожести на уже выбранные фрагменты; 1 — порядок только по оценке
+MMR_LAMBDA = float(os.environ.get("MMR_LAMBDA", "0.5"))
+# Кандидатов на одно место выдачи, из которых выбирает MMR
+MMR_CANDIDATES = 4
+# Файлы базы знаний: текст и PDF (см. chunker.iter_file_lines)
+SOURCE_EXTENSIONS = (".txt", ".pdf")
+# Увеличивайте при изменении формата кэша или алгоритма разбиения на чанки
+INDEX_FORMAT_VERSION = 7
+# Разобранные файлы (фрагменты и термины) по хэшу содержимого: пересборка разбирает только изменённые
+PARTS_DIR = "parts"
+# Сохранённые индексы: каждый — неизменяемая папка, на текущую указывает meta.json
+VERSIONS_DIR = "versions"
+# Файлы индекса (до VERSIONS_DIR они лежали прямо в cache_dir)
+INDEX_FILES = ("model.json", "model_arrays.npz", BLOB_FILE, OFFSETS_FILE, *MATRIX_FILES)
+# Блокировка сборки: индекс в одном cache_dir собирает только один процесс
+BUILD_LOCK_FILE = ".build.lock"
+
+
+def list_knowledge_files(knowledge_dir=KNOWLEDGE_DIR):
+    """Возвращает отсортированный список .txt и .pdf файлов базы знаний"""
+    return sorted(path for path in glob.glob(os.path.join(knowledge_dir, "*"))
+                  if path.lower().endswith(SOURCE_EXTENSIONS))
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan_sources(knowledge_dir=KNOWLEDGE_DIR, previous=None, rehash=False):
+    """Манифест файлов базы знаний: имя -> {size, mtime_ns, sha256}.
+
+    Хэш берётся из previous, если размер и mtime файла не изменились
+    (rehash=True пересчитывает все хэши), так что проверка неизменённой
+    базы стоит по одному stat на файл.
+    """
+    previous = previous or {}
+    manifest = {}
+    for path in list_knowledge_files(knowledge_dir):
+        name = os.path.basename(path)
+        stat = os.stat(path)
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        known = previous.get(name)
+        if not rehash and known and known["size"] == entry["size"] and known["mtime_ns"] == entry["mtime_ns"]:
+            entry["sha256"] = known["sha256"]
+        else:
+            entry["sha256"] = file_sha256(path)
+        manifest[name] = entry
+    return manifest
+
+
+def diff_manifests(old, new):
+    """Имена добавленных, изменённых и удалённых файлов"""
+    old = old or {}
+    added = sorted(name for name in new if name not in old)
+    changed = sorted(name for name in new if name in old and new[name]["sha256"] != old[name]["sha256"])
+    removed = sorted(name for name in old if name not in new)
+    return added, changed, removed
+
+
+def corpus_fingerprint(manifest, model=KNOWLEDGE_MODEL):
+    """Считает отпечаток корпуса по именам и хэшам файлов, модели ранжирования и порогу почти дубликатов"""
+    digest = hashlib.sha256(
+        f"v{INDEX_FORMAT_VERSION}:{CHUNK_SIZE}:{CHUNK_OVERLAP}:{model}:{NEAR_DUPLICATE_THRESHOLD}".encode()
+    )
+    for name in sorted(manifest):
+        digest.update(name.encode("utf-8"))
+        digest.update(manifest[name]["sha256"].encode())
+    return digest.hexdigest()
+
+
+def load_chunks(paths):
+    """Разбивает файлы базы знаний на чанки по ~500 слов"""
+    chunks = []
+    for path in paths:
+        try:
+            chunks.extend(iter_file_chunks(path, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP))
+        except Exception as e:
+            logging.error(f"Ошибка чтения {path}: {e}")
+    return chunks
+
+
+def chunk_key(chunk):
+    """Ключ точного дубликата: текст без учёта регистра и пробелов"""
+    return hashlib.blake2b(" ".join(chunk.casefold().split()).encode(), digest_size=16).digest()
+
+
+def parse_source(path, model=KNOWLEDGE_MODEL):
+    """Разбор одного файла: фрагменты и их термины для модели (выполняется и в пуле процессов)"""
+    file_chunks = load_chunks([path])
+    return {"chunks": file_chunks, "terms": create_model(model).analyze_chunks(file_chunks)}
+
+
+def _part_path(cache_dir, sha256, model):
+    # Разбор зависит от содержимого файла, параметров нарезки и модели
+    key = hashlib.sha256(f"v{INDEX_FORMAT_VERSION}:{CHUNK_SIZE}:{CHUNK_OVERLAP}:{model}:{sha256}".encode())
+    return os.path.join(cache_dir, PARTS_DIR, key.hexdigest() + ".json")
+
+
+def _load_part(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Разбор {path} повреждён, разбираю файл заново: {e}")
+        return None
+
+
+def _save_part(path, part):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(part, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+@contextlib.contextmanager
+def _build_lock(cache_dir):
+    """Эксклюзивная блокировка cache_dir (flock): остальные сборщики ждут её снятия"""
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(os.path.join(cache_dir, BUILD_LOCK_FILE), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class KnowledgeIndex:
+    """Индекс фрагментов базы знаний.
+
+    Матрица весов фрагментов строится моделью из scoring.py один раз (CSR),
+    а поиск по ней выполняет движок из retrieval.py. У загруженного из кэша
+    индекса фрагменты и матрица отображены с диска (см. chunk_store.py).
+    """
+
+    def __init__(self, chunks, model, matrix, fingerprint=None, engine=RETRIEVAL_ENGINE, manifest=None):
+        self.chunks = chunks
+        self.model = model
+        self.matrix = matrix
+        self.fingerprint = fingerprint
+        # Файлы, из которых собран индекс (см. scan_sources)
+        self.manifest = manifest or {}
+        self.engine = create_engine(engine, matrix)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    @classmethod
+    def build(cls, chunks, fingerprint=None, engine=RETRIEVAL_ENGINE, model=KNOWLEDGE_MODEL,
+              analyzed=None, manifest=None):
+        model = create_model(model)
+        matrix = model.fit_transform(chunks, analyzed)
+        return cls(chunks, model, matrix, fingerprint, engine, manifest)
+
+    def save(self, cache_dir=CACHE_DIR, **extra_meta):
+        """Сохраняет модель, фрагменты, матрицу и отпечаток корпуса на диск.
+
+        Файлы пишутся в новую папку cache_dir/versions/<версия>/ и больше не
+        меняются, а на неё переключает meta.json — одним os.replace. load
+        берёт версию из meta.json, поэтому видит либо прежний индекс целиком,
+        либо новый. Кроме новой остаётся только предыдущая версия: её мог
+        только что выбрать параллельный load.
+        """
+        versions_dir = os.path.join(cache_dir, VERSIONS_DIR)
+        os.makedirs(versions_dir, exist_ok=True)
+        previous = _cached_meta(cache_dir).get("version")
+        version_dir = tempfile.mkdtemp(prefix=datetime.now().strftime("%Y%m%d-%H%M%S-"), dir=versions_dir)
+        version = os.path.basename(version_dir)
+        meta_path = os.path.join(cache_dir, "meta.json")
+        meta_tmp = f"{meta_path}.{os.getpid()}.tmp"
+        try:
+            params, arrays = self.model.get_state()
+            with open(os.path.join(version_dir, "model.json"), "w", encoding="utf-8") as f:
+                json.dump({"name": self.model.name, "params": params}, f, ensure_ascii=False)
+            with open(os.path.join(version_dir, "model_arrays.npz"), "wb") as f:
+                np.savez(f, **arrays)
+            ChunkStore.write(version_dir, self.chunks)
+            write_matrix(version_dir, self.matrix)
+            with open(meta_tmp, "w", encoding="utf-8") as f:
+                json.dump({
+                    "format_version": INDEX_FORMAT_VERSION,
+                    "version": version,
+                    "fingerprint": self.fingerprint,
+                    "chunks": len(self.chunks),
+                    "shape": list(self.matrix.shape),
+                    "manifest": self.manifest,
+                    **extra_meta,
+                }, f, ensure_ascii=False)
+            os.replace(meta_tmp, meta_path)
+        except BaseException:
+            shutil.rmtree(version_dir, ignore_errors=True)
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(meta_tmp)
+            raise
+        # Открытые mmap удалённых версий остаются целы до закрытия
+        _prune_versions(cache_dir, {version, previous})
+
+    @classmethod
+    def load(cls, cache_dir=CACHE_DIR, fingerprint=None, engine=RETRIEVAL_ENGINE):
+        """Загружает индекс из кэша. Возвращает None, если кэш устарел или повреждён"""
+        # Выбранную по meta.json версию могут удалить два сохранения подряд — тогда читаем его заново
+        for _ in range(3):
+            version = None
+            try:
+                with open(os.path.join(cache_dir, "meta.json"), encoding="utf-8") as f:
+                    meta = json.load(f)
+                if meta.get("format_version") != INDEX_FORMAT_VERSION:
+                    return None
+                if fingerprint is not None and meta.get("fingerprint") != fingerprint:
+                    return None
+
+                version = meta["version"]
+                version_dir = os.path.join(cache_dir, VERSIONS_DIR, version)
+                with open(os.path.join(version_dir, "model.json"), encoding="utf-8") as f:
+                    model_state = json.load(f)
+                with np.load(os.path.join(version_dir, "model_arrays.npz")) as arrays:
+                    model = model_from_state(model_state["name"], model_state["params"], dict(arrays))
+                chunks = ChunkStore.open(version_dir)
+                matrix = open_matrix(version_dir, tuple(meta["shape"]))
+                break
+            except FileNotFoundError:
+                if version is not None and _cached_meta(cache_dir).get("version") != version:
+                    continue
+                return None
+            except Exception as e:
+                logging.warning(f"Кэш индекса в {cache_dir} повреждён, пересобираю: {e}")
+                return None
+        else:
+            return None
+
+        if matrix.shape != (len(chunks), model.vocabulary_size) or len(matrix.indptr) != len(chunks) + 1:
+            logging.warning(f"Кэш индекса в {cache_dir} не согласован, пересобираю")
+            return None
+
+        return cls(chunks, model, matrix, meta.get("fingerprint"), engine, meta.get("manifest"))
+
+    def search(self, query, top_k=3, min_score=None, relevance_weight=None):
+        """Возвращает до top_k фрагментов с оценкой выше min_score (по умолчанию — порог модели).
+
+        При relevance_weight < 1 (по умолчанию MMR_LAMBDA) выдача выбирается
+        по MMR из top_k * MMR_CANDIDATES лучших, чтобы фрагменты не повторяли
+        друг друга.
+        """
+        if not len(self.chunks):
+            return []
+        if min_score is None:
+            min_score = self.model.min_score
+        if relevance_weight is None:
+            relevance_weight = MMR_LAMBDA
+        query_vec = self.model.query_vector(query)
+        diverse = relevance_weight < 1 and top_k > 1
+        top_indices, scores = self.engine.search(query_vec, top_k * MMR_CANDIDATES if diverse else top_k)
+        passed = scores > min_score
+        top_indices, scores = top_indices[passed], scores[passed]
+        if diverse and len(top_indices) > top_k:
+            top_indices = top_indices[mmr_order(self.matrix[top_indices], scores, top_k, relevance_weight)]
+        return [self.chunks[i] for i in top_indices[:top_k]]
+
+
+def _parse_sources(knowledge_dir, names, model, workers):
+    """Разбирает файлы names; при workers > 1 — в пуле процессов. Возвращает {имя: разбор}"""
+    paths = [os.path.join(knowledge_dir, name) for name in names]
+    if workers > 1 and len(names) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(names))) as pool:
+            return dict(zip(names, pool.map(parse_source, paths, [model] * len(paths))))
+    return {name: parse_source(path, model) for name, path in zip(names, paths)}
+
+
+def build_index(knowledge_dir=KNOWLEDGE_DIR, cache_dir=CACHE_DIR, manifest=None,
+                model=KNOWLEDGE_MODEL, engine=RETRIEVAL_ENGINE, workers=1):
+    """Собирает индекс по файлам manifest и сохраняет его в cache_dir. Возвращает (индекс, статистику).
+
+    Фрагменты и термины неизменённых файлов берутся из cache_dir/parts/,
+    заново читаются и разбираются только новые и изменённые файлы (при
+    workers > 1 — параллельно в процессах). Точные (chunk_key) и почти
+    дубликаты фрагментов (NEAR_DUPLICATE_THRESHOLD) в индекс не попадают,
+    из группы остаётся первый по порядку файлов. Веса (IDF, средняя длина
+    фрагмента) зависят от всего корпуса, поэтому матрица пересчитывается
+    целиком — по готовым терминам это быстро.
+
+    Если в cache_dir уже лежит индекс с тем же отпечатком и набором файлов,
+    он просто загружается: модель не переобучается и кэш не перезаписывается.
+    Сборка идёт под блокировкой cache_dir (BUILD_LOCK_FILE): воркеры, которым
+    одновременно понадобилась пересборка, выполняют её по очереди.
+    """
+    with _build_lock(cache_dir):
+        return _build_index(knowledge_dir, cache_dir, manifest, model, engine, workers)
+
+
+def _build_index(knowledge_dir, cache_dir, manifest, model, engine, workers):
+    started = time.perf_counter()
+    manifest = scan_sources(knowledge_dir) if manifest is None else manifest
+    fingerprint = corpus_fingerprint(manifest, model)
+    meta = _cached_meta(cache_dir)
+    if meta.get("fingerprint") == fingerprint and not any(diff_manifests(meta.get("manifest"), manifest)):
+        index = KnowledgeIndex.load(cache_dir, fingerprint, engine)
+        if index is not None:
+            for name, entry in manifest.items():
+                entry["chunks"] = meta["manifest"][name].get("chunks")
+            logging.info(f"Индекс базы знаний в {cache_dir}/ актуален, пересборка не нужна")
+            stats = {"files": len(manifest), "parsed": [], "chunks": len(index),
+                     "duplicates": meta.get("duplicates", 0), "near_duplicates": meta.get("near_duplicates", 0),
+                     "fingerprint": fingerprint, "seconds": time.perf_counter() - started}
+            return index, stats
+
+    parts = {name: _load_part(_part_path(cache_dir, manifest[name]["sha256"], model)) for name in manifest}
+    parsed = sorted(name for name, part in parts.items() if part is None)
+    for name, part in _parse_sources(knowledge_dir, parsed, model, workers).items():
+        parts[name] = part
+        # Пустой разбор может быть ошибкой чтения — его не запоминаем
+        if part["chunks"]:
+            try:
+                _save_part(_part_path(cache_dir, manifest[name]["sha256"], model), part)
+            except OSError as e:
+                logging.warning(f"Не удалось сохранить разбор {name}: {e}")
+
+    chunks, analyzed, seen, duplicates, near_duplicates = [], [], set(), 0, 0
+    near_filter = NearDuplicateFilter(NEAR_DUPLICATE_THRESHOLD) if NEAR_DUPLICATE_THRESHOLD < 1 else None
+    for name in sorted(manifest):
+        part = parts[name]
+        kept = 0
+        for i, chunk in enumerate(part["chunks"]):
+            key = chunk_key(chunk)
+            if key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            if near_filter is not None and near_filter.add(chunk) is not None:
+                near_duplicates += 1
+                continue
+            chunks.append(chunk)
+            if part["terms"] is not None:
+                analyzed.append(part["terms"][i])
+            kept += 1
+        manifest[name]["chunks"] = kept
+
+    stats = {"files": len(manifest), "parsed": parsed, "chunks": len(chunks),
+             "duplicates": duplicates, "near_duplicates": near_duplicates}
+    if not chunks:
+        return None, stats
+    index = KnowledgeIndex.build(chunks, fingerprint, engine, model, analyzed or None, manifest)
+    try:
+        index.save(cache_dir, model=model, duplicates=duplicates, near_duplicates=near_duplicates,
+                   built_at=datetime.now(timezone.utc).isoformat(timespec="seconds"))
+        _prune_parts(cache_dir, manifest, model)
+        logging.info(f"Индекс базы знаний сохранён в {cache_dir}/ ({len(index)} фрагментов)")
+        # Дальше работаем с отображённой с диска копией: строки фрагментов и матрица сборки освобождаются
+        index = KnowledgeIndex.load(cache_dir, fingerprint, engine) or index
+    except OSError as e:
+        logging.warning(f"Не удалось сохранить кэш индекса: {e}")
+    stats["fingerprint"] = fingerprint
+    stats["seconds"] = time.perf_counter() - started
+    return index, stats
+
+
+def _prune_parts(cache_dir, manifest, model):
+    """Удаляет разборы файлов, которых больше нет в базе знаний"""
+    keep = {os.path.basename(_part_path(cache_dir, entry["sha256"], model)) for entry in manifest.values()}
+    for path in glob.glob(os.path.join(cache_dir, PARTS_DIR, "*.json")):
+        if os.path.basename(path) not in keep:
+            os.remove(path)
+
+
+def _prune_versions(cache_dir, keep):
+    """Удаляет сохранённые версии индекса, кроме keep, и файлы индекса прежнего формата"""
+    versions_dir = os.path.join(cache_dir, VERSIONS_DIR)
+    for name in os.listdir(versions_dir):
+        if name not in keep:
+            shutil.rmtree(os.path.join(versions_dir, name), ignore_errors=True)
+    for name in INDEX_FILES:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(cache_dir, name))
+
+
+def rebuild_index(knowledge_dir=KNOWLEDGE_DIR, cache_dir=CACHE_DIR, previous=None, rehash=False, workers=1):
+    """Пересборка для отдельного процесса: индекс остаётся в cache_dir, возвращается только статистика.
+
+    previous — манифест индекса, который сейчас обслуживает запросы: с ним
+    сравниваются файлы, а его хэши переиспользуются для неизменённых.
+    """
+    manifest = scan_sources(knowledge_dir, previous, rehash)
+    added, changed, removed = diff_manifests(previous, manifest)
+    _, stats = build_index(knowledge_dir, cache_dir, manifest, workers=workers)
+    stats.update(added=added, changed=changed, removed=removed)
+    return stats
+
+
+async def rebuild_in_subprocess(knowledge_dir=KNOWLEDGE_DIR, cache_dir=CACHE_DIR, previous=None, rehash=False):
+    """rebuild_index в отдельном процессе (python knowledge_index.py rebuild): разбор и
+    стемминг не занимают GIL бота. Индекс остаётся в cache_dir, возвращается статистика.
+
+    Модуль запускается по пути, поэтому рабочая папка бота может быть любой:
+    относительные knowledge_dir и cache_dir считаются от неё, как и в боте."""
+    args = [sys.executable, os.path.abspath(__file__), "rebuild",
+            "--knowledge-dir", knowledge_dir, "--cache-dir", cache_dir, "--previous-stdin"]
+    if rehash:
+        args.append("--rehash")
+    proc = await asyncio.create_subprocess_exec(
+        *args, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+    )
+    out, err = await proc.communicate(json.dumps(previous or {}).encode())
+    if proc.returncode != 0:
+        raise RuntimeError(f"Сборка индекса завершилась с кодом {proc.returncode}: {err.decode(errors='replace')[-500:]}")
+    return json.loads(out.decode().strip().splitlines()[-1])
+
+
+def load_or_build_index(knowledge_dir=KNOWLEDGE_DIR, cache_dir=CACHE_DIR):
+    """Загружает индекс из кэша или пересобирает его, если файлы базы знаний изменились.
+
+    Если исходных файлов нет, загружается готовый индекс из cache_dir как есть —
+    его можно собрать заранее (prepare_knowledge.py) и выкладывать без исходников.
+    """
+    manifest = scan_sources(knowledge_dir, cached_manifest(cache_dir))
+    if not manifest:
+        index = KnowledgeIndex.load(cache_dir)
+        if index is not None:
+            logging.info(f"Исходников в {knowledge_dir}/ нет, загружен готовый индекс {cache_dir}/ ({len(index)} фрагментов)")
+        return index
+
+    index = KnowledgeIndex.load(cache_dir, corpus_fingerprint(manifest))
+    if index is not None:
+        logging.info(f"Индекс базы знаний загружен из кэша {cache_dir}/ ({len(index)} фрагментов)")
+        return index
+
+    index, _ = build_index(knowledge_dir, cache_dir, manifest)
+    return index
+
+
+def _cached_meta(cache_dir):
+    """meta.json последнего сохранённого индекса или {}, если его нет или он повреждён"""
+    try:
+        with open(os.path.join(cache_dir, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return meta if isinstance(meta, dict) else {}
+
+
+def current_version_dir(cache_dir=CACHE_DIR):
+    """Папка версии индекса, на которую указывает meta.json, или None"""
+    version = _cached_meta(cache_dir).get("version")
+    return os.path.join(cache_dir, VERSIONS_DIR, version) if version else None
+
+
+def cached_manifest(cache_dir=CACHE_DIR):
+    """Манифест последнего сохранённого индекса: его хэши переиспользуются для неизменённых файлов"""
+    return _cached_meta(cache_dir).get("manifest")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка индекса базы знаний")
+    parser.add_argument("command", choices=["rebuild"], help="rebuild — собрать индекс в кэш")
+    parser.add_argument("--knowledge-dir", default=KNOWLEDGE_DIR)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--rehash", action="store_true", help="пересчитать хэши всех файлов")
+    parser.add_argument("--previous-stdin", action="store_true", help="манифест текущего индекса в stdin (JSON)")
+    parser.add_argument("--workers", type=int, default=1, help="процессов для разбора изменённых файлов")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    previous = json.load(sys.stdin) if args.previous_stdin else cached_manifest(args.cache_dir)
+    stats = rebuild_index(args.knowledge_dir, args.cache_dir, previous, args.rehash, args.workers)
+    # Статистика — последней строкой stdout, логи идут в stderr
+    print(json.dumps(stats, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Метрики бота в формате Prometheus и идентификатор трассировки запросов.
+
+Счётчики и гистограммы живут в памяти процесса и отдаются маршрутом
+/metrics (см. webhook.py). Запись — прибавление к числу под блокировкой
+и bisect по границам корзин, без аллокаций на горячем пути. Уже
+существующая статистика (кэши, маршрутизатор моделей, планировщик)
+не дублируется: она читается коллекторами в момент опроса.
+
+trace_id — идентификатор обработки одного апдейта. Он хранится в
+contextvars, поэтому виден и в задачах, и в asyncio.to_thread, а
+TraceIdFilter добавляет его в каждую строку лога.
+"""
+import math
+import bisect
+import logging
+import threading
+import contextvars
+
+# Границы корзин длительности, сек: от поиска по индексу до ответа модели
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0)
+
+trace_id = contextvars.ContextVar("trace_id", default="-")
+
+
+class TraceIdFilter(logging.Filter):
+    """Добавляет record.trace_id для формата лога '%(trace_id)s'"""
+
+    def filter(self, record):
+        record.trace_id = trace_id.get()
+        return True
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонный счётчик с метками"""
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            yield self.name, self.labels, label_values, value
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами; счётчики корзин накопительные только при выводе"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # метки -> [счётчики корзин (последняя — +Inf), сумма]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def count(self, *label_values):
+        state = self._values.get(label_values)
+        return sum(state[0]) if state else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(label_values, list(counts), total) for label_values, (counts, total) in self._values.items()]
+        labels = self.labels + ("le",)
+        for label_values, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", labels, label_values + (_format_value(bound),), cumulative
+            yield f"{self.name}_sum", self.labels, label_values, total
+            yield f"{self.name}_count", self.labels, label_values, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labels=()):
+        metric = Counter(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """collector() возвращает [(имя, тип, описание, [(словарь меток, значение), ...]), ...]
+        и вызывается при каждом опросе /metrics"""
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, label_names, label_values, value in metric.samples():
+                lines.append(f"{name}{_format_labels(label_names, label_values)} {_format_value(value)}")
+        for collector in self._collectors:
+            try:
+                families = list(collector())
+            except Exception as e:
+                logging.error(f"Ошибка сбора метрик {getattr(collector, '__name__', collector)}: {e}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} "
+                                 f"{_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Реестр процесса: метрики объявляются в модулях, которые их пишут
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+register_collector = REGISTRY.register_collector
+render = REGISTRY.render
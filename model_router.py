@@ -0,0 +1,300 @@
+"""Маршрутизация запросов к моделям OpenRouter: запасные модели, хеджирование, автоматы отключения.
+
+* Модели перебираются в заданном порядке; модель с открытым автоматом
+  пропускается, пока не истечёт пауза.
+* Хеджирование: если первая модель не дала первый токен (или ответ целиком
+  без потока) за задержку, равную p95 её прошлых ответов, параллельно
+  запускается следующая модель. Побеждает та, что ответила первой;
+  остальные запросы отменяются.
+* Автомат отключения на каждую модель считает ошибки в скользящем окне
+  (и слишком медленные ответы, если есть запасная модель) и при высокой
+  доле сбоев открывается на паузу. Открытый автомат только отодвигает
+  модель в очереди: если открыты все, запрос всё равно уходит модели,
+  что откроется раньше, — сам роутер не отказывает.
+* Ответ 429 с Retry-After открывает автомат ровно на столько, сколько
+  просит сервер. Между повторами — пауза с полным джиттером, не короче
+  Retry-After. Если сервер просит ждать дольше backoff_max все модели,
+  запрос сразу завершается AllModelsFailed, не отправляя ничего раньше срока.
+"""
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+
+
+class ModelCallError(Exception):
+    """Ошибка запроса к модели; status и retry_after — из ответа сервера, если есть"""
+
+    def __init__(self, message, status=None, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AllModelsFailed(Exception):
+    pass
+
+
+def parse_retry_after(value):
+    """Значение заголовка Retry-After в секундах (поддерживается только число секунд)"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Автомат отключения: closed -> open (пауза) -> half_open.
+
+    После паузы автомат полуоткрыт: первый же результат модели закрывает его
+    или снова открывает на удвоенную паузу. Запросы в это время не
+    ограничиваются — решает роутер, куда их отправить.
+    """
+
+    def __init__(self, window=20, min_calls=5, failure_rate=0.5, slow_call=20.0,
+                 cooldown=30.0, max_cooldown=300.0):
+        self.window = deque(maxlen=window)
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.open_until = 0.0
+        # До какого момента сервер просил не отправлять запросы (Retry-After)
+        self.retry_until = 0.0
+
+    def allow(self, now=None):
+        """Закрыт ли автомат или истекла ли его пауза (тогда он становится half_open)"""
+        now = time.monotonic() if now is None else now
+        if self.state == "open":
+            if now < self.open_until:
+                return False
+            self.state = "half_open"
+        return True
+
+    def record(self, ok, latency=None, now=None):
+        now = time.monotonic() if now is None else now
+        # Ответ дольше slow_call тоже считается сбоем: пользователю от него не легче
+        if ok and latency is not None and latency > self.slow_call:
+            ok = False
+        if self.state == "half_open":
+            if ok:
+                self.state = "closed"
+                self.cooldown = self.base_cooldown
+                self.window.clear()
+            else:
+                self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                self._open(now, self.cooldown)
+            return
+        self.window.append(ok)
+        failures = self.window.count(False)
+        if len(self.window) >= self.min_calls and failures / len(self.window) >= self.failure_rate:
+            self._open(now, self.cooldown)
+
+    def trip(self, seconds, now=None):
+        """Принудительно открывает автомат (например, по Retry-After)"""
+        now = time.monotonic() if now is None else now
+        self.retry_until = max(self.retry_until, now + seconds)
+        self._open(now, seconds)
+
+    def _open(self, now, seconds):
+        self.state = "open"
+        self.open_until = max(self.open_until, now + seconds)
+        self.window.clear()
+
+
+class ModelHealth:
+    """Задержки первого ответа модели (для p95) и её автомат отключения"""
+
+    def __init__(self, name, breaker):
+        self.name = name
+        self.breaker = breaker
+        self.latencies = deque(maxlen=200)
+        self.successes = 0
+        self.failures = 0
+
+    def p95(self):
+        if len(self.latencies) < 10:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+class ModelRouter:
+    """Выполняет запрос через упорядоченный список моделей с хеджированием и повторами.
+
+    attempt(model, first_token) — корутина одного запроса к модели, возвращает
+    текст ответа. Она вызывает first_token(), как только получила первый токен
+    потока (или весь ответ): первая вызвавшая попытка становится победителем
+    и получает True, остальные отменяются. Потоковая попытка должна начинать
+    показывать текст пользователю только после True.
+    """
+
+    def __init__(self, models, hedge_delay=6.0, min_hedge_delay=1.0, max_hedge_delay=20.0,
+                 max_attempts=3, max_parallel=2, backoff_base=0.5, backoff_max=8.0,
+                 breaker_factory=CircuitBreaker):
+        if not models:
+            raise ValueError("Список моделей пуст")
+        self.models = list(models)
+        self.health = {model: ModelHealth(model, breaker_factory()) for model in self.models}
+        self.hedge_delay = hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.max_attempts = max_attempts
+        self.max_parallel = max_parallel
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedges = 0
+        self.retries = 0
+
+    def _hedge_delay(self, model):
+        p95 = self.health[model].p95()
+        delay = self.hedge_delay if p95 is None else p95
+        return min(max(delay, self.min_hedge_delay), self.max_hedge_delay)
+
+    def _next_model(self, in_flight, tried):
+        """Следующая модель по порядку: сначала не пробованные, затем повторы"""
+        now = time.monotonic()
+        available = [m for m in self.models if m not in in_flight and self.health[m].breaker.allow(now)]
+        for model in available:
+            if model not in tried:
+                return model
+        if available:
+            return min(available, key=tried.count)
+        # Все автоматы открыты — не отказываем, а пробуем модель, что откроется раньше
+        # (сначала ту, которой сервер не просил ждать)
+        idle = [m for m in self.models if m not in in_flight]
+        breakers = {m: self.health[m].breaker for m in idle}
+        return min(idle, key=lambda m: (breakers[m].retry_until, breakers[m].open_until)) if idle else None
+
+    def _retry_wait(self, model):
+        """Сколько секунд ещё сервер просил не отправлять запросы модели (Retry-After)"""
+        return max(0.0, self.health[model].breaker.retry_until - time.monotonic())
+
+    def _backoff(self, retry, model):
+        """Пауза перед запуском модели: полный джиттер перед повтором (retry не None), но не
+        раньше срока Retry-After. None, если сервер просил ждать дольше backoff_max"""
+        retry_wait = self._retry_wait(model)
+        if retry_wait > self.backoff_max:
+            return None
+        delay = 0.0 if retry is None else random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** retry))
+        return max(delay, retry_wait)
+
+    async def run(self, attempt, tried=None):
+        """Возвращает (ответ, модель). AllModelsFailed, если все попытки не удались.
+
+        В tried (если передан список) дописываются модели в порядке запуска попыток."""
+        winner = None
+        tasks = {}  # task -> (model, started_at)
+        first_token_latency = {}
+        tried = [] if tried is None else tried
+        errors = []
+        retry = 0
+        # Запускать для хеджирования нечего (все модели уже в работе) — ждём, пока завершится попытка
+        hedge_ready = True
+
+        def launch(model):
+            def first_token():
+                nonlocal winner
+                if winner is None:
+                    winner = task
+                    first_token_latency[task] = time.monotonic() - started_at
+                    self.health[model].latencies.append(first_token_latency[task])
+                    for other in tasks:
+                        if other is not task:
+                            other.cancel()
+                return winner is task
+
+            started_at = time.monotonic()
+            task = asyncio.create_task(attempt(model, first_token))
+            tasks[task] = (model, started_at)
+            tried.append(model)
+
+        def closed_too_long(model):
+            errors.append(f"{model}: сервер просит подождать ещё {self._retry_wait(model):.0f} с")
+            logging.warning(f"Все модели просят подождать дольше {self.backoff_max:.0f} с (Retry-After), "
+                            f"запрос не отправлен")
+
+        try:
+            model = self._next_model(set(), tried)
+            delay = self._backoff(None, model)
+            if delay is None:
+                closed_too_long(model)
+            else:
+                if delay:
+                    await asyncio.sleep(delay)
+                launch(model)
+            while tasks:
+                can_hedge = (winner is None and hedge_ready and len(tried) < self.max_attempts
+                             and len(tasks) < min(self.max_parallel, len(self.models)))
+                timeout = None
+                if can_hedge:
+                    newest_model, newest_start = max(tasks.values(), key=lambda item: item[1])
+                    timeout = max(0.0, newest_start + self._hedge_delay(newest_model) - time.monotonic())
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    model = self._next_model({m for m, _ in tasks.values()}, tried)
+                    if model is None:
+                        hedge_ready = False
+                        continue
+                    self.hedges += 1
+                    logging.info(f"Хеджирование: {newest_model} молчит, запускаю {model}")
+                    launch(model)
+                    continue
+
+                hedge_ready = True
+                for task in done:
+                    model, started_at = tasks.pop(task)
+                    health = self.health[model]
+                    if task.cancelled():
+                        continue
+                    error = task.exception()
+                    if error is None and task.result():
+                        health.successes += 1
+                        # Медленным считается поздний первый токен, а не долгий поток. Без
+                        # запасной модели медленный ответ не сбой: переключаться всё равно некуда
+                        latency = first_token_latency.get(task, time.monotonic() - started_at)
+                        health.breaker.record(True, latency if len(self.models) > 1 else None)
+                        return task.result(), model
+                    health.failures += 1
+                    error = error or ModelCallError("Пустой ответ модели")
+                    errors.append(f"{model}: {error}")
+                    logging.warning(f"Модель {model} не ответила: {error}")
+                    if isinstance(error, ModelCallError) and error.retry_after is not None:
+                        health.breaker.trip(error.retry_after)
+                    else:
+                        health.breaker.record(False)
+                    if task is winner:
+                        # Поток оборвался после первого токена — дальше снова гонка
+                        winner = None
+
+                if not tasks and len(tried) < self.max_attempts:
+                    model = self._next_model(set(), tried)
+                    delay = self._backoff(retry, model)
+                    if delay is None:
+                        closed_too_long(model)
+                        break
+                    await asyncio.sleep(delay)
+                    retry += 1
+                    self.retries += 1
+                    launch(model)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        raise AllModelsFailed("; ".join(errors) or "Нет доступных моделей")
+
+    def stats(self):
+        return {
+            model: {
+                "state": health.breaker.state,
+                "p95": health.p95(),
+                "successes": health.successes,
+                "failures": health.failures,
+            }
+            for model, health in self.health.items()
+        }
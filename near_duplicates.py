@@ -0,0 +1,81 @@
+"""Почти дубликаты фрагментов: MinHash по шинглам из слов и LSH.
+
+Фрагмент превращается в множество шинглов — последовательностей из
+SHINGLE_SIZE слов без учёта регистра и пунктуации, — а множество в
+подпись из NUM_PERM минимальных хэшей. Доля совпавших позиций двух
+подписей оценивает коэффициент Жаккара их шинглов. Чтобы не сравнивать
+все пары, подпись режется на BANDS полос: сравниваются только фрагменты,
+у которых целиком совпала хотя бы одна полоса (при 32 полосах по 4 хэша
+пара с Жаккаром 0.5 становится кандидатом с вероятностью ~0.87, с 0.8 —
+почти наверняка).
+"""
+import re
+import zlib
+
+import numpy as np
+
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+BANDS = 32
+_WORD = re.compile(r"\w+")
+# Нечётные множители позиций слова в шингле (арифметика по модулю 2^64)
+_POSITION_WEIGHTS = np.random.default_rng(0).integers(1, 1 << 62, SHINGLE_SIZE, dtype=np.uint64) * 2 + 1
+
+
+def shingle_hashes(text, size=SHINGLE_SIZE):
+    """Уникальные 64-битные хэши шинглов текста; короткий текст — один шингл из всех слов.
+
+    Хэш шингла — сумма crc32 его слов с весами позиций, посчитанная
+    сразу для всех окон сдвигами массива, без склейки строк.
+    """
+    words = np.fromiter((zlib.crc32(word.encode()) for word in _WORD.findall(text.casefold())), dtype=np.uint64)
+    count = max(1, len(words) - size + 1)
+    hashes = np.zeros(count, dtype=np.uint64)
+    for offset in range(min(size, len(words))):
+        hashes += words[offset:offset + count] * _POSITION_WEIGHTS[offset]
+    return np.unique(hashes)
+
+
+class NearDuplicateFilter:
+    """Пропускает фрагменты, не похожие на уже принятые.
+
+    add(text) возвращает номер ранее принятого фрагмента, на который text
+    похож с оценкой Жаккара не ниже threshold, или None — тогда text
+    принимается и получает следующий номер. Порядок важен: из группы
+    похожих остаётся первый.
+    """
+
+    def __init__(self, threshold=0.7, num_perm=NUM_PERM, bands=BANDS, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm должен делиться на bands")
+        self.threshold = threshold
+        self.rows = num_perm // bands
+        # Перестановки — хэши multiply-shift: старшие 32 бита (a * x + b) mod 2^64
+        rnd = np.random.default_rng(seed)
+        self._a = rnd.integers(1, 1 << 62, num_perm, dtype=np.uint64) * 2 + 1
+        self._b = rnd.integers(0, 1 << 63, num_perm, dtype=np.uint64)
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = []
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def signature(self, text):
+        hashes = shingle_hashes(text)
+        return ((np.outer(hashes, self._a) + self._b) >> np.uint64(32)).min(axis=0)
+
+    def add(self, text):
+        signature = self.signature(text)
+        keys = [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(len(self._buckets))]
+        candidates = set()
+        for bucket, key in zip(self._buckets, keys):
+            candidates.update(bucket.get(key, ()))
+        for other in sorted(candidates):
+            if np.count_nonzero(self._signatures[other] == signature) >= self.threshold * len(signature):
+                return other
+
+        number = len(self._signatures)
+        self._signatures.append(signature)
+        for bucket, key in zip(self._buckets, keys):
+            bucket.setdefault(key, []).append(number)
+        return None
@@ -1,36 +1,62 @@
-from PyPDF2 import PdfReader
-import json
+"""Сборка индекса базы знаний заранее, вне бота.
+
+Берёт .txt и .pdf из папки источников, разбирает новые и изменённые файлы
+в пуле процессов (нормализация текста — chunker.normalize_lines), убирает
+точные и почти дубликаты фрагментов (near_duplicates.py), обучает модель
+ранжирования и пишет индекс в папку кэша новой версией (versions/):
+фрагменты и матрица весов (chunk_store.py) и состояние модели. На неё
+переключает meta.json с версией формата, отпечатком корпуса и манифестом
+исходников (sha256 и число фрагментов каждого файла). Повторный запуск разбирает заново только файлы с другим
+хэшем, а если файлы не менялись — оставляет индекс как есть.
+
+bot.py загружает этот индекс при старте без пересборки, а если папки
+источников нет — загружает его как есть.
+
+Запуск из корня репозитория:
+    python prepare_knowledge.py [--source base_knowledge] [--out knowledge_cache] [--workers 4] [--rehash]
+"""
 import os
+import json
+import logging
+import argparse
+
+from knowledge_index import CACHE_DIR, KNOWLEDGE_DIR, cached_manifest, current_version_dir, rebuild_index
+
+
+def artifact_size(cache_dir):
+    """Размер текущей версии индекса с meta.json, без разборов файлов (parts/), байт"""
+    return os.path.getsize(os.path.join(cache_dir, "meta.json")) + sum(
+        entry.stat().st_size for entry in os.scandir(current_version_dir(cache_dir)) if entry.is_file())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка индекса базы знаний из .txt и .pdf")
+    parser.add_argument("--source", default=KNOWLEDGE_DIR, help="папка с исходными файлами")
+    parser.add_argument("--out", default=CACHE_DIR, help="папка индекса (её читает bot.py)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="процессов для разбора файлов")
+    parser.add_argument("--rehash", action="store_true", help="пересчитать хэши всех файлов")
+    parser.add_argument("--json", action="store_true", help="вывести статистику одной строкой JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if not os.path.isdir(args.source):
+        parser.error(f"папка {args.source} не найдена")
+
+    stats = rebuild_index(args.source, args.out, cached_manifest(args.out), args.rehash, args.workers)
+    if args.json:
+        print(json.dumps(stats, ensure_ascii=False))
+        return
+    if "fingerprint" not in stats:
+        print(f"В {args.source}/ нет фрагментов — индекс не собран.")
+        return
+    print(f"Файлов: {stats['files']} (новых {len(stats['added'])}, изменённых {len(stats['changed'])}, "
+          f"удалённых {len(stats['removed'])}, разобрано заново {len(stats['parsed'])})")
+    print(f"Фрагментов: {stats['chunks']}, убрано дубликатов: {stats['duplicates']}, "
+          f"почти дубликатов: {stats['near_duplicates']}")
+    print(f"Индекс {args.out}/: {artifact_size(args.out) / 1024:.0f} КБ, "
+          f"отпечаток {stats['fingerprint'][:12]}, сборка {stats['seconds']:.2f} с")
+
 
-def extract_chunks(pdf_path, chunk_size=500):
-    reader = PdfReader(pdf_path)
-    text = ""
-    for page in reader.pages:
-        t = page.extract_text()
-        if t:
-            text += t + " "
-    sentences = text.split(". ")
-    chunks = []
-    current = ""
-    for sent in sentences:
-        if len(current.split()) + len(sent.split()) > chunk_size:
-            if len(current) > 50:
-                chunks.append(current.strip())
-            current = sent + ". "
-        else:
-            current += sent + ". "
-    if current and len(current) > 50:
-        chunks.append(current.strip())
-    return chunks
-
-all_chunks = []
-for filename in ["kniga-1.txt", "kniga-2.txt", "kniga-3.txt", "kniga-4.txt", "kniga-5.txt", "kniga-s1.txt", "kniga-s4.txt", "kniga-s2.txt", "kniga-s5.txt", "kniga-s3.txt"]:
-    if os.path.exists(filename):
-        print(f"Обрабатываю {filename}...")
-        chunks = extract_chunks(filename)
-        all_chunks.extend(chunks)
-
-with open("knowledge_chunks.json", "w", encoding="utf-8") as f:
-    json.dump(all_chunks, f, ensure_ascii=False, indent=2)
-
-print(f"Сохранено {len(all_chunks)} фрагментов.")
+if __name__ == "__main__":
+    main()
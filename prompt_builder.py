@@ -0,0 +1,133 @@
+"""Сборка промпта с бюджетом токенов.
+
+Промпт состоит из истории диалога, фрагментов знаний и текущего вопроса.
+Вопрос и системный промпт входят всегда; из остатка бюджета до
+KNOWLEDGE_SHARE отдаётся знаниям, остальное — истории:
+
+* фрагменты знаний идут в порядке ранжирования; фрагмент, который почти
+  целиком уже процитирован в истории или повторяет другой фрагмент,
+  пропускается, последний не поместившийся обрезается по предложению;
+* последние RECENT_TURNS пар вопрос-ответ истории передаются дословно,
+  у более старых остаются вопрос и начало ответа; что не влезло —
+  отбрасывается, начиная с самых старых.
+
+Токены оцениваются по длине текста (точный токенизатор модели не нужен
+для бюджета): у BPE-токенизаторов на русский текст приходится около трёх
+символов на токен.
+"""
+import os
+import re
+
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "3000"))
+RECENT_TURNS = int(os.environ.get("PROMPT_RECENT_TURNS", "2"))
+# Доля бюджета (за вычетом вопроса), которую могут занять фрагменты знаний
+KNOWLEDGE_SHARE = 0.6
+# Сколько символов ответа оставлять у старых пар истории
+OLD_ANSWER_CHARS = 300
+CHARS_PER_TOKEN = 3
+# Фрагмент, у которого такая доля словесных 4-грамм уже есть в истории, не повторяем
+DUPLICATE_OVERLAP = 0.5
+# Фрагменты короче этого после обрезки не имеют смысла
+MIN_KNOWLEDGE_CHARS = 200
+
+_WORD_RE = re.compile(r"\w+")
+_SENTENCE_END_RE = re.compile(r"[.!?…](?=\s|$)")
+
+
+def count_tokens(text):
+    """Оценка числа токенов текста"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate(text, max_chars):
+    """Обрезает текст до max_chars по границе предложения (или слова) и ставит многоточие"""
+    if len(text) <= max_chars:
+        return text
+    if max_chars <= 1:
+        return ""
+    head = text[:max_chars]
+    ends = [m.end() for m in _SENTENCE_END_RE.finditer(head)]
+    # Конец предложения берём, только если он не отрезает большую часть
+    cut = ends[-1] if ends and ends[-1] >= max_chars // 2 else head.rfind(" ")
+    if cut <= 0:
+        cut = max_chars
+    return head[:cut].rstrip() + "…"
+
+
+def _shingles(text, size=4):
+    words = _WORD_RE.findall(text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(0, len(words) - size + 1))}
+
+
+def _is_duplicate(shingles, seen):
+    return bool(shingles) and len(shingles & seen) / len(shingles) >= DUPLICATE_OVERLAP
+
+
+def _format_turn(number, question, answer):
+    return f"Вопрос {number}: {question}\n\nОтвет {number}: {answer}"
+
+
+def select_knowledge(knowledge, history, budget_tokens):
+    """Фрагменты знаний без повторов истории и друг друга, в пределах бюджета"""
+    seen = set()
+    for entry in history:
+        seen |= _shingles(entry["answer"])
+    selected = []
+    remaining_chars = budget_tokens * CHARS_PER_TOKEN
+    for text in knowledge:
+        shingles = _shingles(text)
+        if _is_duplicate(shingles, seen):
+            continue
+        # Разделитель между фрагментами тоже занимает место
+        if len(text) + 2 > remaining_chars:
+            if remaining_chars >= MIN_KNOWLEDGE_CHARS:
+                selected.append(truncate(text, remaining_chars - 2))
+            break
+        selected.append(text)
+        seen |= shingles
+        remaining_chars -= len(text) + 2
+    return selected
+
+
+def select_history(history, budget_tokens):
+    """Текст истории: последние пары дословно, старые — с сокращёнными ответами"""
+    remaining_chars = budget_tokens * CHARS_PER_TOKEN
+    turns = []
+    # Идём от новых к старым: при нехватке места теряются самые давние пары
+    for offset, entry in enumerate(reversed(history)):
+        number = len(history) - offset
+        answer = entry["answer"]
+        if offset >= RECENT_TURNS:
+            answer = truncate(answer, OLD_ANSWER_CHARS)
+        text = _format_turn(number, entry["question"], answer)
+        if len(text) + 2 > remaining_chars:
+            if offset == 0:
+                # Последний ответ нужен для уточняющего вопроса — оставляем его начало
+                overflow = len(text) + 2 - remaining_chars
+                short = truncate(answer, len(answer) - overflow)
+                if len(short) > 1:
+                    turns.append(_format_turn(number, entry["question"], short))
+            break
+        turns.append(text)
+        remaining_chars -= len(text) + 2
+    return "\n\n".join(reversed(turns))
+
+
+def build_user_prompt(question, history, knowledge, system_prompt="", budget=PROMPT_TOKEN_BUDGET):
+    """Собирает пользовательский промпт. Возвращает (промпт, оценка токенов вместе с системным)"""
+    frame = f"Текущий вопрос клиента: {question}\n\nОтветь на русском языке, без лишних слов."
+    available = max(0, budget - count_tokens(system_prompt) - count_tokens(frame))
+
+    knowledge_part = ""
+    chunks = select_knowledge(knowledge, history, int(available * KNOWLEDGE_SHARE))
+    if chunks:
+        knowledge_part = "Информация из строительных нормативов:\n" + "\n\n".join(chunks) + "\n\n"
+
+    conversation_part = ""
+    history_budget = available - count_tokens(knowledge_part) - count_tokens("Предыдущий диалог с клиентом:\n")
+    conversation = select_history(history, history_budget) if history else ""
+    if conversation:
+        conversation_part = f"Предыдущий диалог с клиентом:\n{conversation}\n\n"
+
+    prompt = f"{conversation_part}{knowledge_part}{frame}"
+    return prompt, count_tokens(system_prompt) + count_tokens(prompt)
@@ -0,0 +1,138 @@
+"""Ограничение частоты запросов пользователей и числа одновременных запросов к модели.
+
+Лимит — «ведро токенов» в форме GCRA: на пользователя хранится одно число,
+теоретическое время следующего запроса (TAT). Запрос разрешён, если TAT
+опережает текущее время не больше чем на (burst - 1) интервалов; после
+него TAT сдвигается на интервал 60 / per_minute. В любую минуту проходит
+не больше burst + per_minute запросов, а лимит восстанавливается плавно,
+а не целиком после минуты тишины.
+
+Пользователь, чей TAT уже в прошлом, неотличим от нового (ведро полное),
+поэтому его запись можно удалить без потерь. Локальный лимитер держит
+записи в порядке последней активности и на каждой проверке снимает с
+головы простаивающих — память пропорциональна числу активных
+пользователей, а не всех, кто когда-либо писал.
+
+SharedRateLimiter хранит TAT в общем хранилище session_store (ключ с TTL),
+чтобы лимит действовал на все воркеры.
+"""
+import time
+import math
+import asyncio
+from collections import OrderedDict
+
+
+class RateLimiter:
+    """Локальный лимитер GCRA с вытеснением простаивающих пользователей"""
+
+    def __init__(self, per_minute, burst=1, clock=time.monotonic):
+        self.interval = 60.0 / per_minute
+        self.tolerance = self.interval * (max(1, burst) - 1)
+        self.clock = clock
+        # key -> TAT; порядок — от давно активных к недавним
+        self._tat = OrderedDict()
+        # Наибольший размер с последней перестройки: таблица словаря сама не сжимается
+        self._peak = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._tat)
+
+    def evict_idle(self, now=None):
+        """Удаляет пользователей с полным ведром. Возвращает их число"""
+        now = self.clock() if now is None else now
+        tat = self._tat
+        removed = 0
+        # TAT растёт вместе с активностью, так что у головы он самый ранний
+        # (с точностью до tolerance) — дальше первого активного не смотрим
+        while tat:
+            key, value = next(iter(tat.items()))
+            if value > now:
+                break
+            del tat[key]
+            removed += 1
+        if removed:
+            self.evicted += removed
+            if len(tat) * 4 < self._peak:
+                # После массового вытеснения перестраиваем словарь, чтобы вернуть память
+                self._tat = OrderedDict(tat)
+                self._peak = len(tat)
+        return removed
+
+    def allow(self, key):
+        """Учитывает запрос. Возвращает True, если он укладывается в лимит"""
+        now = self.clock()
+        self.evict_idle(now)
+        tat = max(self._tat.get(key, now), now)
+        if tat - now > self.tolerance:
+            return False
+        self._tat[key] = tat + self.interval
+        self._tat.move_to_end(key)
+        self._peak = max(self._peak, len(self._tat))
+        return True
+
+    def retry_after(self, key):
+        """Через сколько секунд следующий запрос пройдёт"""
+        now = self.clock()
+        tat = self._tat.get(key, now)
+        return max(0.0, tat - self.tolerance - now)
+
+
+class SharedRateLimiter:
+    """Лимитер GCRA с состоянием в общем хранилище (SQLite или Redis из session_store).
+
+    Чтение и запись TAT не атомарны между воркерами: два одновременных
+    запроса одного пользователя в разные воркеры могут оба пройти — для
+    защиты от флуда это несущественно. Простаивающие записи удаляет TTL.
+    """
+
+    def __init__(self, backend, name, per_minute, burst=1):
+        self.backend = backend
+        self.name = name
+        self.interval = 60.0 / per_minute
+        self.tolerance = self.interval * (max(1, burst) - 1)
+
+    def _key(self, key):
+        return f"rate:{self.name}:{key}"
+
+    def allow(self, key):
+        # Время общее для машин, поэтому wall clock, а не monotonic
+        now = time.time()
+        raw = self.backend.get(self._key(key))
+        tat = max(float(raw), now) if raw else now
+        if tat - now > self.tolerance:
+            return False
+        tat += self.interval
+        self.backend.set(self._key(key), repr(tat), ex=math.ceil(tat - now) + 1)
+        return True
+
+    def retry_after(self, key):
+        now = time.time()
+        raw = self.backend.get(self._key(key))
+        tat = float(raw) if raw else now
+        return max(0.0, tat - self.tolerance - now)
+
+
+class ConcurrencyLimiter:
+    """Ограничение числа одновременных операций (0 — без ограничения)"""
+
+    def __init__(self, limit=0):
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit) if limit > 0 else None
+        self.in_flight = 0
+        self.waiting = 0
+
+    async def __aenter__(self):
+        if self._semaphore is not None:
+            self.waiting += 1
+            try:
+                await self._semaphore.acquire()
+            finally:
+                self.waiting -= 1
+        self.in_flight += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.in_flight -= 1
+        if self._semaphore is not None:
+            self._semaphore.release()
@@ -0,0 +1,173 @@
+"""Движки поиска по матрице фрагментов базы знаний.
+
+Матрица — CSR (фрагменты x термины) с весами, запрос — разреженный вектор
+в том же пространстве; оценка фрагмента — скалярное произведение.
+
+* DenseScanEngine — одно умножение матрицы на вектор по всем фрагментам.
+  Для нескольких книг это быстрее всего.
+* InvertedIndexEngine — списки вхождений терминов (CSC) с ранней
+  остановкой в духе MaxScore: оцениваются только фрагменты с общими
+  терминами, а после того как верхняя граница оставшихся терминов опустится
+  ниже текущего k-го результата, новые кандидаты больше не заводятся.
+  Окупается на сотнях книг.
+
+Движок выбирается настройкой RETRIEVAL_ENGINE (dense | inverted).
+mmr_order переупорядочивает кандидатов выдачи так, чтобы top-k не
+повторяли друг друга (Maximal Marginal Relevance).
+"""
+import numpy as np
+
+
+class RetrievalEngine:
+    """Базовый интерфейс движка поиска"""
+
+    name = ""
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+
+    def search(self, query_vec, top_k):
+        """Возвращает (индексы фрагментов, оценки) в порядке убывания оценки"""
+        raise NotImplementedError
+
+    @property
+    def nbytes(self):
+        """Память под структуры движка, байт"""
+        return _csr_nbytes(self.matrix)
+
+
+def _csr_nbytes(matrix):
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+def _top_k(ids, scores, top_k):
+    if top_k < len(scores):
+        part = np.argpartition(-scores, top_k)[:top_k]
+        ids, scores = ids[part], scores[part]
+    order = np.argsort(-scores, kind="stable")
+    return ids[order], scores[order]
+
+
+class DenseScanEngine(RetrievalEngine):
+    """Полный перебор: одно умножение разреженной матрицы на вектор"""
+
+    name = "dense"
+
+    def search(self, query_vec, top_k):
+        n = self.matrix.shape[0]
+        if n == 0 or query_vec.nnz == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        scores = (self.matrix @ query_vec.T).toarray().ravel()
+        return _top_k(np.arange(n), scores, top_k)
+
+
+class InvertedIndexEngine(RetrievalEngine):
+    """Инвертированный индекс с ранней остановкой MaxScore (term-at-a-time)"""
+
+    name = "inverted"
+
+    def __init__(self, matrix):
+        super().__init__(matrix)
+        # Столбец CSC — список вхождений термина: номера фрагментов по возрастанию и веса
+        self.postings = matrix.tocsc()
+        self.postings.sort_indices()
+        # Максимальный вес термина во всех фрагментах — для верхних границ оценки
+        self.max_weights = self.postings.max(axis=0).toarray().ravel()
+
+    @property
+    def nbytes(self):
+        return _csr_nbytes(self.postings) + self.max_weights.nbytes
+
+    def _term_postings(self, term):
+        start, end = self.postings.indptr[term], self.postings.indptr[term + 1]
+        return self.postings.indices[start:end], self.postings.data[start:end]
+
+    def search(self, query_vec, top_k):
+        empty = np.empty(0, dtype=np.int64), np.empty(0)
+        query_vec = query_vec.tocsr()
+        terms, weights = query_vec.indices, query_vec.data
+        if len(terms) == 0:
+            return empty
+
+        # Термины по убыванию вклада, который они могут дать
+        upper_bounds = weights * self.max_weights[terms]
+        order = np.argsort(-upper_bounds, kind="stable")
+        terms, weights, upper_bounds = terms[order], weights[order], upper_bounds[order]
+        remaining = np.concatenate([np.cumsum(upper_bounds[::-1])[::-1][1:], [0.0]])
+
+        cand_ids = np.empty(0, dtype=self.postings.indices.dtype)
+        cand_scores = np.empty(0)
+        i = 0
+        # Фаза 1: «существенные» термины — их вхождения заводят новых кандидатов
+        while i < len(terms):
+            ids, data = self._term_postings(terms[i])
+            if len(ids):
+                merged_ids = np.concatenate([cand_ids, ids])
+                merged_scores = np.concatenate([cand_scores, data * weights[i]])
+                cand_ids, inverse = np.unique(merged_ids, return_inverse=True)
+                cand_scores = np.bincount(inverse, weights=merged_scores, minlength=len(cand_ids))
+            i += 1
+            if len(cand_scores) >= top_k:
+                threshold = np.partition(cand_scores, -top_k)[-top_k]
+                # Фрагмент, не встретивший ни одного из уже пройденных терминов,
+                # не наберёт больше remaining[i-1] — ниже порога, новых кандидатов не будет
+                if remaining[i - 1] < threshold:
+                    break
+        if len(cand_ids) == 0:
+            return empty
+
+        # Фаза 2: оставшиеся термины только дооценивают кандидатов
+        while i < len(terms):
+            threshold = np.partition(cand_scores, -top_k)[-top_k] if len(cand_scores) >= top_k else 0.0
+            # Кандидат, которому не хватит даже всех оставшихся терминов, выбывает
+            keep = cand_scores + remaining[i - 1] >= threshold
+            if not keep.all():
+                cand_ids, cand_scores = cand_ids[keep], cand_scores[keep]
+            ids, data = self._term_postings(terms[i])
+            if len(ids) and len(cand_ids):
+                pos = np.searchsorted(ids, cand_ids)
+                pos[pos == len(ids)] = 0
+                hit = ids[pos] == cand_ids
+                cand_scores[hit] += data[pos[hit]] * weights[i]
+            i += 1
+
+        return _top_k(cand_ids.astype(np.int64), cand_scores, top_k)
+
+
+def mmr_order(vectors, scores, top_k, relevance_weight):
+    """Порядок top_k кандидатов по MMR.
+
+    vectors — строки матрицы кандидатов (CSR), scores — их оценки по
+    убыванию. На каждом шаге берётся кандидат с наибольшим
+    relevance_weight * оценка - (1 - relevance_weight) * max косинус с уже
+    выбранными; оценки нормируются на лучшую. Первым всегда идёт лучший.
+    """
+    norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    similarity = (vectors @ vectors.T).toarray() / np.outer(norms, norms)
+    relevance = scores / scores[0] if scores[0] > 0 else scores
+
+    selected = [0]
+    max_similarity = similarity[0].copy()
+    while len(selected) < min(top_k, len(scores)):
+        mmr = relevance_weight * relevance - (1 - relevance_weight) * max_similarity
+        mmr[selected] = -np.inf
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return np.array(selected)
+
+
+ENGINES = {
+    DenseScanEngine.name: DenseScanEngine,
+    InvertedIndexEngine.name: InvertedIndexEngine,
+}
+
+
+def create_engine(name, matrix):
+    """Создаёт движок по имени из настройки RETRIEVAL_ENGINE"""
+    try:
+        engine_cls = ENGINES[name]
+    except KeyError:
+        raise ValueError(f"Неизвестный движок поиска: {name!r}, доступны: {', '.join(ENGINES)}")
+    return engine_cls(matrix)
@@ -0,0 +1,121 @@
+"""Планировщик периодических задач на event loop бота.
+
+Каждая задача — корутина на том же цикле, что Application и http_client:
+она спит до следующего запуска и выполняет работу, а тяжёлые части
+задачи сами уходят в пулы потоков (run_db, asyncio.to_thread). Время
+ежедневных задач считается в явном часовом поясе (по умолчанию
+Europe/Moscow), а не в поясе сервера. Сон ограничен MAX_SLEEP, чтобы
+перевод системных часов не сдвигал запуск больше чем на этот интервал.
+"""
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+import pytz
+
+import metrics
+
+
+class Job:
+    """Задача планировщика: ежедневно в заданное время или с интервалом в секундах"""
+
+    def __init__(self, name, func, at=None, interval=None):
+        self.name = name
+        self.func = func
+        self.at = at
+        self.interval = interval
+        self.next_run = None
+        self.runs = 0
+        self.failures = 0
+        self.last_duration = None
+
+    def schedule_next(self, tz, now=None):
+        """Считает время следующего запуска (unix time)"""
+        now = time.time() if now is None else now
+        if self.interval is not None:
+            self.next_run = now + self.interval
+            return self.next_run
+        local_now = datetime.fromtimestamp(now, tz)
+        day = local_now.date()
+        while True:
+            # localize по дате — переход на летнее время не сдвигает задачу
+            candidate = tz.localize(datetime.combine(day, self.at))
+            if candidate.timestamp() > now:
+                self.next_run = candidate.timestamp()
+                return self.next_run
+            day += timedelta(days=1)
+
+
+class Scheduler:
+    """Запускает задачи на текущем event loop; start() и stop() вызываются из него же"""
+
+    MAX_SLEEP = 3600.0
+
+    def __init__(self, timezone="Europe/Moscow"):
+        self.tz = pytz.timezone(timezone)
+        self.jobs = []
+        self._tasks = []
+
+    def daily(self, at, func, name=None):
+        """Ежедневно в at ('ЧЧ:ММ' в поясе планировщика)"""
+        at = datetime.strptime(at, "%H:%M").time()
+        job = Job(name or func.__name__, func, at=at)
+        self.jobs.append(job)
+        return job
+
+    def every(self, seconds, func, name=None):
+        """Каждые seconds секунд; первый запуск — через seconds после старта"""
+        job = Job(name or func.__name__, func, interval=seconds)
+        self.jobs.append(job)
+        return job
+
+    def start(self):
+        for job in self.jobs:
+            job.schedule_next(self.tz)
+            self._tasks.append(asyncio.create_task(self._loop(job), name=f"job:{job.name}"))
+            logging.info(f"Задача {job.name}: следующий запуск {self._format(job.next_run)}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _format(self, timestamp):
+        return datetime.fromtimestamp(timestamp, self.tz).strftime("%d.%m.%Y %H:%M:%S %Z")
+
+    async def _loop(self, job):
+        while True:
+            delay = job.next_run - time.time()
+            if delay > 0:
+                await asyncio.sleep(min(delay, self.MAX_SLEEP))
+                continue
+            await self.run_job(job)
+            job.schedule_next(self.tz)
+
+    async def run_job(self, job):
+        """Выполняет задачу сейчас; ошибка задачи не останавливает планировщик"""
+        metrics.trace_id.set(f"job:{job.name}")
+        started = time.perf_counter()
+        try:
+            await job.func()
+        except Exception as e:
+            job.failures += 1
+            logging.error(f"Ошибка задачи {job.name}: {e}")
+        finally:
+            job.runs += 1
+            job.last_duration = time.perf_counter() - started
+        logging.info(f"Задача {job.name} выполнена за {job.last_duration:.2f} с")
+
+    def stats(self):
+        return [
+            {
+                "name": job.name,
+                "next_run": self._format(job.next_run) if job.next_run else None,
+                "runs": job.runs,
+                "failures": job.failures,
+                "last_duration": job.last_duration,
+            }
+            for job in self.jobs
+        ]
@@ -0,0 +1,215 @@
+"""Модели ранжирования фрагментов базы знаний: TF-IDF и BM25 со стеммингом.
+
+Модель превращает фрагменты в матрицу весов (фрагменты x термины), а
+запрос — в разреженный вектор; оценка фрагмента — их скалярное
+произведение, его считает движок из retrieval.py.
+
+* tfidf — прежний TfidfVectorizer из scikit-learn без морфологии.
+* bm25 — русский токенизатор: нижний регистр, ё -> е, стоп-слова,
+  стемминг Snowball с кэшем; словарь урезается по min_df/max_df, веса
+  BM25 фрагментов считаются один раз при сборке индекса.
+
+Кроме весов для поиска модель даёт L2-нормированные векторы transform()
+для сравнения коротких текстов между собой (кэш ответов).
+"""
+import re
+from functools import lru_cache
+
+import numpy as np
+from scipy import sparse
+import snowballstemmer
+
+# Служебные слова русского языка, не несущие смысла для поиска
+RUSSIAN_STOPWORDS = frozenset("""
+а без более бы был была были было быть в вам вас весь во вот все всего всех вы где да даже для до его
+ее если есть еще же за здесь и из или им их к как какая какие каким какой когда кто ли либо между меня
+мне может можно мой моя мы на над надо наш не него нее нет ни них но ну о об однако он она они оно от
+очень по под после при про с со так также такой там те тем то того тоже той только том ты у уже хотя
+чего чей чем что чтобы чье чья эта эти это этого этой этом этот я ее ей ему нам нами них всё её
+зачем почему сколько насколько какая какую каких такое нужно нужен нужна нужны вместо перед
+""".split())
+
+_TOKEN_RE = re.compile(r"\w+")
+_stemmer = snowballstemmer.stemmer("russian")
+
+
+@lru_cache(maxsize=200_000)
+def stem(word):
+    """Основа слова; результаты кэшируются — словарь корпуса повторяется постоянно"""
+    return _stemmer.stemWord(word)
+
+
+def analyze(text):
+    """Разбивает текст на основы слов без стоп-слов"""
+    terms = []
+    for token in _TOKEN_RE.findall(text.lower().replace("ё", "е")):
+        if token in RUSSIAN_STOPWORDS or "_" in token:
+            continue
+        # Одиночные цифры и буквы (номера пунктов, рисунков) поиску не помогают
+        if len(token) < 2:
+            continue
+        terms.append(stem(token) if not token.isdigit() else token)
+    return terms
+
+
+def _l2_normalize_rows(matrix):
+    matrix = matrix.tocsr()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms) @ matrix
+
+
+def _tfidf_vectorizer(**kwargs):
+    # scikit-learn импортируется больше секунды (тянет scipy.stats и pandas) — только для модели tfidf
+    from sklearn.feature_extraction.text import TfidfVectorizer
+
+    return TfidfVectorizer(stop_words=None, **kwargs)
+
+
+class TfidfModel:
+    """TF-IDF без морфологии (TfidfVectorizer), косинусная близость"""
+
+    name = "tfidf"
+    # Порог косинусной близости для фрагмента в выдаче
+    min_score = 0.1
+
+    def __init__(self, vectorizer=None):
+        if vectorizer is None:
+            vectorizer = _tfidf_vectorizer()
+        self.vectorizer = vectorizer
+
+    @property
+    def vocabulary_size(self):
+        return len(self.vectorizer.vocabulary_)
+
+    def analyze_chunks(self, chunks):
+        # TfidfVectorizer разбирает тексты сам, заранее разбирать нечего
+        return None
+
+    def fit_transform(self, chunks, analyzed=None):
+        return self.vectorizer.fit_transform(chunks).tocsr()
+
+    def transform(self, texts):
+        return self.vectorizer.transform(texts)
+
+    def query_vector(self, query):
+        return self.vectorizer.transform([query])
+
+    def get_state(self):
+        vocabulary = {term: int(idx) for term, idx in self.vectorizer.vocabulary_.items()}
+        return {"vocabulary": vocabulary}, {"idf": self.vectorizer.idf_}
+
+    @classmethod
+    def from_state(cls, params, arrays):
+        vectorizer = _tfidf_vectorizer(vocabulary=params["vocabulary"])
+        vectorizer.idf_ = arrays["idf"]
+        return cls(vectorizer)
+
+
+class Bm25Model:
+    """BM25 по основам слов с русскими стоп-словами и урезанным словарём"""
+
+    name = "bm25"
+    # Минимальная оценка BM25 фрагмента в выдаче: отсекает совпадения по одному общему слову
+    min_score = 6.0
+
+    def __init__(self, k1=1.5, b=0.75, min_df=1, max_df=0.5, vocabulary=None, idf=None):
+        self.k1 = k1
+        self.b = b
+        self.min_df = min_df
+        self.max_df = max_df
+        self.vocabulary = vocabulary or {}
+        self.idf = idf
+
+    @property
+    def vocabulary_size(self):
+        return len(self.vocabulary)
+
+    @staticmethod
+    def _count_matrix(analyzed, vocabulary):
+        """Матрица частот основ (тексты x словарь) по уже разобранным текстам"""
+        indptr, indices, data = [0], [], []
+        for terms in analyzed:
+            counts = {}
+            for term in terms:
+                idx = vocabulary.get(term)
+                if idx is not None:
+                    counts[idx] = counts.get(idx, 0) + 1
+            indices.extend(counts)
+            data.extend(counts.values())
+            indptr.append(len(indices))
+        return sparse.csr_matrix(
+            (np.asarray(data, dtype=np.float64), np.asarray(indices, dtype=np.int32), indptr),
+            shape=(len(analyzed), len(vocabulary)),
+        )
+
+    def analyze_chunks(self, chunks):
+        """Основы слов фрагментов; их можно сохранить и не разбирать неизменённые файлы заново"""
+        return [analyze(chunk) for chunk in chunks]
+
+    def fit_transform(self, chunks, analyzed=None):
+        if analyzed is None:
+            analyzed = self.analyze_chunks(chunks)
+        n_docs = len(analyzed)
+
+        # Словарь: термины с документной частотой в [min_df, max_df * n_docs]
+        df = {}
+        for terms in analyzed:
+            for term in set(terms):
+                df[term] = df.get(term, 0) + 1
+        max_docs = self.max_df * n_docs if isinstance(self.max_df, float) else self.max_df
+        kept = sorted(term for term, freq in df.items() if self.min_df <= freq <= max_docs)
+        self.vocabulary = {term: idx for idx, term in enumerate(kept)}
+        doc_freq = np.array([df[term] for term in kept], dtype=np.float64)
+        self.idf = np.log1p((n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+        # Веса BM25 считаются по полной длине фрагмента, включая урезанные термины
+        tf = self._count_matrix(analyzed, self.vocabulary)
+        doc_len = np.array([len(terms) for terms in analyzed], dtype=np.float64)
+        avg_len = doc_len.mean() if n_docs else 0.0
+        norm = self.k1 * (1 - self.b + self.b * doc_len / (avg_len or 1.0))
+        row_norm = np.repeat(norm, np.diff(tf.indptr))
+        tf.data = self.idf[tf.indices] * tf.data * (self.k1 + 1) / (tf.data + row_norm)
+        return tf
+
+    def transform(self, texts):
+        counts = self._count_matrix([analyze(text) for text in texts], self.vocabulary)
+        counts.data = np.log1p(counts.data) * self.idf[counts.indices]
+        return _l2_normalize_rows(counts)
+
+    def query_vector(self, query):
+        # Каждый термин запроса учитывается один раз: вес — в матрице фрагментов
+        vec = self._count_matrix([analyze(query)], self.vocabulary)
+        vec.data[:] = 1.0
+        return vec
+
+    def get_state(self):
+        params = {
+            "k1": self.k1, "b": self.b, "min_df": self.min_df, "max_df": self.max_df,
+            # Словарь хранится списком: номер термина — его позиция
+            "terms": sorted(self.vocabulary, key=self.vocabulary.get),
+        }
+        return params, {"idf": self.idf}
+
+    @classmethod
+    def from_state(cls, params, arrays):
+        vocabulary = {term: idx for idx, term in enumerate(params["terms"])}
+        return cls(params["k1"], params["b"], params["min_df"], params["max_df"], vocabulary, arrays["idf"])
+
+
+MODELS = {
+    TfidfModel.name: TfidfModel,
+    Bm25Model.name: Bm25Model,
+}
+
+
+def create_model(name):
+    """Создаёт модель по имени из настройки KNOWLEDGE_MODEL"""
+    try:
+        return MODELS[name]()
+    except KeyError:
+        raise ValueError(f"Неизвестная модель ранжирования: {name!r}, доступны: {', '.join(MODELS)}")
+
+
+def model_from_state(name, params, arrays):
+    return MODELS[name].from_state(params, arrays)
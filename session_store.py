@@ -0,0 +1,371 @@
+"""Хранилище состояния пользователей: user_data бота и счётчики rate limit.
+
+Состояние лежит в хранилище ключ-значение с подмножеством интерфейса Redis
+(get/set/delete/incr/expire/scan_iter), поэтому бэкенд подключаемый:
+
+* SQLiteBackend — по умолчанию, файл SESSION_DB; общий для воркеров на
+  одной машине и переживает перезапуск;
+* Redis — если задан REDIS_URL (нужен пакет redis); общий для всех машин;
+* MemoryBackend — в памяти процесса, локальная замена Redis (SESSION_DB=:memory:).
+
+SessionPersistence подключается к Application через .persistence(...).
+PTB сам копит изменённые user_data и отдаёт их раз в update_interval;
+здесь они дополнительно склеиваются в одну транзакцию, так что сообщение
+пользователя не добавляет записи на диск. Перед обработкой каждого
+обновления user_data перечитывается, если другой воркер сохранил более
+свежую версию.
+"""
+import os
+import json
+import time
+import fnmatch
+import asyncio
+import logging
+import sqlite3
+import threading
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+SESSION_DB = os.environ.get("SESSION_DB", "sessions.db")
+REDIS_URL = os.environ.get("REDIS_URL", "")
+# Как часто сбрасывать изменённые user_data в хранилище, сек
+SESSION_FLUSH_INTERVAL = float(os.environ.get("SESSION_FLUSH_INTERVAL", "10"))
+# Сколько хранится сессия неактивного пользователя, сек (продлевается каждой записью; 0 — бессрочно)
+SESSION_TTL = int(os.environ.get("SESSION_TTL", str(30 * 24 * 3600)))
+
+USER_KEY_PREFIX = "user:"
+
+
+class MemoryBackend:
+    """Хранилище ключ-значение в памяти процесса с интерфейсом подмножества Redis"""
+
+    def __init__(self):
+        self._data = {}  # key -> (value, expires_at или None)
+        self._lock = threading.Lock()
+
+    def _alive(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._alive(key, time.time())
+            return entry[0] if entry else None
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = (value, time.time() + ex if ex else None)
+        return True
+
+    def mset(self, mapping, ex=None):
+        with self._lock:
+            expires_at = time.time() + ex if ex else None
+            for key, value in mapping.items():
+                self._data[key] = (value, expires_at)
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            entry = self._alive(key, time.time())
+            value = int(entry[0]) + amount if entry else amount
+            self._data[key] = (str(value), entry[1] if entry else None)
+            return value
+
+    def expire(self, key, seconds):
+        with self._lock:
+            entry = self._alive(key, time.time())
+            if entry is None:
+                return False
+            self._data[key] = (entry[0], time.time() + seconds)
+            return True
+
+    def scan_iter(self, match="*"):
+        now = time.time()
+        with self._lock:
+            keys = [key for key in list(self._data) if self._alive(key, now) and fnmatch.fnmatchcase(key, match)]
+        return iter(keys)
+
+    def purge_expired(self):
+        """Удаляет просроченные ключи. Возвращает их число"""
+        now = time.time()
+        with self._lock:
+            expired = [key for key, (_, expires_at) in self._data.items() if expires_at is not None and expires_at <= now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """Хранилище ключ-значение в SQLite с интерфейсом подмножества Redis"""
+
+    # Просроченные ключи (окна rate limit) вычищаются раз в столько записей
+    PURGE_EVERY = 1000
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS kv (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            )
+        ''')
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def _written(self):
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self._purge()
+
+    def _purge(self):
+        return self._conn.execute(
+            "DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+        ).rowcount
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM kv WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time()),
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, time.time() + ex if ex else None),
+            )
+            self._written()
+        return True
+
+    def mset(self, mapping, ex=None):
+        """Записывает несколько ключей одной транзакцией; ex — срок жизни всех ключей, сек"""
+        expires_at = time.time() + ex if ex else None
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                    ((key, value, expires_at) for key, value in mapping.items()),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._written()
+        return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._conn.execute("DELETE FROM kv WHERE key = ?", (key,)).rowcount for key in keys)
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                # Просроченный ключ начинает счёт заново, как в Redis
+                self._conn.execute("DELETE FROM kv WHERE key = ? AND expires_at <= ?", (key, now))
+                self._conn.execute('''
+                    INSERT INTO kv (key, value, expires_at) VALUES (?, ?, NULL)
+                    ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + excluded.value
+                ''', (key, amount))
+                value = int(self._conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()[0])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._written()
+        return value
+
+    def expire(self, key, seconds):
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE kv SET expires_at = ? WHERE key = ?", (time.time() + seconds, key)
+            ).rowcount > 0
+
+    def scan_iter(self, match="*"):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key FROM kv WHERE key GLOB ? AND (expires_at IS NULL OR expires_at > ?)",
+                (match, time.time()),
+            ).fetchall()
+        return iter(row[0] for row in rows)
+
+    def purge_expired(self):
+        """Удаляет просроченные ключи. Возвращает их число"""
+        with self._lock:
+            return self._purge()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_backend(redis_url=REDIS_URL, path=SESSION_DB):
+    """Redis при заданном REDIS_URL, иначе SQLite (или память для ':memory:')"""
+    if redis_url:
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("REDIS_URL задан, но пакет redis не установлен: pip install redis")
+        return redis.Redis.from_url(redis_url, decode_responses=True)
+    if path == ":memory:":
+        return MemoryBackend()
+    return SQLiteBackend(path)
+
+
+class SessionPersistence(BasePersistence):
+    """Персистентность user_data поверх хранилища ключ-значение.
+
+    Хранятся только user_data (история диалога, флаги консультации и отзыва);
+    chat_data, bot_data и callback_data боту не нужны.
+    """
+
+    def __init__(self, backend, update_interval=SESSION_FLUSH_INTERVAL, ttl=SESSION_TTL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.backend = backend
+        self.ttl = ttl or None
+        # user_id -> время версии, которую видел этот воркер
+        self._versions = {}
+        self._pending = {}
+        self._write_task = None
+
+    @staticmethod
+    def _key(user_id):
+        return f"{USER_KEY_PREFIX}{user_id}"
+
+    def _store(self, batch):
+        if hasattr(self.backend, "pipeline"):
+            # У Redis MSET без срока жизни — пишем SET ... EX одним конвейером
+            pipe = self.backend.pipeline()
+            for key, value in batch.items():
+                pipe.set(key, value, ex=self.ttl)
+            pipe.execute()
+        else:
+            self.backend.mset(batch, ex=self.ttl)
+
+    def _load(self, user_id):
+        raw = self.backend.get(self._key(user_id))
+        return json.loads(raw) if raw else None
+
+    async def get_user_data(self):
+        def load_all():
+            users = {}
+            for key in self.backend.scan_iter(f"{USER_KEY_PREFIX}*"):
+                raw = self.backend.get(key)
+                if raw:
+                    user_id = int(key[len(USER_KEY_PREFIX):])
+                    record = json.loads(raw)
+                    users[user_id] = record["data"]
+                    self._versions[user_id] = record["updated_at"]
+            return users
+
+        users = await asyncio.to_thread(load_all)
+        logging.info(f"Загружены сессии {len(users)} пользователей")
+        return users
+
+    async def update_user_data(self, user_id, data):
+        # PTB вызывает метод для каждого изменённого пользователя разом —
+        # копим их и пишем одной транзакцией
+        updated_at = time.time()
+        self._versions[user_id] = updated_at
+        self._pending[self._key(user_id)] = json.dumps({"updated_at": updated_at, "data": data}, ensure_ascii=False)
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        try:
+            # Даём остальным update_user_data этого прохода попасть в пачку
+            await asyncio.sleep(0)
+            while self._pending:
+                batch, self._pending = self._pending, {}
+                try:
+                    await asyncio.to_thread(self._store, batch)
+                except Exception:
+                    # Пачка вернётся в следующую запись; изменения, пришедшие за время сбоя, новее
+                    self._pending = {**batch, **self._pending}
+                    raise
+        except Exception as e:
+            logging.error(f"Ошибка сохранения сессий: {e}")
+        finally:
+            self._write_task = None
+
+    async def refresh_user_data(self, user_id, user_data):
+        if self._key(user_id) in self._pending:
+            return
+        try:
+            record = await asyncio.to_thread(self._load, user_id)
+        except Exception as e:
+            logging.warning(f"Не удалось перечитать сессию пользователя {user_id}: {e}")
+            return
+        # Подхватываем версию, сохранённую другим воркером
+        if record and record["updated_at"] > self._versions.get(user_id, 0.0):
+            user_data.clear()
+            user_data.update(record["data"])
+            self._versions[user_id] = record["updated_at"]
+
+    async def drop_user_data(self, user_id):
+        self._versions.pop(user_id, None)
+        self._pending.pop(self._key(user_id), None)
+        await asyncio.to_thread(self.backend.delete, self._key(user_id))
+
+    async def flush(self):
+        if self._write_task is not None:
+            await self._write_task
+        if self._pending:
+            await self._write_pending()
+
+    # chat_data, bot_data, callback_data и диалоги ConversationHandler не хранятся
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
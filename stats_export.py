@@ -0,0 +1,197 @@
+"""Выгрузка статистики взаимодействий для /stats: Excel, CSV или Parquet.
+
+Строки идут из курсора SQLite (storage.iter_admin_stats) прямо в файл за
+один проход, без DataFrame: Excel пишется книгой в режиме write_only,
+поэтому расход памяти не зависит от числа строк. Ширина колонок в
+write_only задаётся до первой строки — она считается по первым
+WIDTH_SAMPLE_ROWS строкам, которые для этого придерживаются в памяти.
+Выгрузка блокирующая, бот вызывает её в отдельном потоке.
+"""
+import csv
+from datetime import datetime, timedelta
+
+from storage import iter_admin_stats
+
+HEADERS = [
+    "ID пользователя", "Имя пользователя", "Имя", "Фамилия",
+    "Вопрос", "Ответ", "Дата/время", "Оценка", "Комментарий"
+]
+FORMATS = ("xlsx", "csv", "parquet")
+WIDTH_SAMPLE_ROWS = 1000
+MAX_COLUMN_WIDTH = 50
+# Вопрос и ответ в выгрузке обрезаются, как и раньше
+MAX_TEXT_CHARS = 100
+PARQUET_BATCH_ROWS = 10000
+DEFAULT_DAYS = 30
+# Bot API не принимает документы больше 50 МБ
+MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+
+USAGE = (
+    "Использование: /stats [дней | ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]] [xlsx|csv|parquet]\n"
+    "Например: /stats, /stats 7, /stats 2025-01-01 2025-01-31 csv"
+)
+
+
+class StatsSummary:
+    """Итоги выгрузки, собранные в том же проходе"""
+
+    def __init__(self):
+        self.rows = 0
+        self.users = set()
+        self.ratings_sum = 0
+        self.ratings_count = 0
+
+    def add(self, row):
+        self.rows += 1
+        self.users.add(row[0])
+        if row[7] is not None:
+            self.ratings_sum += row[7]
+            self.ratings_count += 1
+
+    @property
+    def average_rating(self):
+        return self.ratings_sum / self.ratings_count if self.ratings_count else None
+
+
+def parse_stats_args(args, now):
+    """Разбирает аргументы /stats. Возвращает (начало, конец, формат, подпись периода).
+
+    now — текущее время в часовом поясе, в котором заданы даты; границы
+    периода возвращаются в том же поясе. ValueError при неверных аргументах.
+    """
+    fmt = "xlsx"
+    values = []
+    for arg in args:
+        if arg.lower() in FORMATS:
+            fmt = arg.lower()
+        else:
+            values.append(arg)
+    if len(values) > 2:
+        raise ValueError(USAGE)
+
+    if not values or (len(values) == 1 and values[0].isdigit()):
+        days = int(values[0]) if values else DEFAULT_DAYS
+        if days <= 0:
+            raise ValueError(USAGE)
+        return now - timedelta(days=days), now, fmt, f"за последние {days} дн."
+
+    try:
+        dates = [datetime.strptime(value, "%Y-%m-%d") for value in values]
+    except ValueError:
+        raise ValueError(USAGE)
+    start = now.replace(year=dates[0].year, month=dates[0].month, day=dates[0].day,
+                        hour=0, minute=0, second=0, microsecond=0)
+    last = dates[-1]
+    end = start.replace(year=last.year, month=last.month, day=last.day) + timedelta(days=1)
+    if end <= start:
+        raise ValueError(USAGE)
+    label = f"за {values[0]}" if len(values) == 1 else f"с {values[0]} по {values[1]}"
+    return start, end, fmt, label
+
+
+def _short(text):
+    text = text or ""
+    return text[:MAX_TEXT_CHARS] + "..." if len(text) > MAX_TEXT_CHARS else text
+
+
+def _format_row(row):
+    user_id, username, first_name, last_name, question, answer, timestamp, rating, comment = row
+    return [
+        user_id, username or "", first_name or "", last_name or "",
+        _short(question), _short(answer), timestamp,
+        rating if rating is not None else "Нет оценки", comment or "",
+    ]
+
+
+def _write_xlsx(rows, path, summary):
+    # openpyxl импортируется при первой выгрузке, а не при старте бота
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font, Alignment
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Статистика бота")
+
+    sample = []
+    for row in rows:
+        summary.add(row)
+        sample.append(_format_row(row))
+        if len(sample) >= WIDTH_SAMPLE_ROWS:
+            break
+
+    # Автоширина по заголовку и первым строкам
+    widths = [len(header) for header in HEADERS]
+    for values in sample:
+        for col, value in enumerate(values):
+            widths[col] = max(widths[col], len(str(value)))
+    for col, width in enumerate(widths, 1):
+        ws.column_dimensions[get_column_letter(col)].width = min(width + 2, MAX_COLUMN_WIDTH)
+
+    header_cells = []
+    for header in HEADERS:
+        cell = WriteOnlyCell(ws, value=header)
+        cell.font = Font(bold=True)
+        cell.alignment = Alignment(horizontal="center")
+        header_cells.append(cell)
+    ws.append(header_cells)
+
+    for values in sample:
+        ws.append(values)
+    del sample
+    for row in rows:
+        summary.add(row)
+        ws.append(_format_row(row))
+    wb.save(path)
+
+
+def _write_csv(rows, path, summary):
+    # utf-8-sig — чтобы Excel сразу открыл кириллицу
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(HEADERS)
+        for row in rows:
+            summary.add(row)
+            writer.writerow(_format_row(row))
+
+
+def _write_parquet(rows, path, summary):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Для выгрузки в Parquet нужен пакет pyarrow: pip install pyarrow")
+
+    # В Parquet храним исходные значения: полный текст и оценку числом (null — нет оценки)
+    schema = pa.schema([
+        ("user_id", pa.int64()), ("username", pa.string()), ("first_name", pa.string()),
+        ("last_name", pa.string()), ("question", pa.string()), ("answer", pa.string()),
+        ("timestamp", pa.string()), ("rating", pa.int64()), ("comment", pa.string()),
+    ])
+    with pq.ParquetWriter(path, schema) as writer:
+        batch = []
+        for row in rows:
+            summary.add(row)
+            batch.append(row)
+            if len(batch) >= PARQUET_BATCH_ROWS:
+                writer.write_table(pa.Table.from_pylist([dict(zip(schema.names, r)) for r in batch], schema))
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_pylist([dict(zip(schema.names, r)) for r in batch], schema))
+
+
+_WRITERS = {"xlsx": _write_xlsx, "csv": _write_csv, "parquet": _write_parquet}
+
+
+def export_stats(start, end, fmt, path, rows=None):
+    """Выгружает взаимодействия за [start, end) (строки UTC) в файл path. Возвращает StatsSummary"""
+    summary = StatsSummary()
+    rows = iter(rows if rows is not None else iter_admin_stats(start, end))
+    try:
+        _WRITERS[fmt](rows, path, summary)
+    finally:
+        # Досрочно прерванный генератор возвращает соединение в пул
+        close = getattr(rows, "close", None)
+        if close is not None:
+            close()
+    return summary
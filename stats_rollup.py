@@ -0,0 +1,324 @@
+"""Сводные таблицы статистики, которые обновляются вместе с записью взаимодействий.
+
+Ежедневный отчёт читал за период все взаимодействия с полными текстами
+вопросов и ответов и считал счётчики в pandas. Теперь счётчики копятся по
+часам (время взаимодействия в UTC, как в user_interactions) в той же
+транзакции, которая пишет строки, и сводка за N часов читает N строк
+счётчиков, наброски вопросов и пары (час, пользователь) — без текстов:
+
+* stats_hourly — взаимодействия, оценки, сумма оценок, комментарии;
+* stats_user_hourly — вопросы пользователя за час (уникальные и самые активные);
+* stats_users — последние username и имя пользователя для отчёта;
+* stats_question_sketch — частые вопросы часа по алгоритму Space-Saving:
+  не больше QUESTION_SKETCH_SIZE строк на час, сколько бы разных вопросов
+  ни задали. Счётчик вопроса завышен не больше чем на error, а вопрос,
+  который задают чаще 1/QUESTION_SKETCH_SIZE всех вопросов часа, в таблице
+  гарантированно есть.
+
+Оценка и комментарий относятся к часу взаимодействия, а не отзыва — как в
+прежнем отчёте, где отзывы присоединялись к взаимодействиям за период.
+
+Если в базе уже есть взаимодействия, а сводок нет, init_database строит
+их сама; пересобрать сводки вручную:
+    python stats_rollup.py backfill
+"""
+import os
+import time
+import logging
+import argparse
+from collections import Counter, defaultdict
+
+QUESTION_SKETCH_SIZE = int(os.environ.get("STATS_QUESTION_SKETCH", "50"))
+# Вопросы сравниваются по первым символам: отчёт всё равно показывает начало вопроса
+QUESTION_KEY_CHARS = 200
+
+SCHEMA = [
+    '''
+    CREATE TABLE IF NOT EXISTS stats_hourly (
+        hour TEXT PRIMARY KEY,
+        interactions INTEGER NOT NULL DEFAULT 0,
+        ratings INTEGER NOT NULL DEFAULT 0,
+        rating_sum INTEGER NOT NULL DEFAULT 0,
+        comments INTEGER NOT NULL DEFAULT 0
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS stats_user_hourly (
+        hour TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        interactions INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, user_id)
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS stats_users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        first_name TEXT,
+        last_seen TEXT NOT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS stats_question_sketch (
+        hour TEXT NOT NULL,
+        question TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        error INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (hour, question)
+    )
+    ''',
+]
+
+# === Обновление при записи ===
+_INTERACTIONS = 'SELECT user_id, username, first_name, question, timestamp FROM user_interactions WHERE id IN ({})'
+_FEEDBACKS = '''
+    SELECT f.user_id, f.interaction_id, ui.timestamp, f.rating, f.comment
+    FROM feedback f JOIN user_interactions ui ON ui.id = f.interaction_id
+    WHERE f.interaction_id IN ({})
+'''
+_IN_CHUNK = 500
+_FEEDBACK = '''
+    SELECT ui.timestamp, f.rating, f.comment
+    FROM feedback f JOIN user_interactions ui ON ui.id = f.interaction_id
+    WHERE f.user_id = ? AND f.interaction_id = ?
+'''
+_ADD_HOURLY = '''
+    INSERT INTO stats_hourly (hour, interactions, ratings, rating_sum, comments)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(hour) DO UPDATE SET
+        interactions = interactions + excluded.interactions,
+        ratings = ratings + excluded.ratings,
+        rating_sum = rating_sum + excluded.rating_sum,
+        comments = comments + excluded.comments
+'''
+_ADD_USER_HOURLY = '''
+    INSERT INTO stats_user_hourly (hour, user_id, interactions) VALUES (?, ?, ?)
+    ON CONFLICT(hour, user_id) DO UPDATE SET interactions = interactions + excluded.interactions
+'''
+_UPSERT_USER = '''
+    INSERT INTO stats_users (user_id, username, first_name, last_seen) VALUES (?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        username = excluded.username, first_name = excluded.first_name, last_seen = excluded.last_seen
+    WHERE excluded.last_seen >= last_seen
+'''
+_SKETCH_SELECT = 'SELECT question, count, error FROM stats_question_sketch WHERE hour = ?'
+_SKETCH_DELETE = 'DELETE FROM stats_question_sketch WHERE hour = ?'
+_SKETCH_INSERT = 'INSERT INTO stats_question_sketch (hour, question, count, error) VALUES (?, ?, ?, ?)'
+
+# === Чтение ===
+_SUMMARY = '''
+    SELECT COALESCE(SUM(interactions), 0), COALESCE(SUM(ratings), 0),
+           COALESCE(SUM(rating_sum), 0), COALESCE(SUM(comments), 0)
+    FROM stats_hourly WHERE hour >= ?
+'''
+_UNIQUE_USERS = 'SELECT COUNT(DISTINCT user_id) FROM stats_user_hourly WHERE hour >= ?'
+_TOP_USERS = '''
+    SELECT s.user_id, u.username, u.first_name, SUM(s.interactions) AS total
+    FROM stats_user_hourly s LEFT JOIN stats_users u ON u.user_id = s.user_id
+    WHERE s.hour >= ?
+    GROUP BY s.user_id
+    ORDER BY total DESC
+    LIMIT ?
+'''
+_TOP_QUESTIONS = '''
+    SELECT question, SUM(count) AS total
+    FROM stats_question_sketch WHERE hour >= ?
+    GROUP BY question
+    ORDER BY total DESC
+    LIMIT ?
+'''
+_SINCE_HOUR = "SELECT strftime('%Y-%m-%d %H:00:00', 'now', ?)"
+
+# === Построение по существующим данным ===
+_HOUR = "strftime('%Y-%m-%d %H:00:00', {})"
+_BACKFILL = [
+    'DELETE FROM stats_hourly',
+    'DELETE FROM stats_user_hourly',
+    'DELETE FROM stats_users',
+    'DELETE FROM stats_question_sketch',
+    f'''
+    INSERT INTO stats_hourly (hour, interactions, ratings, rating_sum, comments)
+    SELECT {_HOUR.format('ui.timestamp')}, COUNT(DISTINCT ui.id), COUNT(f.rating),
+           COALESCE(SUM(f.rating), 0), COUNT(f.comment)
+    FROM user_interactions ui LEFT JOIN feedback f ON f.interaction_id = ui.id
+    GROUP BY 1
+    ''',
+    f'''
+    INSERT INTO stats_user_hourly (hour, user_id, interactions)
+    SELECT {_HOUR.format('timestamp')}, user_id, COUNT(*)
+    FROM user_interactions
+    GROUP BY 1, 2
+    ''',
+    # Голые столбцы при MAX() в SQLite берутся из строки с максимумом — это последние имена
+    '''
+    INSERT INTO stats_users (user_id, username, first_name, last_seen)
+    SELECT user_id, username, first_name, MAX(timestamp)
+    FROM user_interactions
+    GROUP BY user_id
+    ''',
+    # По готовым данным частоты точные: оставляем QUESTION_SKETCH_SIZE частых вопросов часа
+    f'''
+    INSERT INTO stats_question_sketch (hour, question, count, error)
+    SELECT hour, question, count, 0 FROM (
+        SELECT hour, question, count,
+               ROW_NUMBER() OVER (PARTITION BY hour ORDER BY count DESC) AS rank
+        FROM (
+            SELECT {_HOUR.format('timestamp')} AS hour,
+                   substr(trim(question, char(32, 9, 10, 13)), 1, {QUESTION_KEY_CHARS}) AS question, COUNT(*) AS count
+            FROM user_interactions
+            GROUP BY 1, 2
+        )
+    )
+    WHERE rank <= ?
+    ''',
+]
+
+
+def _hour(timestamp):
+    """'YYYY-MM-DD HH:MM:SS' -> начало часа"""
+    return f"{timestamp[:13]}:00:00"
+
+
+def _question_key(question):
+    return question.strip(" \t\n\r")[:QUESTION_KEY_CHARS]
+
+
+def _add_questions(conn, hour, counts):
+    """Space-Saving: новый вопрос вытесняет самый редкий и наследует его счётчик как погрешность.
+
+    Набросок часа (не больше QUESTION_SKETCH_SIZE строк) читается целиком,
+    обновляется в памяти и переписывается — несколько запросов на пачку.
+    """
+    sketch = {question: [count, error] for question, count, error in conn.execute(_SKETCH_SELECT, (hour,))}
+    for question, count in counts.items():
+        if question in sketch:
+            sketch[question][0] += count
+        elif len(sketch) < QUESTION_SKETCH_SIZE:
+            sketch[question] = [count, 0]
+        else:
+            rare_question = min(sketch, key=lambda q: sketch[q][0])
+            rare_count = sketch.pop(rare_question)[0]
+            sketch[question] = [rare_count + count, rare_count]
+    conn.execute(_SKETCH_DELETE, (hour,))
+    conn.executemany(_SKETCH_INSERT, [(hour, question, count, error) for question, (count, error) in sketch.items()])
+
+
+def _select_in(conn, sql, keys):
+    """Строки по списку ключей порциями, чтобы не упереться в лимит параметров SQLite"""
+    for i in range(0, len(keys), _IN_CHUNK):
+        chunk = keys[i:i + _IN_CHUNK]
+        yield from conn.execute(sql.format(", ".join("?" * len(chunk))), chunk)
+
+
+class RollupBatch:
+    """Взаимодействия и оценки одной транзакции записи.
+
+    Счётчики сначала складываются в памяти, затем apply() пишет по одному
+    UPSERT на час, пользователя и вопрос, а не на каждую строку.
+    """
+
+    def __init__(self):
+        self.interactions = []
+        self.feedback = set()
+
+    def __bool__(self):
+        return bool(self.interactions or self.feedback)
+
+    def add_interaction(self, interaction_id):
+        self.interactions.append(interaction_id)
+
+    def add_feedback(self, user_id, interaction_id):
+        self.feedback.add((user_id, interaction_id))
+
+    def apply(self, conn):
+        """Обновляет сводки в текущей транзакции (после записи самих строк)"""
+        hourly = defaultdict(lambda: [0, 0, 0, 0])
+        users_hourly = Counter()
+        questions = defaultdict(Counter)
+        users = {}
+        for user_id, username, first_name, question, timestamp in _select_in(conn, _INTERACTIONS, self.interactions):
+            hour = _hour(timestamp)
+            hourly[hour][0] += 1
+            users_hourly[hour, user_id] += 1
+            questions[hour][_question_key(question)] += 1
+            if user_id not in users or users[user_id][3] <= timestamp:
+                users[user_id] = (user_id, username, first_name, timestamp)
+        interaction_ids = [interaction_id for _, interaction_id in self.feedback]
+        for user_id, interaction_id, timestamp, rating, comment in _select_in(conn, _FEEDBACKS, interaction_ids):
+            if (user_id, interaction_id) in self.feedback:
+                counters = hourly[_hour(timestamp)]
+                counters[1] += 1
+                counters[2] += rating
+                counters[3] += comment is not None
+
+        conn.executemany(_ADD_HOURLY, [(hour, *counters) for hour, counters in hourly.items()])
+        conn.executemany(_ADD_USER_HOURLY, [(hour, user_id, n) for (hour, user_id), n in users_hourly.items()])
+        conn.executemany(_UPSERT_USER, users.values())
+        for hour, counts in questions.items():
+            _add_questions(conn, hour, counts)
+
+
+def record_comment(conn, user_id, interaction_id, comment, batch=None):
+    """Учитывает комментарий к оценке; вызывается до UPDATE, пока виден прежний комментарий.
+
+    Оценку из той же пачки batch учтёт вместе с итоговым комментарием.
+    """
+    if comment is None or (batch is not None and (user_id, interaction_id) in batch.feedback):
+        return
+    row = conn.execute(_FEEDBACK, (user_id, interaction_id)).fetchone()
+    if row is None or row[2] is not None:
+        return
+    conn.execute(_ADD_HOURLY, (_hour(row[0]), 0, 0, 0, 1))
+
+
+def read_summary(conn, hours=24, top=3):
+    """Сводка за последние hours часов (начиная с часа, в который попадает начало периода)"""
+    since = conn.execute(_SINCE_HOUR, (f"-{int(hours)} hours",)).fetchone()[0]
+    interactions, ratings, rating_sum, comments = conn.execute(_SUMMARY, (since,)).fetchone()
+    return {
+        "interactions": interactions,
+        "users": conn.execute(_UNIQUE_USERS, (since,)).fetchone()[0],
+        "ratings": ratings,
+        "rating_sum": rating_sum,
+        "comments": comments,
+        "top_users": conn.execute(_TOP_USERS, (since, top)).fetchall(),
+        "top_questions": conn.execute(_TOP_QUESTIONS, (since, top)).fetchall(),
+    }
+
+
+def needs_backfill(conn):
+    """Взаимодействия есть, а сводок нет (база создана до появления сводок)"""
+    has_rollups = conn.execute('SELECT 1 FROM stats_hourly LIMIT 1').fetchone()
+    has_interactions = conn.execute('SELECT 1 FROM user_interactions LIMIT 1').fetchone()
+    return has_interactions is not None and has_rollups is None
+
+
+def backfill(conn):
+    """Пересобирает сводки по user_interactions и feedback. Возвращает число часов"""
+    for statement in _BACKFILL:
+        conn.execute(statement, (QUESTION_SKETCH_SIZE,) if "?" in statement else ())
+    return conn.execute('SELECT COUNT(*) FROM stats_hourly').fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сводные таблицы статистики бота")
+    parser.add_argument("command", choices=["backfill"], help="backfill — пересобрать сводки по всей БД")
+    parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    import storage
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    started = time.perf_counter()
+    # Транзакция на запись держит блокировку БД: работающий бот подождёт и
+    # допишет свои взаимодействия уже поверх новых сводок
+    with storage.pool.transaction() as conn:
+        for statement in storage._SCHEMA:
+            conn.execute(statement)
+        hours = backfill(conn)
+    logging.info(f"Сводки пересобраны в {storage.DB_PATH}: {hours} ч за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,580 @@
+"""Хранилище взаимодействий и обратной связи (SQLite).
+
+Соединения долгоживущие и берутся из пула, база работает в режиме WAL:
+читатели не блокируют писателя, а коммит не требует fsync всего файла.
+SQL-запросы — константы модуля, поэтому sqlite3 переиспользует
+подготовленные выражения из своего кэша. Асинхронные обёртки выполняют
+запросы в отдельном пуле потоков, не блокируя event loop бота.
+В той же транзакции, что пишет взаимодействия и оценки, обновляются
+почасовые сводки статистики (stats_rollup).
+"""
+import os
+import time
+import queue
+import asyncio
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+import stats_rollup
+
+DB_PATH = os.environ.get("DB_PATH", "bot_feedback.db")
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "4"))
+# Отложенная запись: пачка сбрасывается по числу строк или по таймеру
+WRITE_BEHIND_BATCH = int(os.environ.get("WRITE_BEHIND_BATCH", "100"))
+WRITE_BEHIND_INTERVAL_MS = int(os.environ.get("WRITE_BEHIND_INTERVAL_MS", "200"))
+# Сколько id взаимодействий резервируется в БД за раз
+ID_BLOCK_SIZE = 1000
+# Сколько ждать следующий блок id от фонового потока, если запас кончился, сек
+ID_BLOCK_WAIT = 10
+# Просьба фоновому потоку записи зарезервировать следующий блок id
+_RESERVE_REQUEST = object()
+
+DB_WRITE_SECONDS = metrics.histogram(
+    "bot_db_write_seconds", "Запись пачки отложенной записи в БД (транзакция со сводками)")
+DB_WRITE_OPERATIONS = metrics.counter("bot_db_write_operations_total", "Операции отложенной записи", ("result",))
+
+# === Схема ===
+_SCHEMA = [
+    # Таблица для отслеживания взаимодействий пользователей
+    '''
+    CREATE TABLE IF NOT EXISTS user_interactions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        username TEXT,
+        first_name TEXT,
+        last_name TEXT,
+        question TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        session_id TEXT,
+        feedback_given BOOLEAN DEFAULT FALSE
+    )
+    ''',
+    # Таблица для обратной связи
+    '''
+    CREATE TABLE IF NOT EXISTS feedback (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        interaction_id INTEGER NOT NULL,
+        rating INTEGER NOT NULL CHECK (rating >= 1 AND rating <= 5),
+        comment TEXT,
+        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (interaction_id) REFERENCES user_interactions (id),
+        UNIQUE(user_id, interaction_id)
+    )
+    ''',
+    # Статистика выбирает диапазоны по времени, в том числе по конкретному пользователю
+    'CREATE INDEX IF NOT EXISTS idx_user_interactions_timestamp ON user_interactions (timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_user_interactions_user_timestamp ON user_interactions (user_id, timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_feedback_interaction ON feedback (interaction_id)',
+    # Зарезервированные блоки id: id выдаются до записи строки, в том числе несколькими процессами
+    '''
+    CREATE TABLE IF NOT EXISTS id_reservations (
+        name TEXT PRIMARY KEY,
+        next_id INTEGER NOT NULL
+    )
+    ''',
+    # Почасовые сводки для отчётов (см. stats_rollup)
+    *stats_rollup.SCHEMA,
+]
+
+# === Запросы ===
+_INSERT_INTERACTION = '''
+    INSERT INTO user_interactions (user_id, username, first_name, last_name, question, answer, session_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+_INSERT_FEEDBACK = '''
+    INSERT INTO feedback (user_id, interaction_id, rating, comment)
+    VALUES (?, ?, ?, ?)
+'''
+_INSERT_INTERACTION_WITH_ID = '''
+    INSERT INTO user_interactions (id, user_id, username, first_name, last_name, question, answer, session_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+# Повторная оценка того же ответа не должна откатывать всю пачку
+_INSERT_FEEDBACK_OR_IGNORE = '''
+    INSERT OR IGNORE INTO feedback (user_id, interaction_id, rating, comment)
+    VALUES (?, ?, ?, ?)
+'''
+_RESERVE_IDS_INIT = '''
+    INSERT OR IGNORE INTO id_reservations (name, next_id)
+    VALUES ('user_interactions', 1)
+'''
+# next_id не может отставать от реально записанных строк (например, вставленных без резерва)
+_RESERVE_IDS = '''
+    UPDATE id_reservations
+    SET next_id = MAX(next_id, (SELECT COALESCE(MAX(id), 0) + 1 FROM user_interactions)) + ?
+    WHERE name = 'user_interactions'
+'''
+_RESERVED_NEXT_ID = "SELECT next_id FROM id_reservations WHERE name = 'user_interactions'"
+_MARK_FEEDBACK_GIVEN = 'UPDATE user_interactions SET feedback_given = TRUE WHERE id = ?'
+_UPDATE_FEEDBACK_COMMENT = 'UPDATE feedback SET comment = ? WHERE interaction_id = ? AND user_id = ?'
+_COUNT_USER_INTERACTIONS = '''
+    SELECT COUNT(*) FROM user_interactions
+    WHERE user_id = ? AND timestamp >= datetime('now', ?)
+'''
+_HAS_FEEDBACK = 'SELECT 1 FROM feedback WHERE user_id = ? AND interaction_id = ? LIMIT 1'
+_ADMIN_STATS = '''
+    SELECT
+        ui.user_id,
+        ui.username,
+        ui.first_name,
+        ui.last_name,
+        ui.question,
+        ui.answer,
+        ui.timestamp,
+        f.rating,
+        f.comment
+    FROM user_interactions ui
+    LEFT JOIN feedback f ON ui.id = f.interaction_id
+    WHERE ui.timestamp >= datetime('now', ?)
+    ORDER BY ui.timestamp DESC
+'''
+# То же за произвольный период [начало, конец) — для выгрузки, строки читаются курсором
+_ADMIN_STATS_RANGE = '''
+    SELECT
+        ui.user_id,
+        ui.username,
+        ui.first_name,
+        ui.last_name,
+        ui.question,
+        ui.answer,
+        ui.timestamp,
+        f.rating,
+        f.comment
+    FROM user_interactions ui
+    LEFT JOIN feedback f ON ui.id = f.interaction_id
+    WHERE ui.timestamp >= ? AND ui.timestamp < ?
+    ORDER BY ui.timestamp DESC
+'''
+
+
+def _days_modifier(days):
+    return f"-{int(days)} days"
+
+
+def _execute(conn, sql, params, rollup):
+    """Выполняет запись; взаимодействия и оценки для сводок статистики копятся в rollup"""
+    if sql is _UPDATE_FEEDBACK_COMMENT:
+        try:
+            stats_rollup.record_comment(conn, params[2], params[1], params[0], rollup)
+        except sqlite3.Error as e:
+            logging.error(f"Не удалось обновить сводки статистики: {e}")
+    cursor = conn.execute(sql, params)
+    if sql is _INSERT_INTERACTION_WITH_ID:
+        rollup.add_interaction(params[0])
+    elif sql is _INSERT_INTERACTION:
+        rollup.add_interaction(cursor.lastrowid)
+    elif sql is _INSERT_FEEDBACK or (sql is _INSERT_FEEDBACK_OR_IGNORE and cursor.rowcount == 1):
+        rollup.add_feedback(params[0], params[1])
+    return cursor
+
+
+@contextmanager
+def _rollup(conn):
+    """Пачка для сводок: применяется в конце транзакции записи"""
+    rollup = stats_rollup.RollupBatch()
+    yield rollup
+    if rollup:
+        # Ошибка сводок не должна терять сами записи: сводки можно пересобрать
+        try:
+            rollup.apply(conn)
+        except sqlite3.Error as e:
+            logging.error(f"Не удалось обновить сводки статистики: {e}")
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений SQLite в режиме WAL.
+
+    Соединения создаются лениво, не больше size штук. Запись в SQLite всегда
+    однопоточная, поэтому транзакции на запись дополнительно сериализуются
+    внутри процесса, чтобы не упираться в SQLITE_BUSY.
+    """
+
+    def __init__(self, path=DB_PATH, size=DB_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, cached_statements=64)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # В режиме WAL NORMAL безопасен при сбое процесса и не делает fsync на каждый коммит
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+        return self._idle.get()
+
+    @contextmanager
+    def connection(self):
+        """Соединение для чтения"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Соединение для записи: коммит при успехе, откат при ошибке"""
+        with self._write_lock, self.connection() as conn:
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    def close(self):
+        """Закрывает все простаивающие соединения"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
+
+
+class WriteBehindLog:
+    """Отложенная запись взаимодействий и обратной связи.
+
+    Записи копятся в памяти и сбрасываются фоновым потоком одной транзакцией
+    каждые batch_size строк или flush_interval секунд. id взаимодействия
+    выдаётся сразу из заранее зарезервированного в БД блока, поэтому ответ
+    пользователю не ждёт ни INSERT, ни коммита. Следующий блок резервирует
+    фоновый поток, когда израсходована половина текущего; вызывающий поток
+    сам в БД не пишет, а если запас всё же кончился — ждёт фоновый поток.
+    """
+
+    def __init__(self, pool, batch_size=WRITE_BEHIND_BATCH,
+                 flush_interval=WRITE_BEHIND_INTERVAL_MS / 1000, id_block=ID_BLOCK_SIZE):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.id_block = id_block
+        self._queue = queue.Queue()
+        self._thread = None
+        self._ids_lock = threading.Lock()
+        self._next_id = 0
+        self._block_end = 0
+        # Следующий блок id, который фоновый поток резервирует заранее
+        self._spare_block = None
+        self._spare_requested = False
+        self._spare_ready = threading.Condition(self._ids_lock)
+        # Оценки, ещё не записанные в БД: (user_id, interaction_id)
+        self._pending_feedback = set()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._next_id, self._block_end = self._reserve_block()
+        self._thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+        self._thread.start()
+
+    def _reserve_block(self):
+        with self.pool.transaction() as conn:
+            conn.execute(_RESERVE_IDS_INIT)
+            conn.execute(_RESERVE_IDS, (self.id_block,))
+            end = conn.execute(_RESERVED_NEXT_ID).fetchone()[0]
+        return end - self.id_block, end
+
+    def _allocate_id(self):
+        with self._ids_lock:
+            if self._next_id >= self._block_end:
+                self._next_id, self._block_end = self._take_spare_block()
+            interaction_id = self._next_id
+            self._next_id += 1
+            # С середины блока фоновый поток заранее резервирует следующий
+            if self._block_end - self._next_id <= self.id_block // 2:
+                self._request_spare()
+            return interaction_id
+
+    def _request_spare(self):
+        """Просит фоновый поток зарезервировать следующий блок; вызывается под _ids_lock"""
+        if self._spare_block is None and not self._spare_requested:
+            self._spare_requested = True
+            self._queue.put(_RESERVE_REQUEST)
+
+    def _take_spare_block(self):
+        """Забирает заранее зарезервированный блок; вызывается под _ids_lock"""
+        if self._thread is None or not self._thread.is_alive():
+            # Фонового потока нет (до start или после close) — резервировать больше некому
+            return self._reserve_block()
+        self._request_spare()
+        if not self._spare_ready.wait_for(lambda: self._spare_block is not None, timeout=ID_BLOCK_WAIT):
+            raise RuntimeError("Фоновый поток не зарезервировал id взаимодействий")
+        block, self._spare_block = self._spare_block, None
+        return block
+
+    def _reserve_spare(self):
+        try:
+            block = self._reserve_block()
+        except Exception as e:
+            # Просьба остаётся в силе: фоновый поток повторит попытку через flush_interval
+            logging.error(f"Не удалось зарезервировать id взаимодействий: {e}")
+            return
+        with self._ids_lock:
+            self._spare_block = block
+            self._spare_requested = False
+            self._spare_ready.notify_all()
+
+    def log_interaction(self, user_id, username, first_name, last_name, question, answer, session_id=None):
+        """Ставит взаимодействие в очередь на запись и сразу возвращает его id"""
+        interaction_id = self._allocate_id()
+        self._queue.put((_INSERT_INTERACTION_WITH_ID, (
+            interaction_id, user_id, username, first_name, last_name, question, answer, session_id,
+        )))
+        return interaction_id
+
+    def log_feedback(self, user_id, interaction_id, rating, comment):
+        with self._ids_lock:
+            self._pending_feedback.add((user_id, interaction_id))
+        self._queue.put((_INSERT_FEEDBACK_OR_IGNORE, (user_id, interaction_id, rating, comment)))
+        self._queue.put((_MARK_FEEDBACK_GIVEN, (interaction_id,)))
+
+    def log_feedback_comment(self, user_id, interaction_id, comment):
+        self._queue.put((_UPDATE_FEEDBACK_COMMENT, (comment, interaction_id, user_id)))
+
+    def has_pending_feedback(self, user_id, interaction_id):
+        with self._ids_lock:
+            return (user_id, interaction_id) in self._pending_feedback
+
+    def flush(self, timeout=None):
+        """Дожидается записи всего, что было поставлено в очередь до вызова"""
+        if self._thread is None or not self._thread.is_alive():
+            return False
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=10):
+        """Сбрасывает остаток очереди и останавливает фоновый поток"""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval if self._spare_requested else None)
+            except queue.Empty:
+                item = _RESERVE_REQUEST
+            batch, waiters = [], []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                elif item is not _RESERVE_REQUEST:
+                    batch.append(item)
+                if stopping or waiters or item is _RESERVE_REQUEST or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            # При остановке дописываем всё, что успели поставить в очередь
+            while stopping:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                elif item is not None and item is not _RESERVE_REQUEST:
+                    batch.append(item)
+
+            if batch:
+                self._write(batch)
+            for waiter in waiters:
+                waiter.set()
+            if self._spare_requested and not stopping:
+                self._reserve_spare()
+
+    def _write(self, batch):
+        started = time.perf_counter()
+        try:
+            with self.pool.transaction() as conn, _rollup(conn) as rollup:
+                for sql, params in batch:
+                    _execute(conn, sql, params, rollup)
+            DB_WRITE_OPERATIONS.inc("ok", amount=len(batch))
+        except Exception as e:
+            # Одна плохая строка не должна терять всю пачку — пишем по одной
+            logging.error(f"Ошибка пакетной записи в БД ({len(batch)} операций), пишу по одной: {e}")
+            for sql, params in batch:
+                try:
+                    with self.pool.transaction() as conn, _rollup(conn) as rollup:
+                        _execute(conn, sql, params, rollup)
+                    DB_WRITE_OPERATIONS.inc("ok")
+                except Exception as row_error:
+                    DB_WRITE_OPERATIONS.inc("error")
+                    logging.error(f"Не удалось записать в БД: {row_error}")
+        DB_WRITE_SECONDS.observe(time.perf_counter() - started)
+        with self._ids_lock:
+            for sql, params in batch:
+                if sql is _INSERT_FEEDBACK_OR_IGNORE:
+                    self._pending_feedback.discard((params[0], params[1]))
+
+
+pool = ConnectionPool()
+write_log = WriteBehindLog(pool)
+_db_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="db")
+
+
+def init_database():
+    with pool.transaction() as conn:
+        for statement in _SCHEMA:
+            conn.execute(statement)
+        if stats_rollup.needs_backfill(conn):
+            hours = stats_rollup.backfill(conn)
+            logging.info(f"Построены сводки статистики по существующим взаимодействиям: {hours} ч")
+
+
+# === Вспомогательные функции для работы с БД ===
+def save_interaction(user_id, username, first_name, last_name, question, answer, session_id=None):
+    with pool.transaction() as conn, _rollup(conn) as rollup:
+        cursor = _execute(
+            conn, _INSERT_INTERACTION,
+            (user_id, username, first_name, last_name, question, answer, session_id), rollup,
+        )
+        return cursor.lastrowid
+
+
+def save_feedback(user_id, interaction_id, rating, comment):
+    with pool.transaction() as conn, _rollup(conn) as rollup:
+        _execute(conn, _INSERT_FEEDBACK, (user_id, interaction_id, rating, comment), rollup)
+        # Отмечаем, что обратная связь была дана
+        conn.execute(_MARK_FEEDBACK_GIVEN, (interaction_id,))
+
+
+def save_feedback_comment(user_id, interaction_id, comment):
+    with pool.transaction() as conn, _rollup(conn) as rollup:
+        _execute(conn, _UPDATE_FEEDBACK_COMMENT, (comment, interaction_id, user_id), rollup)
+
+
+def get_user_interaction_count(user_id, days=30):
+    with pool.connection() as conn:
+        return conn.execute(_COUNT_USER_INTERACTIONS, (user_id, _days_modifier(days))).fetchone()[0]
+
+
+def has_given_feedback(user_id, interaction_id):
+    if write_log.has_pending_feedback(user_id, interaction_id):
+        return True
+    with pool.connection() as conn:
+        return conn.execute(_HAS_FEEDBACK, (user_id, interaction_id)).fetchone() is not None
+
+
+def has_low_rating(interaction_ids, max_rating):
+    """Есть ли среди оценок этих взаимодействий оценка не выше max_rating"""
+    if not interaction_ids:
+        return False
+    placeholders = ", ".join("?" * len(interaction_ids))
+    with pool.connection() as conn:
+        row = conn.execute(
+            f'SELECT 1 FROM feedback WHERE rating <= ? AND interaction_id IN ({placeholders}) LIMIT 1',
+            (max_rating, *interaction_ids),
+        ).fetchone()
+    return row is not None
+
+
+def get_admin_stats(days=30):
+    # pandas нужен только этой выгрузке — не импортируем его при старте бота
+    import pandas as pd
+
+    # Статистика должна учитывать и ещё не сброшенные отложенные записи
+    write_log.flush(timeout=5)
+    # Получаем статистику за последние N дней
+    with pool.connection() as conn:
+        return pd.read_sql_query(_ADMIN_STATS, conn, params=(_days_modifier(days),))
+
+
+def get_stats_summary(hours=24):
+    """Счётчики и топы за последние hours часов из почасовых сводок (см. stats_rollup.read_summary)"""
+    write_log.flush(timeout=5)
+    with pool.connection() as conn:
+        return stats_rollup.read_summary(conn, hours)
+
+
+def iter_admin_stats(start, end, batch_size=1000):
+    """Построчно отдаёт взаимодействия с оценками за [start, end) (строки 'YYYY-MM-DD HH:MM:SS', UTC).
+
+    Соединение из пула занято, пока генератор не исчерпан или не закрыт.
+    """
+    write_log.flush(timeout=5)
+    with pool.connection() as conn:
+        cursor = conn.execute(_ADMIN_STATS_RANGE, (start, end))
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
+
+
+def run_maintenance():
+    """Обслуживание БД: статистика планировщика запросов SQLite и усечение WAL"""
+    write_log.flush(timeout=30)
+    with pool.connection() as conn:
+        conn.execute("PRAGMA optimize")
+        busy, wal_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    return {"busy": bool(busy), "wal_pages": wal_pages, "checkpointed": checkpointed}
+
+
+# === Асинхронные обёртки: запросы выполняются вне event loop ===
+async def run_db(func, *args):
+    """Выполняет функцию работы с БД в пуле потоков хранилища"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, func, *args)
+
+
+async def aget_user_interaction_count(user_id, days=30):
+    return await run_db(get_user_interaction_count, user_id, days)
+
+
+async def ahas_given_feedback(user_id, interaction_id):
+    return await run_db(has_given_feedback, user_id, interaction_id)
+
+
+async def aget_admin_stats(days=30):
+    return await run_db(get_admin_stats, days)
+
+
+async def aget_stats_summary(hours=24):
+    return await run_db(get_stats_summary, hours)
+
+
+def close_storage():
+    """Дописывает отложенные записи, завершает пул потоков и закрывает соединения"""
+    write_log.close()
+    _db_executor.shutdown(wait=True)
+    pool.close()
+    logging.info("Соединения с БД закрыты")
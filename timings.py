@@ -0,0 +1,41 @@
+"""Замер длительности этапов обработки одного сообщения.
+
+Этапы (поиск в кэше, локальный поиск, docs.cntd.ru, запрос к модели,
+отправка ответа) записываются по имени; в лог уходит одна строка на ответ,
+по которой видно, куда ушло время.
+"""
+import time
+from contextlib import contextmanager
+
+
+class StageTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        # имя этапа -> длительность, сек (в порядке записи)
+        self.stages = {}
+        self.timed_out = set()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds, timed_out=False):
+        self.stages[name] = seconds
+        if timed_out:
+            self.timed_out.add(name)
+
+    def total(self):
+        return time.perf_counter() - self.started
+
+    def trace(self, **fields):
+        """Запись для структурированного лога: этапы и итог в миллисекундах плюс поля вызывающего"""
+        record = {"stages_ms": {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()}}
+        if self.timed_out:
+            record["timed_out"] = sorted(self.timed_out)
+        record["total_ms"] = round(self.total() * 1000, 1)
+        record.update(fields)
+        return record
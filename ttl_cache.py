@@ -0,0 +1,208 @@
+"""Ограниченный кэш с TTL и вытеснением LRU, с необязательным дисковым уровнем (SQLite).
+
+Первый уровень — OrderedDict в памяти процесса, второй — таблица SQLite,
+которая переживает перезапуск и общая для воркеров на одной машине.
+Значения дискового уровня хранятся в JSON.
+"""
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """LRU-кэш в памяти с временем жизни записей и счётчиками попаданий"""
+
+    def __init__(self, maxsize=256, ttl=3600.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def evict_expired(self):
+        """Удаляет просроченные записи. Возвращает их число"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (_, expires_at) in self._data.items() if expires_at <= now]
+            for key in expired:
+                del self._data[key]
+        return len(expired)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class SQLiteCacheTier:
+    """Дисковый уровень кэша: таблица (namespace, key) -> JSON со сроком жизни"""
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_expires_at ON cache (expires_at)')
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def get(self, namespace, key):
+        found = self.get_with_ttl(namespace, key)
+        return found[0] if found else None
+
+    def get_with_ttl(self, namespace, key):
+        """(значение, сколько секунд ему осталось жить) или None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, expires_at FROM cache WHERE namespace = ? AND key = ? AND expires_at > ?',
+                (namespace, key, now),
+            ).fetchone()
+        return (json.loads(row[0]), row[1] - now) if row else None
+
+    def set(self, namespace, key, value, ttl):
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO cache (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)',
+                (namespace, key, json.dumps(value, ensure_ascii=False), time.time() + ttl),
+            )
+            self._conn.commit()
+
+    def evict_expired(self):
+        """Удаляет просроченные записи и самые старые сверх max_entries"""
+        with self._lock:
+            removed = self._conn.execute('DELETE FROM cache WHERE expires_at <= ?', (time.time(),)).rowcount
+            removed += self._conn.execute('''
+                DELETE FROM cache WHERE rowid IN (
+                    SELECT rowid FROM cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?
+                )
+            ''', (self.max_entries,)).rowcount
+            self._conn.commit()
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TieredCache:
+    """Кэш в памяти с необязательным дисковым уровнем.
+
+    При промахе в памяти значение ищется на диске и поднимается в память
+    на оставшийся срок дисковой записи, а не на новый полный TTL.
+    Асинхронные методы обращаются к диску в пуле потоков.
+    """
+
+    def __init__(self, namespace, maxsize=256, ttl=3600.0, disk=None):
+        self.namespace = namespace
+        self.memory = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.disk = disk
+        self.disk_hits = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+        return self._disk_get(key)
+
+    def set(self, key, value, ttl=None):
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            self._disk_set(key, value, ttl)
+
+    async def aget(self, key):
+        value = self.memory.get(key)
+        if value is not None or self.disk is None:
+            return value
+        # На диск идём в потоке, не блокируя event loop
+        return await asyncio.to_thread(self._disk_get, key)
+
+    async def aset(self, key, value, ttl=None):
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            await asyncio.to_thread(self._disk_set, key, value, ttl)
+
+    def _disk_get(self, key):
+        try:
+            found = self.disk.get_with_ttl(self.namespace, key)
+        except sqlite3.Error as e:
+            logging.warning(f"Ошибка чтения дискового кэша {self.namespace}: {e}")
+            return None
+        if found is None:
+            return None
+        value, remaining = found
+        self.disk_hits += 1
+        self.memory.set(key, value, min(self.memory.ttl, remaining))
+        return value
+
+    def _disk_set(self, key, value, ttl):
+        try:
+            self.disk.set(self.namespace, key, value, self.memory.ttl if ttl is None else ttl)
+        except sqlite3.Error as e:
+            logging.warning(f"Ошибка записи дискового кэша {self.namespace}: {e}")
+
+    def evict_expired(self):
+        removed = self.memory.evict_expired()
+        if self.disk is not None:
+            removed += self.disk.evict_expired()
+        return removed
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats["disk_hits"] = self.disk_hits
+        # Промах — это промах обоих уровней
+        stats["misses"] -= self.disk_hits
+        lookups = stats["hits"] + self.disk_hits + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + self.disk_hits) / lookups if lookups else 0.0
+        return stats
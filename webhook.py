@@ -0,0 +1,104 @@
+"""Асинхронный сервер вебхука Telegram на aiohttp.
+
+Вебхук только разбирает апдейт и кладёт его в очередь Application, сразу
+отвечая Telegram 200. Порт открывается сразу: Application (с getMe к
+Bot API) запускается в фоне, и апдейты до его запуска ждут в очереди.
+Обработка идёт в фоне на том же event loop, число одновременно
+обрабатываемых апдейтов ограничено concurrent_updates.
+"""
+import os
+import asyncio
+import logging
+
+from aiohttp import web
+from telegram import Update
+from telegram.error import NetworkError
+
+import metrics
+
+# Максимум апдейтов, ожидающих обработки; при переполнении отвечаем 503,
+# и Telegram повторит доставку позже
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", "1000"))
+# Сколько апдейтов обрабатывается одновременно
+MAX_CONCURRENT_UPDATES = int(os.environ.get("MAX_CONCURRENT_UPDATES", "32"))
+
+WEBHOOK_UPDATES = metrics.counter("bot_webhook_updates_total", "Апдейты, пришедшие на вебхук", ("result",))
+_STARTUP_TASK = web.AppKey("application_startup", asyncio.Task)
+
+
+def _log_startup_failure(task):
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Не удалось запустить Application: {task.exception()}")
+
+
+def create_web_app(application, token):
+    """Создаёт aiohttp-приложение с маршрутами /<token>, /health и /metrics"""
+    app = web.Application()
+
+    async def telegram_webhook(request):
+        if request.match_info["token"] != token:
+            return web.Response(text="Forbidden", status=403)
+        try:
+            data = await request.json()
+            # Апдейт — JSON-объект; на остальное 400, иначе Telegram повторял бы его после 500
+            if not isinstance(data, dict):
+                raise ValueError(f"ожидался объект, получен {type(data).__name__}")
+            update = Update.de_json(data, application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logging.warning(f"Некорректный апдейт на вебхуке: {e!r}")
+            WEBHOOK_UPDATES.inc("bad_request")
+            return web.Response(text="Bad Request", status=400)
+
+        try:
+            application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logging.warning("Очередь апдейтов переполнена, Telegram повторит доставку")
+            WEBHOOK_UPDATES.inc("queue_full")
+            return web.Response(text="Busy", status=503)
+        WEBHOOK_UPDATES.inc("accepted")
+        return web.Response(text="OK")
+
+    async def health(request):
+        return web.Response(text="OK")
+
+    async def metrics_endpoint(request):
+        return web.Response(
+            body=metrics.render().encode("utf-8"),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    async def start_application():
+        delay = 1.0
+        while True:
+            try:
+                # initialize() делает getMe — сетевой запрос к Telegram
+                await application.initialize()
+                break
+            except NetworkError as e:
+                logging.warning(f"Bot API недоступен ({e}), повтор через {delay:.0f} с")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+        await application.start()
+        logging.info("Application запущен, апдейты принимаются через вебхук")
+
+    async def on_startup(app):
+        # aiohttp открывает порт только после on_startup: Application запускается в фоне,
+        # а пришедшие раньше апдейты ждут его в update_queue
+        app[_STARTUP_TASK] = asyncio.create_task(start_application())
+        app[_STARTUP_TASK].add_done_callback(_log_startup_failure)
+
+    async def on_cleanup(app):
+        task = app[_STARTUP_TASK]
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics_endpoint)
+    app.router.add_post("/{token}", telegram_webhook)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app